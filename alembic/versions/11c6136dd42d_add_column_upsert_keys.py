@@ -0,0 +1,94 @@
+"""add column upsert keys
+
+Revision ID: 11c6136dd42d
+Revises: fb506e6aba8d
+Create Date: 2019-06-12 13:40:27.551804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '11c6136dd42d'
+down_revision = 'fb506e6aba8d'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+# Columns profiled more than once for the same Data Table, except the latest.
+DUPLICATE_COLUMN_IDS = """
+    SELECT column_id
+    FROM (
+        SELECT
+            column_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY data_table_id, column_name
+                ORDER BY column_id DESC
+            ) AS profile_rank
+        FROM metabase.column_info
+    ) AS ranked_column_info
+    WHERE profile_rank > 1
+"""
+
+
+def upgrade():
+    '''Remove duplicate columns and add the keys re-profiling upserts on.'''
+
+    for table_name in ['numeric_column', 'text_column', 'date_column',
+                       'code_frequency', 'histogram_bin', 'column_info']:
+        op.execute(
+            'DELETE FROM {}.{} WHERE column_id IN ({})'.format(
+                SCHEMA_NAME,
+                table_name,
+                DUPLICATE_COLUMN_IDS,
+            )
+        )
+
+    op.create_unique_constraint(
+        'column_info_data_table_column_name_key',
+        'column_info',
+        ['data_table_id', 'column_name'],
+        schema=SCHEMA_NAME,
+    )
+
+    # A unique index does not treat NULL codes as equal, so the NULL code of
+    # a column has an index of its own.
+    op.create_index(
+        'code_frequency_column_code_idx',
+        'code_frequency',
+        ['column_id', 'code'],
+        unique=True,
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text('code IS NOT NULL'),
+    )
+    op.create_index(
+        'code_frequency_column_null_code_idx',
+        'code_frequency',
+        ['column_id'],
+        unique=True,
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text('code IS NULL'),
+    )
+
+
+def downgrade():
+    '''Drop the keys re-profiling upserts on.'''
+
+    op.drop_index(
+        'code_frequency_column_null_code_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+    op.drop_index(
+        'code_frequency_column_code_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_constraint(
+        'column_info_data_table_column_name_key',
+        'column_info',
+        schema=SCHEMA_NAME,
+    )
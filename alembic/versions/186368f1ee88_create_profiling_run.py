@@ -0,0 +1,50 @@
+"""create profiling run
+
+Revision ID: 186368f1ee88
+Revises: 242e365ff0a4
+Create Date: 2019-05-28 16:12:05.718442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '186368f1ee88'
+down_revision = '242e365ff0a4'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Create the table holding per-stage metrics of extraction runs.'''
+
+    # No foreign key on data_table_id: metrics of failed runs are kept even
+    # when the data_table_id is invalid.
+    op.create_table(
+        'profiling_run',
+        sa.Column('metric_id', sa.Integer, primary_key=True),
+        sa.Column('run_id', sa.Text),
+        sa.Column('data_table_id', sa.Integer),
+        # NULL for table-level stages.
+        sa.Column('column_name', sa.Text),
+        sa.Column('stage', sa.Text),
+        sa.Column('run_started_at', sa.TIMESTAMP),
+        sa.Column('wall_seconds', sa.Float),
+        sa.Column('execute_seconds', sa.Float),
+        sa.Column('fetch_seconds', sa.Float),
+        sa.Column('rows_fetched', sa.BigInteger),
+        sa.Column('bytes_fetched', sa.BigInteger),
+        sa.Column('queries_issued', sa.Integer),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+
+def downgrade():
+    '''Drop the profiling run table.'''
+
+    op.drop_table('profiling_run', schema=SCHEMA_NAME)
@@ -0,0 +1,53 @@
+"""add column profile statistics
+
+Revision ID: 242e365ff0a4
+Revises: 2967eb4e8e6b
+Create Date: 2019-05-20 09:47:52.302913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '242e365ff0a4'
+down_revision = '2967eb4e8e6b'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Add null, non-null and distinct counts and standard deviation.'''
+
+    op.add_column(
+        'column_info',
+        sa.Column('missing_count', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+    op.add_column(
+        'column_info',
+        sa.Column('non_null_count', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+    op.add_column(
+        'column_info',
+        sa.Column('distinct_count', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+
+    op.add_column(
+        'numeric_column',
+        sa.Column('std', sa.Numeric),
+        schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop null, non-null and distinct counts and standard deviation.'''
+
+    op.drop_column('numeric_column', 'std', schema=SCHEMA_NAME)
+    op.drop_column('column_info', 'distinct_count', schema=SCHEMA_NAME)
+    op.drop_column('column_info', 'non_null_count', schema=SCHEMA_NAME)
+    op.drop_column('column_info', 'missing_count', schema=SCHEMA_NAME)
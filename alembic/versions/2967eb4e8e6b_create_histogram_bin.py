@@ -0,0 +1,87 @@
+"""create histogram bin
+
+Revision ID: 2967eb4e8e6b
+Revises: 57ba94b0fc50
+Create Date: 2019-05-13 14:02:11.540318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2967eb4e8e6b'
+down_revision = '57ba94b0fc50'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Create the table holding histogram bins of columns.'''
+
+    op.create_table(
+        'histogram_bin',
+        sa.Column('column_id', sa.Integer),
+        sa.Column('data_table_id', sa.Integer),
+        sa.Column('column_name', sa.Text),
+        # 'numeric' for values, 'text_length' for lengths of text values.
+        sa.Column('histogram_type', sa.Text),
+        # 'equi_width' or 'equi_depth'.
+        sa.Column('method', sa.Text),
+        sa.Column('bin_number', sa.Integer),
+        sa.Column('lower_bound', sa.Numeric),
+        sa.Column('upper_bound', sa.Numeric),
+        sa.Column('frequency', sa.BigInteger),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_primary_key(
+        'histogram_bin_pk',
+        'histogram_bin',
+        ['column_id', 'histogram_type', 'bin_number'],
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'histogram_bin_column_info_fk',
+        'histogram_bin',
+        'column_info',
+        ['column_id'],
+        ['column_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'histogram_bin_data_table_fk',
+        'histogram_bin',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the histogram bin table.'''
+
+    op.drop_constraint(
+        'histogram_bin_column_info_fk',
+        'histogram_bin',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_constraint(
+        'histogram_bin_data_table_fk',
+        'histogram_bin',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('histogram_bin', schema=SCHEMA_NAME)
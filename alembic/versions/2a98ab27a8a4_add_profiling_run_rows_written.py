@@ -0,0 +1,34 @@
+"""add profiling run rows written
+
+Revision ID: 2a98ab27a8a4
+Revises: b37f31b6ec54
+Create Date: 2019-06-05 15:48:19.274016
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a98ab27a8a4'
+down_revision = 'b37f31b6ec54'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Add the number of rows written to the metabase per stage.'''
+
+    op.add_column(
+        'profiling_run',
+        sa.Column('rows_written', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the number of rows written to the metabase per stage.'''
+
+    op.drop_column('profiling_run', 'rows_written', schema=SCHEMA_NAME)
@@ -0,0 +1,94 @@
+"""create text top value
+
+Revision ID: 2b2d895598cd
+Revises: 72f8d07566b5
+Create Date: 2019-06-24 10:12:47.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b2d895598cd'
+down_revision = '72f8d07566b5'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Create the table holding the most frequent values of text columns.'''
+
+    op.create_table(
+        'text_top_value',
+        sa.Column('column_id', sa.Integer),
+        sa.Column('data_table_id', sa.Integer),
+        sa.Column('column_name', sa.Text),
+        # 1 for the most frequent value.
+        sa.Column('rank', sa.Integer),
+        sa.Column('value', sa.Text),
+        # Estimated frequency, an upper bound of the frequency.
+        sa.Column('frequency', sa.BigInteger),
+        # Largest overestimation of the frequency.
+        sa.Column('frequency_error', sa.BigInteger),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_primary_key(
+        'text_top_value_pk',
+        'text_top_value',
+        ['column_id', 'rank'],
+        schema=SCHEMA_NAME,
+    )
+
+    # Looked up by data_table_id on export.
+    op.create_index(
+        'text_top_value_data_table_idx',
+        'text_top_value',
+        ['data_table_id', 'column_id', 'rank'],
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'text_top_value_column_info_fk',
+        'text_top_value',
+        'column_info',
+        ['column_id'],
+        ['column_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'text_top_value_data_table_fk',
+        'text_top_value',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the text top value table.'''
+
+    op.drop_constraint(
+        'text_top_value_column_info_fk',
+        'text_top_value',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_constraint(
+        'text_top_value_data_table_fk',
+        'text_top_value',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('text_top_value', schema=SCHEMA_NAME)
@@ -0,0 +1,60 @@
+"""create gmeta cache
+
+Revision ID: 57ba94b0fc50
+Revises: 0fbe9f4e9934
+Create Date: 2019-05-06 10:21:37.184520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '57ba94b0fc50'
+down_revision = '0fbe9f4e9934'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Create the table holding rendered GMETA documents.'''
+
+    op.create_table(
+        'gmeta_cache',
+        sa.Column('data_table_id', sa.Integer, primary_key=True),
+        sa.Column('gmeta', postgresql.JSONB),
+        sa.Column('gmeta_hash', sa.Text),
+        sa.Column('version', sa.Integer),
+        # data_table.date_last_updated when the document was rendered.
+        sa.Column('source_date_last_updated', sa.TIMESTAMP),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_foreign_key(
+        'gmeta_cache_data_table_fk',
+        'gmeta_cache',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the GMETA cache table.'''
+
+    op.drop_constraint(
+        'gmeta_cache_data_table_fk',
+        'gmeta_cache',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('gmeta_cache', schema=SCHEMA_NAME)
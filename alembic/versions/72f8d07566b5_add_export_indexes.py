@@ -0,0 +1,259 @@
+"""add export indexes
+
+Revision ID: 72f8d07566b5
+Revises: b2ae7b945140
+Create Date: 2019-06-17 11:26:04.583190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '72f8d07566b5'
+down_revision = 'b2ae7b945140'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+# Hash partitions of code_frequency on PostgreSQL 11 and later.
+CODE_FREQUENCY_PARTITIONS = 16
+
+# Tables looked up by data_table_id and ordered by column_id on export.
+EXPORT_INDEXES = [
+    ('column_info_data_table_column_idx', 'column_info',
+     ['data_table_id', 'column_id']),
+    ('numeric_column_data_table_idx', 'numeric_column',
+     ['data_table_id', 'column_id']),
+    ('text_column_data_table_idx', 'text_column',
+     ['data_table_id', 'column_id']),
+    ('date_column_data_table_idx', 'date_column',
+     ['data_table_id', 'column_id']),
+    ('histogram_bin_data_table_idx', 'histogram_bin',
+     ['data_table_id', 'column_id', 'bin_number']),
+]
+
+
+def upgrade():
+    '''Index the export lookups and partition code_frequency.'''
+
+    for index_name, table_name, columns in EXPORT_INDEXES:
+        op.create_index(
+            index_name,
+            table_name,
+            columns,
+            schema=SCHEMA_NAME,
+        )
+
+    op.drop_index(
+        'code_frequency_column_null_code_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+    op.drop_index(
+        'code_frequency_column_code_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+
+    # Declarative hash partitioning needs PostgreSQL 11. Older servers keep
+    # a single table with the same keys.
+    if supports_hash_partitioning():
+        partition_code_frequency()
+
+    # Keys include data_table_id, the partition key, and are the conflict
+    # targets of the code frequency upserts.
+    op.create_index(
+        'code_frequency_column_code_idx',
+        'code_frequency',
+        ['data_table_id', 'column_id', 'code'],
+        unique=True,
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text('code IS NOT NULL'),
+    )
+    op.create_index(
+        'code_frequency_column_null_code_idx',
+        'code_frequency',
+        ['data_table_id', 'column_id'],
+        unique=True,
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text('code IS NULL'),
+    )
+
+    # Top-k codes of the columns of a Data Table, read by an index-only scan.
+    op.create_index(
+        'code_frequency_top_codes_idx',
+        'code_frequency',
+        [
+            'data_table_id',
+            'column_id',
+            sa.text('frequency DESC'),
+            'code',
+        ],
+        schema=SCHEMA_NAME,
+    )
+
+
+def supports_hash_partitioning():
+    return int(
+        op.get_bind().execute('SHOW server_version_num').scalar()
+    ) >= 110000
+
+
+def partition_code_frequency():
+    '''Replace code_frequency by a table hash-partitioned by data_table_id.'''
+
+    replace_code_frequency(
+        'PRIMARY KEY (data_table_id, code_id)',
+        'PARTITION BY HASH (data_table_id)',
+    )
+
+
+def merge_code_frequency_partitions():
+    '''Replace the partitioned code_frequency by a single table.'''
+
+    replace_code_frequency('PRIMARY KEY (code_id)', '')
+
+
+def replace_code_frequency(primary_key, partition_by):
+    '''Copy code_frequency into a new table with another layout.
+
+    The code_id sequence is handed over to the new table. Partitions are
+    created if `partition_by` is given.
+
+    '''
+    for constraint_name in ['code_frequency_column_info_fk',
+                            'code_frequency_data_table_fk']:
+        op.drop_constraint(
+            constraint_name,
+            'code_frequency',
+            schema=SCHEMA_NAME,
+        )
+    op.execute(
+        """
+        ALTER TABLE {schema}.code_frequency
+            RENAME CONSTRAINT code_frequency_pkey TO code_frequency_old_pkey;
+        ALTER TABLE {schema}.code_frequency RENAME TO code_frequency_old;
+        """.format(schema=SCHEMA_NAME)
+    )
+
+    op.execute(
+        """
+        CREATE TABLE {schema}.code_frequency (
+            code_id INTEGER NOT NULL DEFAULT NEXTVAL(
+                '{schema}.code_frequency_code_id_seq'::REGCLASS),
+            data_table_id INTEGER NOT NULL,
+            column_id INTEGER,
+            column_name TEXT,
+            code TEXT,
+            frequency INTEGER,
+            created_by TEXT,
+            date_created TIMESTAMP,
+            updated_by TEXT,
+            date_last_updated TIMESTAMP,
+            CONSTRAINT code_frequency_pkey {primary_key}
+        ) {partition_by}
+        """.format(
+            schema=SCHEMA_NAME,
+            primary_key=primary_key,
+            partition_by=partition_by,
+        )
+    )
+    if partition_by:
+        for remainder in range(CODE_FREQUENCY_PARTITIONS):
+            op.execute(
+                """
+                CREATE TABLE {schema}.code_frequency_{remainder:02d}
+                PARTITION OF {schema}.code_frequency
+                FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})
+                """.format(
+                    schema=SCHEMA_NAME,
+                    modulus=CODE_FREQUENCY_PARTITIONS,
+                    remainder=remainder,
+                )
+            )
+
+    op.execute(
+        """
+        INSERT INTO {schema}.code_frequency
+        SELECT
+            code_id,
+            data_table_id,
+            column_id,
+            column_name,
+            code,
+            frequency,
+            created_by,
+            date_created,
+            updated_by,
+            date_last_updated
+        FROM {schema}.code_frequency_old;
+
+        ALTER SEQUENCE {schema}.code_frequency_code_id_seq
+            OWNED BY {schema}.code_frequency.code_id;
+        """.format(schema=SCHEMA_NAME)
+    )
+    op.drop_table('code_frequency_old', schema=SCHEMA_NAME)
+
+    op.create_foreign_key(
+        'code_frequency_column_info_fk',
+        'code_frequency',
+        'column_info',
+        ['column_id'],
+        ['column_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+    op.create_foreign_key(
+        'code_frequency_data_table_fk',
+        'code_frequency',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the export indexes and merge the code_frequency partitions.'''
+
+    op.drop_index(
+        'code_frequency_top_codes_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+    op.drop_index(
+        'code_frequency_column_null_code_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+    op.drop_index(
+        'code_frequency_column_code_idx',
+        'code_frequency',
+        schema=SCHEMA_NAME,
+    )
+
+    if supports_hash_partitioning():
+        merge_code_frequency_partitions()
+
+    op.create_index(
+        'code_frequency_column_code_idx',
+        'code_frequency',
+        ['column_id', 'code'],
+        unique=True,
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text('code IS NOT NULL'),
+    )
+    op.create_index(
+        'code_frequency_column_null_code_idx',
+        'code_frequency',
+        ['column_id'],
+        unique=True,
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text('code IS NULL'),
+    )
+
+    for index_name, table_name, _columns in reversed(EXPORT_INDEXES):
+        op.drop_index(index_name, table_name, schema=SCHEMA_NAME)
@@ -0,0 +1,36 @@
+"""add gmeta cache format version
+
+Revision ID: a83c6e0d42f1
+Revises: d7a3f19c5e62
+Create Date: 2019-07-03 09:17:45.208311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83c6e0d42f1'
+down_revision = 'd7a3f19c5e62'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Record the format of cached GMETA documents.'''
+
+    # extract_metadata_helper.GMETA_FORMAT_VERSION of the rendering code.
+    # Documents cached before are NULL, hence stale.
+    op.add_column(
+        'gmeta_cache',
+        sa.Column('format_version', sa.Integer),
+        schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the format of cached GMETA documents.'''
+
+    op.drop_column('gmeta_cache', 'format_version', schema=SCHEMA_NAME)
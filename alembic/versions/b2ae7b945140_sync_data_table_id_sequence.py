@@ -0,0 +1,42 @@
+"""sync data table id sequence
+
+Revision ID: b2ae7b945140
+Revises: 11c6136dd42d
+Create Date: 2019-06-14 09:52:36.107463
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2ae7b945140'
+down_revision = '11c6136dd42d'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Move the data_table_id sequence past IDs allocated with MAX + 1.
+
+    data_table_id is a serial column, but tables used to be registered with
+    explicit IDs, so the sequence never advanced.
+
+    '''
+    op.execute(
+        """
+        SELECT SETVAL(
+            PG_GET_SERIAL_SEQUENCE('{schema}.data_table', 'data_table_id'),
+            COALESCE(MAX(data_table_id), 0) + 1,
+            FALSE
+        )
+        FROM {schema}.data_table
+        """.format(schema=SCHEMA_NAME)
+    )
+
+
+def downgrade():
+    '''Nothing to undo: the sequence stays ahead of the existing IDs.'''
+
+    pass
@@ -0,0 +1,46 @@
+"""add profiling run memory
+
+Revision ID: b37f31b6ec54
+Revises: 186368f1ee88
+Create Date: 2019-06-03 11:26:40.915237
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b37f31b6ec54'
+down_revision = '186368f1ee88'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Add RSS and tracemalloc peak of memory profiling runs.'''
+
+    op.add_column(
+        'profiling_run',
+        sa.Column('rss_before_bytes', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+    op.add_column(
+        'profiling_run',
+        sa.Column('rss_after_bytes', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+    op.add_column(
+        'profiling_run',
+        sa.Column('peak_traced_bytes', sa.BigInteger),
+        schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop RSS and tracemalloc peak of memory profiling runs.'''
+
+    op.drop_column('profiling_run', 'peak_traced_bytes', schema=SCHEMA_NAME)
+    op.drop_column('profiling_run', 'rss_after_bytes', schema=SCHEMA_NAME)
+    op.drop_column('profiling_run', 'rss_before_bytes', schema=SCHEMA_NAME)
@@ -0,0 +1,101 @@
+"""create column minhash
+
+Revision ID: c5e0b7d3a914
+Revises: 2b2d895598cd
+Create Date: 2019-06-26 15:03:12.804127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e0b7d3a914'
+down_revision = '2b2d895598cd'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Create the table holding MinHash signatures of columns.'''
+
+    op.create_table(
+        'column_minhash',
+        sa.Column('column_id', sa.Integer),
+        sa.Column('data_table_id', sa.Integer),
+        sa.Column('column_name', sa.Text),
+        # Lowest hash of the distinct values by each hash function, as
+        # little-endian 32-bit integers.
+        sa.Column('signature', sa.LargeBinary),
+        # LSH hash of each band of the signature.
+        sa.Column('band_hashes', postgresql.ARRAY(sa.BigInteger)),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_primary_key(
+        'column_minhash_pk',
+        'column_minhash',
+        ['column_id'],
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_index(
+        'column_minhash_data_table_idx',
+        'column_minhash',
+        ['data_table_id', 'column_id'],
+        schema=SCHEMA_NAME,
+    )
+
+    # Candidate joinable columns share a band hash with the queried column.
+    op.create_index(
+        'column_minhash_band_hashes_idx',
+        'column_minhash',
+        ['band_hashes'],
+        schema=SCHEMA_NAME,
+        postgresql_using='gin',
+    )
+
+    op.create_foreign_key(
+        'column_minhash_column_info_fk',
+        'column_minhash',
+        'column_info',
+        ['column_id'],
+        ['column_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'column_minhash_data_table_fk',
+        'column_minhash',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the column minhash table.'''
+
+    op.drop_constraint(
+        'column_minhash_column_info_fk',
+        'column_minhash',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_constraint(
+        'column_minhash_data_table_fk',
+        'column_minhash',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('column_minhash', schema=SCHEMA_NAME)
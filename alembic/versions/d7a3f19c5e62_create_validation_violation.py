@@ -0,0 +1,91 @@
+"""create validation violation
+
+Revision ID: d7a3f19c5e62
+Revises: e41f6a2c8b07
+Create Date: 2019-07-01 14:22:09.530418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3f19c5e62'
+down_revision = 'e41f6a2c8b07'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Key the codebook by code and create the validation violation table.'''
+
+    # A codebook lists every code of a column, not one code per column.
+    op.drop_constraint('codebook_pk', 'codebook', schema=SCHEMA_NAME)
+    op.create_primary_key(
+        'codebook_pk',
+        'codebook',
+        ['data_table_id', 'column_name', 'code'],
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_table(
+        'validation_violation',
+        sa.Column('violation_id', sa.Integer, primary_key=True),
+        sa.Column('data_table_id', sa.Integer, nullable=False),
+        sa.Column('column_name', sa.Text),
+        # 'numeric_range', 'text_range', 'date_range' or 'codebook'.
+        sa.Column('expectation', sa.Text),
+        # Expected statistic, e.g. 'minimum', or 'frequency' of a code, or
+        # 'unexpected_code' for a code missing from the codebook.
+        sa.Column('statistic', sa.Text),
+        sa.Column('code', sa.Text),
+        # Values as text, since they are numbers, dates or intervals.
+        sa.Column('expected', sa.Text),
+        sa.Column('tolerance', sa.Text),
+        # NULL if the column was not profiled with this statistic.
+        sa.Column('observed', sa.Text),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_index(
+        'validation_violation_data_table_idx',
+        'validation_violation',
+        ['data_table_id'],
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'validation_violation_data_table_fk',
+        'validation_violation',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the validation violation table and key the codebook by column.'''
+
+    op.drop_constraint(
+        'validation_violation_data_table_fk',
+        'validation_violation',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('validation_violation', schema=SCHEMA_NAME)
+
+    op.drop_constraint('codebook_pk', 'codebook', schema=SCHEMA_NAME)
+    op.create_primary_key(
+        'codebook_pk',
+        'codebook',
+        ['data_table_id', 'column_name'],
+        schema=SCHEMA_NAME,
+    )
@@ -0,0 +1,74 @@
+"""create candidate key
+
+Revision ID: e41f6a2c8b07
+Revises: c5e0b7d3a914
+Create Date: 2019-06-28 10:41:37.215664
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41f6a2c8b07'
+down_revision = 'c5e0b7d3a914'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Add the uniqueness of columns and create the candidate key table.'''
+
+    # Distinct non-null values per row of the table. 1 for unique columns
+    # without missing values.
+    op.add_column(
+        'column_info',
+        sa.Column('uniqueness', sa.Numeric),
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_table(
+        'candidate_key',
+        sa.Column('data_table_id', sa.Integer),
+        # Columns whose values identify every row, in the order of the table.
+        sa.Column('key_columns', postgresql.ARRAY(sa.Text)),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_primary_key(
+        'candidate_key_pk',
+        'candidate_key',
+        ['data_table_id', 'key_columns'],
+        schema=SCHEMA_NAME,
+    )
+
+    op.create_foreign_key(
+        'candidate_key_data_table_fk',
+        'candidate_key',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+
+def downgrade():
+    '''Drop the candidate key table and the uniqueness of columns.'''
+
+    op.drop_constraint(
+        'candidate_key_data_table_fk',
+        'candidate_key',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('candidate_key', schema=SCHEMA_NAME)
+
+    op.drop_column('column_info', 'uniqueness', schema=SCHEMA_NAME)
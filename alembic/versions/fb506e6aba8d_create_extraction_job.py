@@ -0,0 +1,103 @@
+"""create extraction job
+
+Revision ID: fb506e6aba8d
+Revises: 2a98ab27a8a4
+Create Date: 2019-06-10 10:05:43.618927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'fb506e6aba8d'
+down_revision = '2a98ab27a8a4'
+branch_labels = None
+depends_on = None
+
+SCHEMA_NAME = 'metabase'
+
+
+def upgrade():
+    '''Create the queue of extraction jobs claimed by workers.'''
+
+    op.create_table(
+        'extraction_job',
+        sa.Column('job_id', sa.Integer, primary_key=True),
+        sa.Column('data_table_id', sa.Integer, nullable=False),
+        # Jobs with higher priority are claimed first.
+        sa.Column('priority', sa.Integer, nullable=False,
+                  server_default='0'),
+        # Keyword arguments of ExtractMetadata.process_table().
+        sa.Column('options', postgresql.JSONB, nullable=False,
+                  server_default='{}'),
+        # 'pending', 'running', 'succeeded' or 'failed'.
+        sa.Column('status', sa.Text, nullable=False,
+                  server_default='pending'),
+        sa.Column('attempts', sa.Integer, nullable=False,
+                  server_default='0'),
+        sa.Column('max_attempts', sa.Integer, nullable=False,
+                  server_default='3'),
+        # <host>:<pid> of the worker running the job.
+        sa.Column('worker_id', sa.Text),
+        sa.Column('lease_expires_at', sa.TIMESTAMP),
+        sa.Column('heartbeat_at', sa.TIMESTAMP),
+        sa.Column('started_at', sa.TIMESTAMP),
+        sa.Column('finished_at', sa.TIMESTAMP),
+        sa.Column('error', sa.Text),
+        sa.Column('created_by', sa.Text),
+        sa.Column('date_created', sa.TIMESTAMP),
+        sa.Column('updated_by', sa.Text),
+        sa.Column('date_last_updated', sa.TIMESTAMP),
+        schema=SCHEMA_NAME
+    )
+
+    op.create_foreign_key(
+        'extraction_job_data_table_fk',
+        'extraction_job',
+        'data_table',
+        ['data_table_id'],
+        ['data_table_id'],
+        source_schema=SCHEMA_NAME,
+        referent_schema=SCHEMA_NAME,
+    )
+
+    # Workers look for the next pending job and for expired leases.
+    op.create_index(
+        'extraction_job_pending_idx',
+        'extraction_job',
+        [sa.text('priority DESC'), 'job_id'],
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.create_index(
+        'extraction_job_running_idx',
+        'extraction_job',
+        ['lease_expires_at'],
+        schema=SCHEMA_NAME,
+        postgresql_where=sa.text("status = 'running'"),
+    )
+
+
+def downgrade():
+    '''Drop the extraction job queue.'''
+
+    op.drop_index(
+        'extraction_job_running_idx',
+        'extraction_job',
+        schema=SCHEMA_NAME,
+    )
+    op.drop_index(
+        'extraction_job_pending_idx',
+        'extraction_job',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_constraint(
+        'extraction_job_data_table_fk',
+        'extraction_job',
+        schema=SCHEMA_NAME,
+    )
+
+    op.drop_table('extraction_job', schema=SCHEMA_NAME)
@@ -0,0 +1,306 @@
+"""
+Export latency benchmark for a growing metabase.
+
+Synthetic metadata of processed Data Tables (columns of every type, code
+frequencies and histogram bins) is generated inside a temporary PostgreSQL
+database (`testing.postgresql`) until the metabase holds each of the
+requested numbers of Data Tables. At every size, the GMETA documents of a
+random sample of Data Tables are rendered from the metadata tables, bypassing
+the GMETA cache, and the median and 95th percentile latencies are reported.
+With the export indexes, the latency stays flat as the metabase grows.
+
+Run from the root directory of the project, e.g.::
+
+    python -m benchmarks.bench_export --tables 100 1000 10000
+
+    python -m benchmarks.bench_export --tables 100 1000 10000 \\
+        --revision b2ae7b945140
+
+The second command measures the metabase before the export indexes.
+
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+
+import psycopg2
+import psycopg2.extras
+
+from benchmarks.bench_extract_metadata import benchmark_database
+from metabase import extract_metadata_helper
+
+
+# Column types of the columns of every Data Table, in turn.
+COLUMN_TYPES = ('numeric', 'text', 'date', 'code')
+
+
+# #############################################################################
+#   Synthetic metadata
+# #############################################################################
+
+def add_data_tables(cursor, first_id, last_id, n_columns, n_codes, n_bins):
+    """Insert metadata of Data Tables `first_id` to `last_id` in SQL.
+
+    Columns get IDs (data_table_id - 1) * n_columns + column number, so that
+    batches of Data Tables can be added in any order.
+
+    """
+    params = {
+        'first_id': first_id,
+        'last_id': last_id,
+        'n_columns': n_columns,
+        'n_codes': n_codes,
+        'n_bins': n_bins,
+        'column_types': list(COLUMN_TYPES),
+    }
+
+    cursor.execute(
+        """
+        INSERT INTO metabase.data_table (
+            data_table_id,
+            file_table_name,
+            date_last_updated
+        )
+        SELECT t, 'data.table_' || t, CURRENT_TIMESTAMP
+        FROM GENERATE_SERIES(%(first_id)s, %(last_id)s) AS t;
+
+        INSERT INTO metabase.column_info (
+            column_id,
+            data_table_id,
+            column_name,
+            data_type,
+            missing_count,
+            non_null_count,
+            distinct_count
+        )
+        SELECT
+            (t - 1) * %(n_columns)s + c,
+            t,
+            'column_' || c,
+            (%(column_types)s::TEXT[])[
+                c %% ARRAY_LENGTH(%(column_types)s::TEXT[], 1) + 1],
+            10,
+            990,
+            %(n_codes)s
+        FROM GENERATE_SERIES(%(first_id)s, %(last_id)s) AS t,
+            GENERATE_SERIES(0, %(n_columns)s - 1) AS c;
+        """,
+        params,
+    )
+
+    new_columns = """
+        FROM metabase.column_info
+        WHERE data_table_id BETWEEN %(first_id)s AND %(last_id)s
+            AND data_type = '{}'
+    """
+
+    cursor.execute(
+        """
+        INSERT INTO metabase.numeric_column (
+            column_id, data_table_id, column_name,
+            minimum, maximum, mean, median, std
+        )
+        SELECT column_id, data_table_id, column_name, 0, 100, 50, 50, 10
+        """ + new_columns.format('numeric') + """;
+
+        INSERT INTO metabase.text_column (
+            column_id, data_table_id, column_name,
+            max_length, min_length, median_length
+        )
+        SELECT column_id, data_table_id, column_name, 32, 1, 16
+        """ + new_columns.format('text') + """;
+
+        INSERT INTO metabase.date_column (
+            column_id, data_table_id, column_name, max_date, min_date
+        )
+        SELECT
+            column_id, data_table_id, column_name,
+            DATE '2019-01-01', DATE '2000-01-01'
+        """ + new_columns.format('date') + """;
+
+        INSERT INTO metabase.code_frequency (
+            data_table_id, column_id, column_name, code, frequency
+        )
+        SELECT data_table_id, column_id, column_name, 'C' || k, k
+        FROM GENERATE_SERIES(1, %(n_codes)s) AS k,
+            metabase.column_info
+        WHERE data_table_id BETWEEN %(first_id)s AND %(last_id)s
+            AND data_type = 'code';
+
+        INSERT INTO metabase.histogram_bin (
+            column_id, data_table_id, column_name, histogram_type, method,
+            bin_number, lower_bound, upper_bound, frequency
+        )
+        SELECT
+            column_id, data_table_id, column_name,
+            CASE data_type
+                WHEN 'numeric' THEN 'numeric'
+                ELSE 'text_length'
+            END,
+            'equi_width', b, b * 10, (b + 1) * 10, 100
+        FROM metabase.column_info
+            CROSS JOIN GENERATE_SERIES(0, %(n_bins)s - 1) AS b
+        WHERE data_table_id BETWEEN %(first_id)s AND %(last_id)s
+            AND data_type IN ('numeric', 'text');
+        """,
+        params,
+    )
+
+
+def count_rows(cursor):
+    """Return the number of rows of the metadata tables read on export."""
+
+    counts = {}
+    for table_name in ['column_info', 'code_frequency', 'histogram_bin']:
+        cursor.execute(
+            'SELECT COUNT(*) FROM metabase.{}'.format(table_name))
+        counts[table_name] = cursor.fetchone()[0]
+
+    return counts
+
+
+# #############################################################################
+#   Timing
+# #############################################################################
+
+def time_exports(conn, data_table_ids):
+    """Render the GMETA document of every Data Table without the cache.
+
+    Each document is rendered in its own transaction, which is rolled back
+    so that the GMETA cache stays empty.
+
+    Returns:
+        ([float]): Seconds per Data Table.
+
+    """
+    seconds = []
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        for data_table_id in data_table_ids:
+            start = time.perf_counter()
+            extract_metadata_helper.refresh_gmeta_cache(
+                cursor, [data_table_id])
+            seconds.append(time.perf_counter() - start)
+            conn.rollback()
+
+    return seconds
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def parse_args(args):
+    """Parse command line arguments of the benchmark."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument(
+        '--tables', type=int, nargs='+', default=[100, 1000, 10000],
+        help='Numbers of Data Tables in the metabase to export at')
+    parser.add_argument(
+        '--columns', type=int, default=20,
+        help='Columns per Data Table, of every type in turn')
+    parser.add_argument(
+        '--codes', type=int, default=50,
+        help='Distinct codes per categorical column')
+    parser.add_argument(
+        '--bins', type=int, default=10,
+        help='Histogram bins per numeric and text column')
+    parser.add_argument(
+        '--samples', type=int, default=50,
+        help='Data Tables exported at every size')
+    parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Data Tables generated per statement')
+    parser.add_argument(
+        '--revision', type=str, default='head',
+        help='Alembic revision of the metabase, e.g. to compare against '
+             'the schema before an index was added')
+    parser.add_argument('--output', type=str,
+                        help='JSON file to write results to')
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'revision': args.revision,
+        'columns': args.columns,
+        'codes': args.codes,
+        'bins': args.bins,
+        'results': [],
+    }
+
+    rng = random.Random(0)
+    n_tables = 0
+
+    print('{:>10} {:>12} {:>16} {:>12} {:>12}'.format(
+        'tables', 'column_info', 'code_frequency', 'median ms', 'p95 ms'))
+
+    with benchmark_database(args.revision) as conn_str:
+        conn = psycopg2.connect(conn_str)
+        try:
+            for target_tables in sorted(args.tables):
+                with conn, conn.cursor() as cursor:
+                    while n_tables < target_tables:
+                        last_id = min(n_tables + args.batch_size,
+                                      target_tables)
+                        add_data_tables(
+                            cursor,
+                            n_tables + 1,
+                            last_id,
+                            args.columns,
+                            args.codes,
+                            args.bins,
+                        )
+                        n_tables = last_id
+
+                    row_counts = count_rows(cursor)
+
+                # ANALYZE cannot run inside a transaction block.
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                conn.autocommit = False
+
+                sample_ids = [
+                    rng.randint(1, n_tables) for _ in range(args.samples)
+                ]
+                seconds = time_exports(conn, sample_ids)
+
+                result = {
+                    'tables': n_tables,
+                    'rows': row_counts,
+                    'median_seconds': percentile(seconds, 0.5),
+                    'p95_seconds': percentile(seconds, 0.95),
+                }
+                results['results'].append(result)
+                print('{:>10} {:>12} {:>16} {:>12.2f} {:>12.2f}'.format(
+                    n_tables,
+                    row_counts['column_info'],
+                    row_counts['code_frequency'],
+                    result['median_seconds'] * 1000,
+                    result['p95_seconds'] * 1000,
+                ))
+        finally:
+            conn.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,486 @@
+"""
+Scaling benchmarks for metadata extraction.
+
+Synthetic tables are generated inside a temporary PostgreSQL database
+(`testing.postgresql`) for every combination of the requested shapes, then
+`ExtractMetadata.process_table()` and `ExtractMetadata.export_table_metadata()`
+are timed end to end and per stage. Results are written to JSON and can be
+compared against a stored baseline.
+
+Run from the root directory of the project, e.g.::
+
+    python -m benchmarks.bench_extract_metadata \\
+        --rows 10000 100000 --columns 10 50 --output results.json
+
+    python -m benchmarks.bench_extract_metadata \\
+        --rows 10000 100000 --columns 10 50 --baseline results.json
+
+"""
+
+import argparse
+import collections
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+import alembic.command
+from alembic.config import Config
+import psycopg2
+from psycopg2 import sql
+import testing.postgresql
+
+from metabase import extract_metadata
+from metabase import extract_metadata_helper
+
+
+COLUMN_TYPES = ('numeric', 'text', 'date', 'code')
+
+# Helper functions timed as stages of `process_table()`, by stage name.
+STAGES = collections.OrderedDict([
+    ('type_detection', 'execute_column_plan'),
+    ('numeric', 'update_numeric'),
+    ('text', 'update_text'),
+    ('date', 'update_date'),
+    ('code', 'update_code'),
+    ('histogram', 'get_histogram_from_counts'),
+    ('candidate_keys', 'has_duplicate_rows'),
+    ('validation', 'validate_data_table'),
+    ('gmeta_cache', 'refresh_gmeta_cache'),
+])
+
+
+# #############################################################################
+#   Database setup and synthetic tables
+# #############################################################################
+
+@contextlib.contextmanager
+def benchmark_database(revision='head'):
+    """Yield the connection string of a temporary database with a metabase.
+
+    Args:
+        revision (str): Alembic revision the metabase is upgraded to.
+
+    """
+
+    postgresql = testing.postgresql.Postgresql()
+    params = postgresql.dsn()
+    conn_str = 'postgresql://{user}@{host}:{port}/{database}'.format(**params)
+
+    try:
+        with psycopg2.connect(conn_str) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('CREATE SCHEMA metabase; CREATE SCHEMA data;')
+
+        alembic_cfg = Config()
+        alembic_cfg.set_main_option('script_location', 'alembic')
+        alembic_cfg.set_main_option('sqlalchemy.url', conn_str)
+        alembic.command.upgrade(alembic_cfg, revision)
+
+        yield conn_str
+
+    finally:
+        postgresql.stop()
+
+
+def parse_type_mix(type_mix_str):
+    """Parse 'numeric=0.4,text=0.2,...' into a dict of column type weights."""
+
+    type_mix = {}
+    for item in type_mix_str.split(','):
+        column_type, weight = item.split('=')
+        if column_type not in COLUMN_TYPES:
+            raise ValueError('Unknown column type: {}'.format(column_type))
+        type_mix[column_type] = float(weight)
+
+    return type_mix
+
+
+def assign_column_types(n_cols, type_mix):
+    """Spread column types over `n_cols` columns in proportion to weights.
+
+    Types are interleaved so that every prefix of the columns has a similar
+    mix.
+
+    Returns:
+        ([str]): Column type of each column.
+
+    """
+    total = sum(type_mix.values())
+    counts = dict.fromkeys(type_mix, 0)
+
+    column_types = []
+    for i in range(1, n_cols + 1):
+        column_type = max(
+            type_mix,
+            key=lambda t: type_mix[t] / total * i - counts[t],
+        )
+        counts[column_type] += 1
+        column_types.append(column_type)
+
+    return column_types
+
+
+def column_expression(column_type, cardinality, string_length,
+                      code_cardinality):
+    """SQL expression generating values of one column from row number `i`.
+
+    All columns are stored as TEXT, like raw data receipts, so that type
+    detection has to convert them.
+
+    """
+    if column_type == 'numeric':
+        return sql.SQL(
+            "((i * 7919) % {})::NUMERIC / 100"
+        ).format(sql.Literal(max(cardinality, 1)))
+
+    if column_type == 'text':
+        return sql.SQL(
+            "LEFT(REPEAT(MD5((i % {})::TEXT), {}), {})"
+        ).format(
+            sql.Literal(max(cardinality, 1)),
+            sql.Literal(string_length // 32 + 1),
+            sql.Literal(string_length),
+        )
+
+    if column_type == 'date':
+        return sql.SQL(
+            "TO_CHAR(DATE '2000-01-01' + (i % {}), 'YYYY-MM-DD')"
+        ).format(sql.Literal(max(min(cardinality, 36500), 1)))
+
+    if column_type == 'code':
+        return sql.SQL("'C' || (i % {})").format(
+            sql.Literal(code_cardinality))
+
+    raise ValueError('Unknown column type: {}'.format(column_type))
+
+
+def create_synthetic_table(cursor, table_name, n_rows, column_types,
+                           null_rate, cardinality, string_length,
+                           code_cardinality):
+    """Create and fill `data.<table_name>` inside the database.
+
+    Rows are generated with `GENERATE_SERIES` so that 10M-row tables do not
+    have to be shipped from Python.
+
+    """
+    column_names = [
+        '{}_{:04d}'.format(column_type, i)
+        for i, column_type in enumerate(column_types)
+    ]
+
+    cursor.execute(
+        sql.SQL('CREATE TABLE data.{} ({})').format(
+            sql.Identifier(table_name),
+            sql.SQL(', ').join(
+                sql.SQL('{} TEXT').format(sql.Identifier(name))
+                for name in column_names
+            ),
+        )
+    )
+
+    value_sqls = [
+        sql.SQL(
+            'CASE WHEN RANDOM() < {} THEN NULL ELSE ({})::TEXT END'
+        ).format(
+            sql.Literal(null_rate),
+            column_expression(column_type, cardinality, string_length,
+                              code_cardinality),
+        )
+        for column_type in column_types
+    ]
+
+    cursor.execute(
+        sql.SQL("""
+            INSERT INTO data.{} ({})
+            SELECT {} FROM GENERATE_SERIES(1, {}) AS i
+        """).format(
+            sql.Identifier(table_name),
+            sql.SQL(', ').join(sql.Identifier(n) for n in column_names),
+            sql.SQL(', ').join(value_sqls),
+            sql.Literal(n_rows),
+        )
+    )
+    cursor.execute(
+        sql.SQL('ANALYZE data.{}').format(sql.Identifier(table_name)))
+
+
+# #############################################################################
+#   Timing
+# #############################################################################
+
+@contextlib.contextmanager
+def stage_timers(stage_seconds):
+    """Accumulate wall time of the helper function of every stage."""
+
+    def timed(stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage_seconds[stage] += time.perf_counter() - start
+        return wrapper
+
+    with contextlib.ExitStack() as stack:
+        for stage, func_name in STAGES.items():
+            func = getattr(extract_metadata_helper, func_name)
+            stack.enter_context(patch.object(
+                extract_metadata_helper,
+                func_name,
+                timed(stage, func),
+            ))
+        stack.enter_context(patch.object(
+            extract_metadata.ExtractMetadata,
+            '_get_table_level_metadata',
+            timed(
+                'table_level',
+                extract_metadata.ExtractMetadata._get_table_level_metadata,
+            ),
+        ))
+        yield
+
+
+def run_shape(conn_str, shape, data_table_id, args):
+    """Generate one table shape and time its extraction `args.repeat` times.
+
+    Returns:
+        (dict): Parameters and median timings of this shape.
+
+    """
+    table_name = 'bench_{}'.format(data_table_id)
+    column_types = assign_column_types(shape['columns'], shape['type_mix'])
+
+    with psycopg2.connect(conn_str) as conn:
+        with conn.cursor() as cursor:
+            start = time.perf_counter()
+            create_synthetic_table(
+                cursor,
+                table_name,
+                shape['rows'],
+                column_types,
+                shape['null_rate'],
+                shape['cardinality'],
+                shape['string_length'],
+                args.code_cardinality,
+            )
+            generate_seconds = time.perf_counter() - start
+
+    mock_settings = MagicMock()
+    mock_settings.metabase_connection_string = conn_str
+    mock_settings.data_connection_string = conn_str
+
+    runs = []
+    for _ in range(args.repeat):
+        with psycopg2.connect(conn_str) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO metabase.data_table
+                        (data_table_id, file_table_name)
+                    VALUES (%s, %s)
+                    """,
+                    [data_table_id, 'data.' + table_name],
+                )
+
+        stage_seconds = collections.defaultdict(float)
+        with patch.object(extract_metadata, 'settings', mock_settings):
+            extract = extract_metadata.ExtractMetadata(data_table_id)
+
+            with stage_timers(stage_seconds):
+                start = time.perf_counter()
+                extract.process_table(
+                    categorical_threshold=args.categorical_threshold,
+                )
+                process_seconds = time.perf_counter() - start
+
+            with tempfile.TemporaryDirectory() as output_dir:
+                output_filepath = os.path.join(output_dir, 'gmeta.json')
+
+                start = time.perf_counter()
+                extract.export_table_metadata(output_filepath)
+                export_cached_seconds = time.perf_counter() - start
+
+                # Invalidate the GMETA cache to time a full render.
+                with psycopg2.connect(conn_str) as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            """
+                            UPDATE metabase.gmeta_cache
+                            SET source_date_last_updated = NULL
+                            WHERE data_table_id = %s
+                            """,
+                            [data_table_id],
+                        )
+
+                start = time.perf_counter()
+                extract.export_table_metadata(output_filepath)
+                export_seconds = time.perf_counter() - start
+
+        runs.append({
+            'process_table': process_seconds,
+            'export_table_metadata': export_seconds,
+            'export_table_metadata_cached': export_cached_seconds,
+            'stages': dict(stage_seconds),
+        })
+        data_table_id += 1000000  # Keep IDs of repeats apart.
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    return {
+        'shape': shape,
+        'column_types': dict(collections.Counter(column_types)),
+        'generate_seconds': generate_seconds,
+        'seconds': {
+            key: median([run[key] for run in runs])
+            for key in ('process_table', 'export_table_metadata',
+                        'export_table_metadata_cached')
+        },
+        'stage_seconds': {
+            stage: median([run['stages'].get(stage, 0.0) for run in runs])
+            for stage in itertools.chain(['table_level'], STAGES)
+        },
+        'rows_per_second': shape['rows'] * shape['columns'] / median(
+            [run['process_table'] for run in runs]),
+    }
+
+
+# #############################################################################
+#   Results and baseline comparison
+# #############################################################################
+
+def shape_key(shape):
+    """Hashable key identifying a shape across result files."""
+
+    return json.dumps(shape, sort_keys=True)
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Print timing ratios against the baseline.
+
+    Returns:
+        (bool): True if any shape is slower than baseline by more than
+            `tolerance` (e.g. 0.1 for 10%).
+
+    """
+    baseline_dict = {
+        shape_key(result['shape']): result for result in baseline['results']
+    }
+
+    regressed = False
+    for result in results['results']:
+        baseline_result = baseline_dict.get(shape_key(result['shape']))
+        if baseline_result is None:
+            print('No baseline for shape', shape_key(result['shape']))
+            continue
+
+        for key, seconds in result['seconds'].items():
+            baseline_seconds = baseline_result['seconds'][key]
+            ratio = seconds / baseline_seconds if baseline_seconds else 1.0
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressed = True
+            print('{:>8} rows {:>4} cols {:<30} {:8.3f}s vs {:8.3f}s '
+                  '({:.2f}x){}'.format(
+                      result['shape']['rows'],
+                      result['shape']['columns'],
+                      key,
+                      seconds,
+                      baseline_seconds,
+                      ratio,
+                      flag,
+                  ))
+
+    return regressed
+
+
+def parse_args(args):
+    """Parse command line arguments of the benchmark."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[10])
+    parser.add_argument(
+        '--type-mix', nargs='+', default=['numeric=1,text=1,date=1,code=1'],
+        help="Weights of column types, e.g. 'numeric=0.7,text=0.3'")
+    parser.add_argument('--null-rate', type=float, nargs='+', default=[0.1])
+    parser.add_argument(
+        '--cardinality', type=int, nargs='+', default=[1000],
+        help='Distinct values of numeric, text and date columns')
+    parser.add_argument(
+        '--string-length', type=int, nargs='+', default=[16],
+        help='Length of values of text columns')
+    parser.add_argument(
+        '--code-cardinality', type=int, default=5,
+        help='Distinct values of code columns')
+    parser.add_argument('--categorical-threshold', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', type=str,
+                        help='JSON file to write results to')
+    parser.add_argument('--baseline', type=str,
+                        help='JSON results to compare against')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.1,
+        help='Relative slowdown over baseline reported as a regression')
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+
+    shapes = [
+        {
+            'rows': rows,
+            'columns': columns,
+            'type_mix': parse_type_mix(type_mix),
+            'null_rate': null_rate,
+            'cardinality': cardinality,
+            'string_length': string_length,
+        }
+        for rows, columns, type_mix, null_rate, cardinality, string_length
+        in itertools.product(
+            args.rows, args.columns, args.type_mix, args.null_rate,
+            args.cardinality, args.string_length,
+        )
+    ]
+
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+
+    with benchmark_database() as conn_str:
+        for data_table_id, shape in enumerate(shapes, start=1):
+            result = run_shape(conn_str, shape, data_table_id, args)
+            results['results'].append(result)
+            print('{rows:>8} rows {columns:>4} cols: '.format(**shape)
+                  + ', '.join('{} {:.3f}s'.format(k, v)
+                              for k, v in result['seconds'].items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare_with_baseline(results, baseline, args.tolerance):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,318 @@
+"""
+Microbenchmarks for the pure-Python helper functions of metadata extraction.
+
+The statistics functions of `extract_metadata_helper` and the GMETA shaping
+are run on generated inputs without a database, so that regressions in the
+Python hot loops show up independently of database variance. Throughput
+(elements per second, best of `--repeat` runs with `timeit`) and peak
+allocation (`tracemalloc`, measured in a separate run) are reported.
+
+Run from the root directory of the project, e.g.::
+
+    python -m benchmarks.bench_helpers --sizes 1000 100000 10000000
+
+"""
+
+import argparse
+import collections
+import datetime
+import decimal
+import functools
+import gc
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from metabase import date_parser
+from metabase import extract_metadata_helper
+
+
+NULL_RATE = 0.1
+
+
+# #############################################################################
+#   Input generators
+# #############################################################################
+
+def with_nulls(values, rng):
+    """Replace a fraction `NULL_RATE` of the values by None."""
+
+    return [None if rng.random() < NULL_RATE else v for v in values]
+
+
+def generate_floats(size, rng):
+    return with_nulls((rng.uniform(0, 1e6) for _ in range(size)), rng)
+
+
+def generate_decimals(size, rng):
+    # psycopg2 returns NUMERIC columns as Decimal.
+    return with_nulls(
+        (decimal.Decimal(rng.randrange(10 ** 8)) / 100 for _ in range(size)),
+        rng,
+    )
+
+
+def generate_strings(length, size, rng):
+    pool = [
+        ''.join(rng.choice(string.ascii_letters) for _ in range(length))
+        for _ in range(min(size, 10000))
+    ]
+    return with_nulls((rng.choice(pool) for _ in range(size)), rng)
+
+
+def generate_dates(size, rng):
+    start = datetime.date(2000, 1, 1)
+    return with_nulls(
+        (start + datetime.timedelta(days=rng.randrange(36500))
+         for _ in range(size)),
+        rng,
+    )
+
+
+def generate_date_strings(size, rng):
+    return [
+        None if date is None else date.strftime('%Y-%m-%d')
+        for date in generate_dates(size, rng)
+    ]
+
+
+def parse_dates_per_row(values):
+    # Reference for `date_parser.parse_dates()`, one Python call per value.
+    dates = []
+    for value in values:
+        try:
+            dates.append(
+                None if value is None
+                else datetime.datetime.strptime(value, '%Y-%m-%d').date())
+        except ValueError:
+            dates.append(None)
+    return dates
+
+
+def generate_codes(n_distinct, size, rng):
+    codes = ['C{}'.format(i) for i in range(n_distinct)]
+    return with_nulls((rng.choice(codes) for _ in range(size)), rng)
+
+
+def generate_gmeta_fields(size, rng):
+    """Generate table and column GMETA fields of a table of `size` columns.
+
+    Returns:
+        (dict, dict): Arguments of `export_gmeta_in_json()`.
+
+    """
+    table_gmeta_dict = {
+        'file_name': 'data.benchmark',
+        'file_type': None,
+        'file_size': 1e9,
+    }
+
+    column_gmeta_dict = {}
+    for column_id in range(size):
+        gmeta_type = ('Numeric', 'Temporal', 'Categorical',
+                      'Textual')[column_id % 4]
+        counts = {'missing': rng.randrange(100), 'values': rng.randrange(100)}
+
+        if gmeta_type == 'Numeric':
+            column_result = dict(
+                counts, min=0.0, max=rng.random(), mean=0.5, std=0.1,
+                histogram={'method': 'equi_width', 'bins': [
+                    {'lower_bound': i, 'upper_bound': i + 1, 'frequency': 10}
+                    for i in range(10)
+                ]},
+            )
+        elif gmeta_type == 'Temporal':
+            column_result = dict(counts, min='01/01/2000 12:01:00 AM',
+                                 max='12/31/2099 12:12:00 AM')
+        elif gmeta_type == 'Categorical':
+            column_result = dict(counts, codes=[
+                {'code': 'C{}'.format(i), 'frequency': 20 - i}
+                for i in range(20)
+            ])
+        else:
+            column_result = dict(counts, max_length=10.0, histogram={})
+
+        column_gmeta_dict[
+            (column_id, 'column_{}'.format(column_id), gmeta_type)
+        ] = column_result
+
+    return table_gmeta_dict, column_gmeta_dict
+
+
+def export_gmeta_in_json(gmeta_fields, output_filepath):
+    extract_metadata_helper.export_gmeta_in_json(
+        gmeta_fields[0],
+        gmeta_fields[1],
+        output_filepath,
+    )
+
+
+def counted(generate):
+    """Wrap `generate` to count the frequency of each generated value.
+
+    The statistics functions take the value counters of `execute_column_plan`
+    rather than lists of values.
+
+    """
+    def generate_counter(size, rng):
+        return collections.Counter(generate(size, rng))
+
+    return generate_counter
+
+
+def counted_items(generate):
+    """Wrap `generate` to stream each generated value with its frequency.
+
+    Text columns are summarized from the grouped values of
+    `iter_value_counts` rather than from a counter.
+
+    """
+    def generate_items(size, rng):
+        return list(collections.Counter(generate(size, rng)).items())
+
+    return generate_items
+
+
+# #############################################################################
+#   Cases
+# #############################################################################
+
+Case = collections.namedtuple('Case', ['name', 'generate', 'func'])
+
+
+def get_cases(output_filepath):
+    """Return the benchmark cases.
+
+    Each case generates its input from a size and a random generator, and
+    runs the benchmarked function on that input.
+
+    """
+    return [
+        Case('get_numeric_metadata[float]', counted(generate_floats),
+             extract_metadata_helper.get_numeric_metadata),
+        Case('get_numeric_metadata[Decimal]', counted(generate_decimals),
+             extract_metadata_helper.get_numeric_metadata),
+        Case('summarize_text[short]',
+             counted_items(functools.partial(generate_strings, 8)),
+             extract_metadata_helper.summarize_text),
+        Case('summarize_text[long]',
+             counted_items(functools.partial(generate_strings, 1000)),
+             extract_metadata_helper.summarize_text),
+        Case('get_column_minhash', generate_decimals,
+             extract_metadata_helper.get_column_minhash),
+        Case('get_date_metadata', counted(generate_dates),
+             extract_metadata_helper.get_date_metadata),
+        Case('parse_dates[YYYY-MM-DD]', generate_date_strings,
+             functools.partial(date_parser.parse_dates,
+                               date_format='YYYY-MM-DD')),
+        Case('parse_dates[strptime]', generate_date_strings,
+             parse_dates_per_row),
+        Case('get_column_counts_from_counter[few codes]',
+             counted(functools.partial(generate_codes, 5)),
+             extract_metadata_helper.get_column_counts_from_counter),
+        Case('get_column_counts_from_counter[many codes]',
+             counted(functools.partial(generate_codes, 100000)),
+             extract_metadata_helper.get_column_counts_from_counter),
+        Case('export_gmeta_in_json[columns]', generate_gmeta_fields,
+             functools.partial(export_gmeta_in_json,
+                               output_filepath=output_filepath)),
+    ]
+
+
+def measure(case, size, repeat, max_gmeta_columns):
+    """Time one case on one input size and measure its peak allocation.
+
+    Returns:
+        (dict): Best time, throughput and peak allocation, or None if the case
+            is skipped at this size.
+
+    """
+    if case.generate is generate_gmeta_fields and size > max_gmeta_columns:
+        return None
+
+    rng = random.Random(size)
+    data = case.generate(size, rng)
+
+    timer = timeit.Timer(functools.partial(case.func, data))
+    seconds = min(timer.repeat(repeat=repeat, number=1))
+
+    gc.collect()
+    tracemalloc.start()
+    case.func(data)
+    _current, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'case': case.name,
+        'size': size,
+        'seconds': seconds,
+        'elements_per_second': size / seconds if seconds else None,
+        'peak_bytes': peak_bytes,
+    }
+
+
+def parse_args(args):
+    """Parse command line arguments of the benchmark."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+',
+        default=[1000, 10000, 100000, 1000000],
+        help='Number of elements of the inputs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--cases', type=str, nargs='+',
+        help='Only run cases whose name starts with one of these')
+    parser.add_argument(
+        '--max-gmeta-columns', type=int, default=10000,
+        help='Largest number of columns shaped by export_gmeta_in_json')
+    parser.add_argument('--output', type=str,
+                        help='JSON file to write results to')
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        cases = get_cases(os.path.join(output_dir, 'gmeta.json'))
+        if args.cases:
+            cases = [
+                case for case in cases
+                if case.name.startswith(tuple(args.cases))
+            ]
+
+        print('{:<32} {:>10} {:>12} {:>16} {:>14}'.format(
+            'case', 'size', 'seconds', 'elements/s', 'peak MiB'))
+        for case in cases:
+            for size in args.sizes:
+                result = measure(case, size, args.repeat,
+                                 args.max_gmeta_columns)
+                if result is None:
+                    continue
+
+                results.append(result)
+                print('{:<32} {:>10} {:>12.6f} {:>16,.0f} {:>14.2f}'.format(
+                    case.name,
+                    size,
+                    result['seconds'],
+                    result['elements_per_second'] or 0,
+                    result['peak_bytes'] / 2 ** 20,
+                ))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results}, f, indent=4)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -16,89 +16,103 @@ select * from metabase.text_column where data_table_id =  <data_table_id>;
 select * from metabase.date_column where data_table_id = <data_table_id>;
 select * from metabase.code_frequency where data_table_id = <data_table_id>;
 
+If the extraction daemon (python -m metabase.daemon) is running, the job is
+submitted to it and runs with its warm connections. Otherwise it runs in this
+process.
+
 """
 
+import logging
+import os
 import sys
 
-import sqlalchemy
-
-from metabase import extract_metadata
+from metabase import client
 from metabase import parse_input
 
 
-def update_data_table(full_table_name):
-    """Update meatabase.data_table with this new table.
+def build_job(args):
+    """Build the extraction job from command line arguments.
 
-    This function is not intended to be part of the final metabase design but
-    it is useful for testing in this stage.
+    Args:
+        args (argparse.Namespace): Parsed arguments from argparse
 
+    Returns:
+        (dict): Job accepted by `metabase.jobs.run_job()`.
 
     """
+    options = {'categorical_threshold': args.categorical}
+    gmeta_output = None
 
-    engine = sqlalchemy.create_engine(
-        'postgres://metaadmin@localhost/postgres')
-    max_id = engine.execute(
-        'SELECT MAX(data_table_id) FROM metabase.data_table'
-    ).fetchall()[0][0]
-    if max_id is None:
-        new_id = 1
-    else:
-        new_id = max_id + 1
-        print("data_table_id is {} for table {}".format(
-            new_id, full_table_name))
-
-    engine.execute(
-        """
-        INSERT INTO metabase.data_table
-        (
-        data_table_id,
-        file_table_name
-        )
-        VALUES
-        (
-        %(data_table_id)s,
-        %(file_table_name)s
+    if args.input_file is not None:
+        file_parser = parse_input.ParseInput()
+        file_parser.parse(args.input_file)
+        if file_parser.categorical_threshold:
+            options['categorical_threshold'] = (
+                file_parser.categorical_threshold)
+        options.update(
+            type_overrides=file_parser.type_overrides,
+            date_format_dict=file_parser.date_format,
+            histogram_bins=file_parser.histogram_bins,
+            histogram_method=file_parser.histogram_method,
+            record_metrics=file_parser.record_metrics,
+            log_metrics=file_parser.log_metrics,
+            trace_sql=file_parser.trace_sql,
+            explain_filepath=file_parser.explain_file,
+            profile_memory=file_parser.profile_memory,
+            prometheus_textfile_dir=file_parser.prometheus_textfile_dir,
+            date_formats=file_parser.date_formats,
         )
-        """,
-        {
-            'data_table_id': new_id,
-            'file_table_name': full_table_name
-        }
-    )
+        gmeta_output = file_parser.gmeta_output
 
-    return new_id
+    # The daemon has its own working directory.
+    for key in ['explain_filepath', 'prometheus_textfile_dir']:
+        if options.get(key):
+            options[key] = os.path.abspath(options[key])
+    if gmeta_output:
+        gmeta_output = os.path.abspath(gmeta_output)
 
+    return {
+        'full_table_name': parse_input.derive_full_table_name(args),
+        'options': options,
+        'gmeta_output': gmeta_output,
+    }
 
-if __name__ == "__main__":
 
-    args = parse_input.parse_command_line_args(sys.argv[1:])
-    full_table_name = parse_input.derive_full_table_name(args)
-    categorical_threshold = args.categorical
-    input_file = args.input_file
-    type_overrides = {}
+def run_job(job, socket_path=None):
+    """Submit the job to the daemon, or run it in process if none is running.
 
-    if input_file is not None:
-        file_parser = parse_input.ParseInput()
-        file_parser.parse(input_file)
-        type_overrides = file_parser.type_overrides
-        categ_threshold_config = file_parser.categorical_threshold
-        date_format_dict = file_parser.date_format
-        gmeta_output = file_parser.gmeta_output
+    Args:
+        job (dict): Job accepted by `metabase.jobs.run_job()`.
+        socket_path (str): Unix socket of the daemon. The job runs in process
+            if None.
 
-    new_id = update_data_table(full_table_name)
+    Returns:
+        (int): data_table_id of the registered table.
 
-    # Extract metadata from data.
-    if categ_threshold_config:
-        categorical_threshold = categ_threshold_config
+    """
+    if socket_path is not None:
+        try:
+            return client.submit_job(job, socket_path)
+        except client.DaemonUnavailable:
+            pass
 
-    extract = extract_metadata.ExtractMetadata(data_table_id=new_id)
+    # Imported here so that submitting to the daemon stays cheap.
+    from metabase import jobs
 
-    extract.process_table(
-        categorical_threshold=categorical_threshold,
-        type_overrides=type_overrides,
-        date_format_dict=date_format_dict,
-    )
+    options = job['options']
+    if options.get('log_metrics') or options.get('trace_sql'):
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-    # Export metadata as Gmeta in JSON.
-    if gmeta_output:
-        extract.export_table_metadata(gmeta_output)
+    return jobs.run_job(job)
+
+
+if __name__ == "__main__":
+
+    args = parse_input.parse_command_line_args(sys.argv[1:])
+    job = build_job(args)
+
+    socket_path = None if args.no_daemon else args.daemon_socket
+    data_table_id = run_job(job, socket_path)
+
+    print("data_table_id is {} for table {}".format(
+        data_table_id, job['full_table_name']))
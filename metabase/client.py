@@ -0,0 +1,62 @@
+"""Client submitting extraction jobs to the daemon over its Unix socket.
+
+Only the standard library is imported, so that submitting a job does not pay
+for importing psycopg2 and the extraction modules.
+
+Jobs and results are JSON objects sent as single lines. A job is a dict
+accepted by `jobs.run_job()`. The daemon answers with {'data_table_id': ...}
+or {'error': ..., 'error_type': ...}.
+
+"""
+
+import json
+import socket
+
+
+class DaemonUnavailable(Exception):
+    """No daemon is listening on the socket."""
+
+
+class JobFailed(Exception):
+    """The daemon ran the job and it failed."""
+
+
+def submit_job(job, socket_path):
+    """Submit a job to the daemon and wait for it to finish.
+
+    Args:
+        job (dict): Job accepted by `jobs.run_job()`. Filepaths should be
+            absolute since the daemon has its own working directory.
+        socket_path (str): Unix socket of the daemon.
+
+    Returns:
+        (int): data_table_id of the registered table.
+
+    Raises:
+        DaemonUnavailable: If no daemon accepts the connection. The job has
+            not been started.
+        JobFailed: If the job raised an exception in the daemon.
+
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise DaemonUnavailable(str(e))
+
+        sock.sendall(json.dumps(job).encode('utf-8') + b'\n')
+
+        with sock.makefile('rb') as response_file:
+            line = response_file.readline()
+    finally:
+        sock.close()
+
+    if not line:
+        raise JobFailed('Daemon closed the connection without a result.')
+
+    result = json.loads(line.decode('utf-8'))
+    if 'error' in result:
+        raise JobFailed('{}: {}'.format(result['error_type'], result['error']))
+
+    return result['data_table_id']
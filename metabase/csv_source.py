@@ -0,0 +1,655 @@
+"""Extract metadata from CSV files without loading them into PostgreSQL.
+
+A CSV file is read in chunks, which are parsed by a pool of processes into
+the frequencies of the values of every column. Uncompressed files are split
+at line boundaries and every process reads its own chunk with a memory map.
+Gzip-compressed files are decompressed in order and their chunks handed to
+the pool.
+
+The frequencies of every distinct value are kept in memory, so the number
+of distinct values of a file is limited by `MAX_DISTINCT_VALUES`. Files with
+more, e.g. with free text columns, should be loaded into PostgreSQL, where
+text columns are summarized while they are streamed.
+
+Column types are inferred from the distinct values with the probes of
+`extract_metadata_helper.plan_column()`, as for a text column in the data
+database, and the metabase is updated with the same records as by
+`ExtractMetadata.process_table()`.
+
+Run from the root directory of the project, e.g.::
+
+    python -m metabase.csv_source data.csv --categorical 10 --processes 4
+
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import decimal
+import gc
+import gzip
+import io
+import itertools
+import json
+import math
+import mmap
+import os
+import re
+
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+from . import date_parser
+from . import extract_metadata_helper
+from . import jobs
+from . import settings
+
+
+# Bytes of an uncompressed file parsed per task of the process pool.
+CHUNK_BYTES = 16 * 2 ** 20
+
+# Lines of a compressed file parsed per task of the process pool.
+GZIP_CHUNK_LINES = 200000
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Distinct values of all columns of a file kept in memory while it is read.
+# Every distinct value is counted exactly, unlike the streamed text columns
+# of the data database, so files with more are rejected.
+MAX_DISTINCT_VALUES = 10 ** 7
+
+# Finite numbers cast by ::NUMERIC in PostgreSQL.
+NUMERIC_PATTERN = re.compile(
+    r'^\s*[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?\s*$')
+
+
+# #############################################################################
+#   Reading CSV files
+# #############################################################################
+
+def is_gzip(filepath):
+    """Return True if the file is gzip-compressed."""
+
+    with open(filepath, 'rb') as f:
+        return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def read_header(filepath, encoding='utf-8'):
+    """Return the column names and the offset of the first data line.
+
+    The offset is in bytes of the uncompressed file. Column names are
+    stripped of surrounding whitespace.
+
+    """
+    opener = gzip.open if is_gzip(filepath) else open
+    with opener(filepath, 'rb') as f:
+        header_line = f.readline()
+
+    header = header_line.decode(encoding).lstrip('\ufeff')
+    column_names = [
+        name.strip()
+        for name in next(csv.reader([header], skipinitialspace=True))
+    ]
+
+    return column_names, len(header_line)
+
+
+def split_lines(filepath, start, chunk_bytes):
+    """Split an uncompressed file into chunks ending at line boundaries.
+
+    Returns:
+        ([(int, int)]): Start and end offsets of every chunk.
+
+    """
+    file_size = os.path.getsize(filepath)
+    if start >= file_size:
+        return []
+
+    with open(filepath, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ranges = []
+        while start < file_size:
+            end = mm.find(b'\n', min(start + chunk_bytes, file_size) - 1)
+            end = file_size if end == -1 else end + 1
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def count_values(text, n_columns):
+    """Count the values of every column in CSV lines.
+
+    Empty values are counted as None, i.e. missing.
+
+    Raises:
+        ValueError: If a line does not have `n_columns` values.
+
+    Returns:
+        ((int, [collections.Counter])): Number of rows and a Counter per
+            column. Plain tuples, so that the pool pickles them.
+
+    """
+    # Parsing allocates a list per line, which would trigger the cyclic
+    # garbage collector over and over without freeing anything.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rows = [
+            row
+            for row in csv.reader(io.StringIO(text), skipinitialspace=True)
+            if row
+        ]
+        for row in rows:
+            if len(row) != n_columns:
+                raise ValueError(
+                    'Expected {} values but found {} in line {}'.format(
+                        n_columns, len(row), row))
+
+        value_counts = []
+        for column in zip(*rows) if rows else [()] * n_columns:
+            counter = collections.Counter(column)
+            n_empty = counter.pop('', 0)
+            if n_empty:
+                counter[None] = n_empty
+            value_counts.append(counter)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return len(rows), value_counts
+
+
+def count_range(filepath, start, end, n_columns, encoding='utf-8'):
+    """Count the values of every column in a chunk of a file.
+
+    Runs in the processes of the pool, which map the file themselves.
+
+    """
+    with open(filepath, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(encoding)
+
+    return count_values(text, n_columns)
+
+
+def iter_gzip_chunks(filepath, start, encoding='utf-8',
+                     chunk_lines=GZIP_CHUNK_LINES):
+    """Yield the text of chunks of lines of a gzip-compressed file."""
+
+    with gzip.open(filepath, 'rb') as f:
+        f.seek(start)
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                break
+            yield b''.join(lines).decode(encoding)
+
+
+def count_file_values(filepath, processes=None, chunk_bytes=CHUNK_BYTES,
+                      encoding='utf-8',
+                      max_distinct_values=MAX_DISTINCT_VALUES):
+    """Count the values of every column of a CSV file.
+
+    Records must not span lines, since chunks are split at line boundaries.
+    Counters of chunks are bounded by the size of the chunks, and the merged
+    counters by `max_distinct_values`.
+
+    Args:
+        filepath (str): CSV file with a header line, optionally
+            gzip-compressed.
+        processes (int): Size of the process pool. Chunks are parsed in
+            this process if 1, and by as many processes as CPUs if None.
+        chunk_bytes (int): Bytes of an uncompressed file per chunk.
+        max_distinct_values (int): Largest number of distinct values of all
+            columns together.
+
+    Returns:
+        (([str], int, [collections.Counter])): Column names, number of rows
+            and a Counter per column.
+
+    Raises:
+        ValueError: If the columns have more than `max_distinct_values`
+            distinct values.
+
+    """
+    column_names, start = read_header(filepath, encoding)
+    n_columns = len(column_names)
+
+    if is_gzip(filepath):
+        tasks = (
+            (count_values, text, n_columns)
+            for text in iter_gzip_chunks(filepath, start, encoding)
+        )
+    else:
+        tasks = (
+            (count_range, filepath, chunk_start, chunk_end, n_columns,
+             encoding)
+            for chunk_start, chunk_end in split_lines(
+                filepath, start, chunk_bytes)
+        )
+
+    n_rows = 0
+    value_counts = None
+
+    for chunk_rows, chunk_value_counts in map_tasks(tasks, processes):
+        n_rows += chunk_rows
+        if value_counts is None:
+            value_counts = chunk_value_counts
+        else:
+            for counter, chunk_counter in zip(value_counts,
+                                              chunk_value_counts):
+                counter.update(chunk_counter)
+
+        n_distinct = [len(counter) for counter in value_counts]
+        if sum(n_distinct) > max_distinct_values:
+            raise ValueError(
+                'File has more than {} distinct values, {} in column {}. '
+                'Load it into the data database to profile it.'.format(
+                    max_distinct_values,
+                    max(n_distinct),
+                    column_names[n_distinct.index(max(n_distinct))],
+                )
+            )
+
+    if value_counts is None:
+        value_counts = [collections.Counter() for _ in column_names]
+
+    return column_names, n_rows, value_counts
+
+
+def map_tasks(tasks, processes):
+    """Yield the results of (function, *args) tasks, in process or in a pool.
+
+    At most two tasks per process are pending at a time, so that chunks are
+    not read much ahead of the pool.
+
+    """
+    if processes == 1:
+        for func, *args in tasks:
+            yield func(*args)
+        return
+
+    max_pending = 2 * (processes or os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = collections.deque()
+        for func, *args in tasks:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+# #############################################################################
+#   Type inference
+# #############################################################################
+
+def convert_numeric(values):
+    """Return Decimals by value, or None if a value is not numeric.
+
+    Values are text, or numbers stored as such, e.g. by SQLite.
+
+    """
+    converted = {}
+    for value in values:
+        if isinstance(value, str):
+            if not NUMERIC_PATTERN.match(value):
+                return None
+            converted[value] = decimal.Decimal(value)
+        elif isinstance(value, (int, float)) and math.isfinite(value):
+            converted[value] = decimal.Decimal(repr(value))
+        else:
+            return None
+
+    return converted
+
+
+def convert_text(values):
+    """Return text by value for the values that are not text."""
+
+    return {
+        value: str(value) for value in values if not isinstance(value, str)
+    }
+
+
+def convert_dates(values, date_formats):
+    """Return dates by value in the first format parsing every value.
+
+    Returns:
+        (dict): datetime.date by value, or None if no format parses every
+            value.
+
+    """
+    values = list(values)
+    strings = np.array(values, dtype=str)
+    for date_format in date_formats:
+        parsed = date_parser.parse_dates(strings, date_format)
+        if parsed.invalid_count == 0:
+            return dict(zip(values, parsed.dates.tolist()))
+
+    return None
+
+
+def convert_counts(value_counts, converted):
+    """Return the frequencies of the converted values of a column.
+
+    Values converted to the same value, e.g. 1 and '1' to text, are counted
+    together.
+
+    """
+    converted_counts = collections.Counter()
+    for value, count in value_counts.items():
+        converted_counts[converted.get(value, value)] += count
+
+    return converted_counts
+
+
+def execute_csv_column_plan(plan, value_counts, categorical_threshold):
+    """Infer the type of a column from the frequencies of its values.
+
+    Probes are those of `extract_metadata_helper.execute_column_plan()`.
+    Candidate date formats are tried on every distinct value rather than a
+    sample. Columns overridden as dates without a date format are parsed
+    with the candidate formats.
+
+    Args:
+        plan (column_plan): Plan of the column, as a text column.
+        value_counts (collections.Counter): Value -> frequency. None counts
+            missing values. Values that are not text, e.g. numbers of SQLite
+            columns, are converted to text for text and code columns.
+
+    Returns:
+        (column_data): Type of the column and frequencies of its converted
+            values, or the text summary of a text column.
+
+    Raises:
+        ValueError: If an overridden column cannot be converted to the type
+            it is overridden with.
+
+    """
+    values = [value for value in value_counts if value is not None]
+    formats = [plan.date_format] if plan.date_format else plan.date_formats
+
+    def probe(probe_type):
+        if probe_type == 'numeric':
+            return convert_numeric(values)
+        elif probe_type in ('date', 'date_sample'):
+            return convert_dates(values, formats)
+        else:
+            return convert_text(values)
+
+    if plan.override:
+        column_type, = plan.probes
+        converted = probe(column_type)
+        if converted is None:
+            raise ValueError(
+                'Invalid type override. Column {} cannot be converted to '
+                'type {}'.format(plan.column_name, column_type)
+            )
+
+        return get_column_data(
+            column_type,
+            convert_counts(value_counts, converted),
+        )
+
+    for probe_type in plan.probes:
+        if probe_type == 'code':
+            column_type = (
+                'code' if len(values) <= categorical_threshold else 'text')
+            return get_column_data(
+                column_type,
+                convert_counts(value_counts, convert_text(values)),
+            )
+
+        converted = probe(probe_type)
+        if converted is not None:
+            return extract_metadata_helper.COLUMN_DATA(
+                'numeric' if probe_type == 'numeric' else 'date',
+                convert_counts(value_counts, converted),
+            )
+
+    raise ValueError(
+        'Column plan of {} has no code probe'.format(plan.column_name))
+
+
+def get_column_data(column_type, value_counter):
+    """Return the column data of converted value frequencies.
+
+    Text columns are summarized as those of the data database, by
+    `extract_metadata_helper.summarize_text()`.
+
+    """
+    if column_type == 'text':
+        value_counter = extract_metadata_helper.summarize_text(
+            value_counter.items())
+
+    return extract_metadata_helper.COLUMN_DATA(column_type, value_counter)
+
+
+# #############################################################################
+#   Extraction
+# #############################################################################
+
+class ExtractCsvMetadata():
+    """Class to extract metadata from a Data Table stored as a CSV file."""
+
+    def __init__(self, data_table_id, filepath, metabase_conn=None):
+        """Set Data Table ID and the file to read.
+
+        Args:
+           data_table_id (int): ID associated with this Data Table.
+           filepath (str): CSV file with a header line, optionally
+               gzip-compressed.
+           metabase_conn (psycopg2.extensions.connection): Connection to the
+               metabase to reuse. A new connection is opened if None.
+
+        """
+        self.data_table_id = data_table_id
+        self.filepath = filepath
+        self.metabase_conn = metabase_conn
+
+    def process_table(self, categorical_threshold=10, type_overrides={},
+                      date_format_dict={}, histogram_bins=10,
+                      histogram_method='equi_width', date_formats=None,
+                      processes=None, chunk_bytes=CHUNK_BYTES,
+                      encoding='utf-8',
+                      max_distinct_values=MAX_DISTINCT_VALUES):
+        """Update the metabase with metadata from this CSV file.
+
+        The file is read once. Table level metadata, every column, candidate
+        keys and validation are committed in one transaction, and the GMETA
+        cache in another.
+
+        Args:
+            processes (int): Size of the process pool parsing the file. The
+                file is parsed in this process if 1, and by as many
+                processes as CPUs if None.
+            chunk_bytes (int): Bytes of an uncompressed file per chunk.
+            encoding (str): Encoding of the file.
+            max_distinct_values (int): Largest number of distinct values of
+                all columns together, which are counted in memory. Files
+                with more are rejected with a ValueError.
+
+        See `ExtractMetadata.process_table()` for the other arguments.
+
+        """
+        if date_formats is None:
+            date_formats = extract_metadata_helper.DEFAULT_DATE_FORMATS
+
+        column_names, n_rows, value_counts = count_file_values(
+            self.filepath,
+            processes,
+            chunk_bytes,
+            encoding,
+            max_distinct_values,
+        )
+        if n_rows == 0:
+            raise ValueError('Selected data table has 0 rows.')
+
+        conn = self.metabase_conn
+        if conn is None:
+            conn = psycopg2.connect(settings.metabase_connection_string)
+        try:
+            with conn, conn.cursor() as cursor:
+                # Size of the file as stored, i.e. compressed.
+                extract_metadata_helper.update_table_level_metadata(
+                    cursor,
+                    self.data_table_id,
+                    n_rows,
+                    len(column_names),
+                    os.path.getsize(self.filepath),
+                )
+                extract_metadata_helper.delete_missing_columns(
+                    cursor,
+                    self.data_table_id,
+                    column_names,
+                )
+                for col_name, column_counts in zip(column_names,
+                                                   value_counts):
+                    plan = extract_metadata_helper.plan_column(
+                        col_name,
+                        'text',
+                        type_overrides,
+                        date_format_dict,
+                        date_formats,
+                    )
+                    self._update_column_metadata(
+                        cursor,
+                        plan,
+                        column_counts,
+                        categorical_threshold,
+                        histogram_bins,
+                        histogram_method,
+                    )
+
+                # Rows are not kept, so only single columns are checked.
+                unique_columns, _ = extract_metadata_helper.get_candidate_keys(
+                    extract_metadata_helper.select_key_columns(
+                        cursor,
+                        self.data_table_id,
+                    ),
+                    max_pairs=0,
+                )
+                extract_metadata_helper.replace_candidate_keys(
+                    cursor,
+                    self.data_table_id,
+                    [[col_name] for col_name in unique_columns],
+                )
+                extract_metadata_helper.validate_data_table(
+                    cursor,
+                    self.data_table_id,
+                )
+
+            with conn, conn.cursor(
+                cursor_factory=psycopg2.extras.DictCursor
+                    ) as dict_cursor:
+                extract_metadata_helper.refresh_gmeta_cache(
+                    dict_cursor,
+                    [self.data_table_id],
+                )
+        finally:
+            if self.metabase_conn is None:
+                conn.close()
+
+    def _update_column_metadata(self, metabase_cur, plan, value_counts,
+                                categorical_threshold, histogram_bins,
+                                histogram_method):
+        """Infer the type of a column and store its metadata."""
+
+        col_name = plan.column_name
+        column_data = execute_csv_column_plan(
+            plan,
+            value_counts,
+            categorical_threshold,
+        )
+        column_type = column_data.type
+
+        update_functions = {
+            'numeric': extract_metadata_helper.update_numeric,
+            'text': extract_metadata_helper.update_text,
+            'date': extract_metadata_helper.update_date,
+            'code': extract_metadata_helper.update_code,
+        }
+        column_id = update_functions[column_type](
+            metabase_cur,
+            col_name,
+            column_data.data,
+            self.data_table_id,
+        )
+
+        if histogram_bins and column_type in ('numeric', 'text'):
+            histogram_type = (
+                'numeric' if column_type == 'numeric' else 'text_length')
+
+            extract_metadata_helper.insert_histogram_bins(
+                metabase_cur,
+                col_name,
+                column_id,
+                self.data_table_id,
+                histogram_type,
+                histogram_method,
+                extract_metadata_helper.get_histogram_from_counts(
+                    extract_metadata_helper.get_histogram_counts(column_data),
+                    histogram_bins,
+                    histogram_method,
+                ),
+            )
+
+
+def parse_command_line_args(args):
+    """Parse command line arguments of the CSV extractor.
+
+    Args:
+        args ([str]): List of command line arguments and flags.
+
+    Returns
+        (argparse.Namespace): Parsed arguments from argparse
+
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'filepath', type=str,
+        help='CSV file with a header line, optionally gzip-compressed')
+    parser.add_argument(
+        '-c', '--categorical', type=int, default=10,
+        help='Max number of distinct values in all categorical columns')
+    parser.add_argument(
+        '-f', '--input_file', type=str,
+        help='JSON file with the options of process_table()')
+    parser.add_argument(
+        '--processes', type=int,
+        help='Processes parsing the file, as many as CPUs by default')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_command_line_args(args)
+
+    options = {'categorical_threshold': args.categorical}
+    if args.input_file is not None:
+        with open(args.input_file) as f:
+            options.update(json.load(f))
+    options['processes'] = args.processes
+
+    conn = psycopg2.connect(settings.metabase_connection_string)
+    try:
+        with conn:
+            data_table_id = jobs.register_data_table(conn, args.filepath)
+
+        extract = ExtractCsvMetadata(data_table_id, args.filepath, conn)
+        extract.process_table(**options)
+    finally:
+        conn.close()
+
+    print('data_table_id is {} for file {}'.format(
+        data_table_id, args.filepath))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Long-running extraction daemon accepting jobs over a Unix socket.
+
+Start it with::
+
+    python -m metabase.daemon --socket /tmp/metabase-extract.sock --workers 2
+
+The extraction modules are imported and connections to the data database and
+the metabase are opened once, so jobs submitted by `extract.py` skip its cold
+start. Each connection in use runs one job at a time; up to `workers` jobs run
+in parallel. As tracemalloc traces the whole process, a job with
+`profile_memory` waits for the running jobs and runs alone.
+
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+import psycopg2
+import psycopg2.pool
+
+from . import settings
+from . import jobs
+
+
+class ExtractionServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    """Unix socket server running extraction jobs with pooled connections."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=1):
+        """Open the connection pools and bind the socket.
+
+        Args:
+            socket_path (str): Path of the Unix socket. A stale socket left
+                by a daemon that did not shut down cleanly is replaced.
+            workers (int): Maximum number of jobs running at the same time.
+
+        Raises:
+            RuntimeError: If a daemon is already listening on the socket.
+
+        """
+        remove_stale_socket(socket_path)
+
+        self.workers = workers
+        self.job_slots = threading.BoundedSemaphore(workers)
+        self.exclusive_lock = threading.Lock()
+        self.data_pool = psycopg2.pool.ThreadedConnectionPool(
+            1,
+            workers,
+            settings.data_connection_string,
+        )
+        self.metabase_pool = psycopg2.pool.ThreadedConnectionPool(
+            1,
+            workers,
+            settings.metabase_connection_string,
+        )
+
+        try:
+            super().__init__(socket_path, JobHandler)
+        except Exception:
+            self.data_pool.closeall()
+            self.metabase_pool.closeall()
+            raise
+
+    def server_bind(self):
+        super().server_bind()
+        # Jobs write to the metabase as the daemon's user.
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        self.data_pool.closeall()
+        self.metabase_pool.closeall()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    def run_job(self, job):
+        """Run a job with connections from the pools.
+
+        Returns:
+            (int): data_table_id of the registered table.
+
+        """
+        if job.get('options', {}).get('profile_memory'):
+            slots = self.all_job_slots()
+        else:
+            slots = self.job_slots
+
+        with slots:
+            with pooled_connection(self.data_pool) as data_conn, \
+                    pooled_connection(self.metabase_pool) as metabase_conn:
+                return jobs.run_job(job, data_conn, metabase_conn)
+
+    @contextlib.contextmanager
+    def all_job_slots(self):
+        """Take every job slot, waiting for the running jobs to finish.
+
+        The tracemalloc peak of a job with `profile_memory` would otherwise
+        include the allocations of the jobs running next to it, and its
+        start and stop of tracemalloc would cut their tracing short.
+
+        """
+        # Slots are taken one by one, so two exclusive jobs each holding part
+        # of them would wait for each other forever.
+        with self.exclusive_lock:
+            for _ in range(self.workers):
+                self.job_slots.acquire()
+
+        try:
+            yield
+        finally:
+            for _ in range(self.workers):
+                self.job_slots.release()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Run the job sent as one JSON line and answer with its result."""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            job = json.loads(line.decode('utf-8'))
+            result = {'data_table_id': self.server.run_job(job)}
+        except Exception as e:
+            result = {'error': str(e), 'error_type': type(e).__name__}
+
+        self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+
+
+@contextlib.contextmanager
+def pooled_connection(pool):
+    """Borrow a connection from a pool, replacing it if it was closed.
+
+    Connections are returned to the pool idle, outside any transaction.
+
+    """
+    conn = pool.getconn()
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+
+    try:
+        yield conn
+    finally:
+        if not conn.closed and not conn.autocommit:
+            conn.rollback()
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def remove_stale_socket(socket_path):
+    """Remove a socket file no daemon is listening on.
+
+    Raises:
+        RuntimeError: If a daemon is listening on the socket.
+
+    """
+    if not os.path.exists(socket_path):
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        sock.close()
+
+    raise RuntimeError('A daemon is already listening on ' + socket_path)
+
+
+def parse_command_line_args(args):
+    """Parse command line arguments of the daemon.
+
+    Args:
+        args ([str]): List of command line arguments and flags.
+
+    Returns
+        (argparse.Namespace): Parsed arguments from argparse
+
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--socket', type=str, default=settings.daemon_socket_path,
+        help='Path of the Unix socket to listen on')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Max number of jobs running at the same time')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_command_line_args(args)
+
+    # Metrics and SQL traces of jobs are logged by the daemon.
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    server = ExtractionServer(args.socket, args.workers)
+    print('Listening on', args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Databases holding the Data Tables profiled by `ExtractMetadata`.
+
+`ExtractMetadata` reads a Data Table through a data source, which answers
+the table level, catalog and column queries in the SQL of its database.
+Metadata is written to the metabase in PostgreSQL whatever the source.
+
+"""
+
+from psycopg2 import sql
+
+from . import extract_metadata_helper
+
+
+class DataSource():
+    """Interface of the data sources of `ExtractMetadata`.
+
+    Tables are named by schema and table name, as in
+    `metabase.data_table.file_table_name`.
+
+    """
+
+    def wrap_cursor(self, wrap):
+        """Wrap the cursor of the source for SQL tracing and metrics.
+
+        Args:
+            wrap (function): Takes a psycopg2 cursor and returns the cursor
+                to use instead.
+
+        Sources that are not queried with a psycopg2 cursor are left as they
+        are.
+
+        """
+
+    def get_table_level_metadata(self, schema_name, table_name):
+        """Return the number of rows and columns and the size of a table.
+
+        Returns:
+            (int, int, int): Number of rows, number of columns and size in
+                bytes.
+
+        """
+        raise NotImplementedError
+
+    def get_columns(self, schema_name, table_name):
+        """Return the names and types of the columns of a table.
+
+        Returns:
+            ([(str, str)]): Column names and data types, in the order of the
+                columns. Data types are named as in PostgreSQL's
+                INFORMATION_SCHEMA.COLUMNS, e.g. 'integer', so that they are
+                understood by `extract_metadata_helper.plan_column()`.
+
+        """
+        raise NotImplementedError
+
+    def execute_column_plan(self, plan, categorical_threshold, schema_name,
+                            table_name):
+        """Run the scans of a column plan.
+
+        Returns:
+            (column_data): Type and contents of the column.
+
+        Raises:
+            ValueError: If an overridden column cannot be converted to the type
+                it is overridden with.
+
+        """
+        raise NotImplementedError
+
+    def iter_row_batches(self, columns, schema_name, table_name, batch_rows):
+        """Yield the values of some columns of every row, in batches.
+
+        The batches are fetched while they are consumed, so the rows of a
+        table are never all held in memory. Close the generator to stop
+        early.
+
+        Args:
+            columns ([str]): Column names.
+            batch_rows (int): Number of rows per batch.
+
+        Yields:
+            ([tuple]): Up to batch_rows rows of column values.
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the connection of the source, if it opened it."""
+
+
+class PostgresDataSource(DataSource):
+    """Tables of a PostgreSQL database, queried with psycopg2."""
+
+    def __init__(self, conn, close_conn=False):
+        """
+        Args:
+            conn (psycopg2.extensions.connection): Connection to the data
+                database. Set to autocommit.
+            close_conn (bool): Close the connection with the source.
+
+        """
+        self.conn = conn
+        self.conn.autocommit = True
+        self.cursor = self.conn.cursor()
+        self.close_conn = close_conn
+
+    def wrap_cursor(self, wrap):
+        self.cursor = wrap(self.cursor)
+
+    def get_table_level_metadata(self, schema_name, table_name):
+        self.cursor.execute(
+            sql.SQL('SELECT COUNT(*) as n_rows FROM {}.{};').format(
+                sql.Identifier(schema_name),
+                sql.Identifier(table_name),
+            )
+        )
+        n_rows = self.cursor.fetchone()[0]
+
+        self.cursor.execute(
+            sql.SQL("""
+                SELECT COUNT(*)
+                FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE
+                    TABLE_SCHEMA = %s
+                    AND TABLE_NAME = %s
+            """),
+            [schema_name, table_name]
+        )
+        n_cols = self.cursor.fetchone()[0]
+
+        self.cursor.execute(
+            sql.SQL('SELECT PG_RELATION_SIZE(%s);'),
+            [schema_name + '.' + table_name],
+        )
+        table_size = self.cursor.fetchone()[0]
+
+        return n_rows, n_cols, table_size
+
+    def get_columns(self, schema_name, table_name):
+        self.cursor.execute(
+                """
+                SELECT column_name, data_type FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE table_schema = %(schema)s
+                AND table_name  = %(table)s
+                ORDER BY ordinal_position;
+                """,
+                {
+                    'schema': schema_name,
+                    'table': table_name
+                },
+                )
+
+        columns = self.cursor.fetchall()
+        return([(c[0], c[1]) for c in columns])
+
+    def execute_column_plan(self, plan, categorical_threshold, schema_name,
+                            table_name):
+        return extract_metadata_helper.execute_column_plan(
+            self.cursor,
+            plan,
+            categorical_threshold,
+            schema_name,
+            table_name,
+        )
+
+    def iter_row_batches(self, columns, schema_name, table_name, batch_rows):
+        # A server-side cursor lives in a transaction, which the source being
+        # in autocommit mode is opened explicitly.
+        self.cursor.execute('BEGIN')
+        try:
+            self.cursor.execute(
+                sql.SQL(
+                    'DECLARE key_rows NO SCROLL CURSOR FOR '
+                    'SELECT {} FROM {}.{}'
+                ).format(
+                    sql.SQL(', ').join(map(sql.Identifier, columns)),
+                    sql.Identifier(schema_name),
+                    sql.Identifier(table_name),
+                )
+            )
+
+            while True:
+                self.cursor.execute(
+                    'FETCH %s FROM key_rows', [batch_rows])
+                batch = self.cursor.fetchall()
+                if not batch:
+                    break
+                yield batch
+        finally:
+            self.cursor.execute('ROLLBACK')
+
+    def close(self):
+        self.cursor.close()
+        if self.close_conn:
+            self.conn.close()
@@ -0,0 +1,261 @@
+"""Vectorized parsing of date strings in the formats of TO_DATE().
+
+A format such as ``'YYYY-MM-DD'`` or ``'DD-MON-YY'`` is compiled once into a
+`DateParser` of fixed field offsets. Batches of strings are then parsed with
+numpy into ``datetime64[D]`` arrays, without a Python call per value. Values
+that do not follow the format, or are not valid dates, become NaT and are
+counted instead of raising, so that dates can be profiled client side, e.g.
+for sources read outside PostgreSQL.
+
+The fields are those of `extract_metadata_helper.DATE_FIELD_PATTERNS`, and a
+value is valid if it matches the guard of its format and is a calendar date.
+Like TO_DATE(), two-digit years are taken to be the nearest to 2020, i.e.
+00 to 69 are 2000 to 2069, and fields missing from the format default to 1.
+
+"""
+
+from collections import namedtuple
+import functools
+
+import numpy as np
+
+
+# Fields of date formats and their widths in characters, longest fields
+# first as in `extract_metadata_helper.DATE_FIELD_PATTERNS`.
+DATE_FIELD_WIDTHS = [
+    ('YYYY', 4),
+    ('HH24', 2),
+    ('MON', 3),
+    ('YY', 2),
+    ('MM', 2),
+    ('DD', 2),
+    ('MI', 2),
+    ('SS', 2),
+]
+
+# Largest valid value of the time fields, which are checked but not kept.
+TIME_FIELD_MAXIMA = {'HH24': 23, 'MI': 59, 'SS': 59}
+
+MONTH_ABBREVIATIONS = ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+                       'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')
+
+PARSED_DATES = namedtuple('parsed_dates',
+                          ['dates', 'invalid_count', 'missing_count'])
+
+DATE_FIELD = namedtuple('date_field', ['name', 'offset', 'width'])
+
+
+def get_month_lookup():
+    """Return month numbers by base-26 code of upper case abbreviations."""
+
+    lookup = np.zeros(26 ** 3, dtype=np.int32)
+    for month, abbreviation in enumerate(MONTH_ABBREVIATIONS, 1):
+        letters = [ord(char) - ord('A') for char in abbreviation]
+        lookup[(letters[0] * 26 + letters[1]) * 26 + letters[2]] = month
+
+    return lookup
+
+
+MONTH_LOOKUP = get_month_lookup()
+
+
+class DateParser():
+    """Parser of the values of one date format.
+
+    Args:
+        date_format (str): Format of TO_DATE() made of the fields of
+            `DATE_FIELD_WIDTHS` and separators.
+
+    Raises:
+        ValueError: If the format has fields that are not supported.
+
+    """
+
+    def __init__(self, date_format):
+
+        self.date_format = date_format
+        self.fields = []
+        self.separators = []
+
+        # Positions in the format and offsets in the values differ after
+        # fields such as HH24 that are longer than their values.
+        position = 0
+        offset = 0
+        while position < len(date_format):
+            for field, width in DATE_FIELD_WIDTHS:
+                if date_format.upper().startswith(field, position):
+                    self.fields.append(DATE_FIELD(field, offset, width))
+                    position += len(field)
+                    offset += width
+                    break
+            else:
+                char = date_format[position]
+                if char.isalnum():
+                    raise ValueError(
+                        'Unsupported field in date format {}'.format(
+                            date_format))
+                self.separators.append((offset, ord(char)))
+                position += 1
+                offset += 1
+
+        self.width = offset
+
+    def parse(self, values):
+        """Parse a batch of values.
+
+        Args:
+            values (iterable): Strings, or None for missing values. A numpy
+                array of strings is parsed without copying its values to
+                Python objects.
+
+        Returns:
+            (PARSED_DATES): ``datetime64[D]`` array with NaT for missing and
+                invalid values, and the counts of both.
+
+        """
+        strings = np.asarray(values)
+        if strings.dtype.kind in 'US':
+            missing = np.zeros(strings.shape, dtype=bool)
+        else:
+            strings = np.asarray(values, dtype=object)
+            missing = np.equal(strings, None)
+            strings = np.where(missing, '', strings)
+
+        # One more character than the format, so that longer values are not
+        # truncated into valid ones.
+        codes = (
+            strings.astype('U{}'.format(self.width + 1))
+            .view(np.uint32)
+            .reshape(-1, self.width + 1)
+        )
+        valid = codes[:, self.width] == 0
+        for offset, char in self.separators:
+            valid &= codes[:, offset] == char
+
+        values_by_field = {}
+        for field in self.fields:
+            field_codes = codes[:, field.offset:field.offset + field.width]
+            if field.name == 'MON':
+                values_by_field['MM'] = self.parse_month(field_codes, valid)
+            else:
+                values_by_field[field.name] = self.parse_number(
+                    field_codes, valid)
+
+        if 'YYYY' in values_by_field:
+            year = values_by_field['YYYY']
+            valid &= year > 0
+        elif 'YY' in values_by_field:
+            year = values_by_field['YY']
+            year += np.where(year < 70, 2000, 1900)
+        else:
+            year = np.ones(len(codes), dtype=np.int32)
+
+        month = values_by_field.get('MM', np.ones(len(codes), dtype=np.int32))
+        day = values_by_field.get('DD', np.ones(len(codes), dtype=np.int32))
+        valid &= (month >= 1) & (month <= 12) & (day >= 1)
+        for field, maximum in TIME_FIELD_MAXIMA.items():
+            if field in values_by_field:
+                valid &= values_by_field[field] <= maximum
+
+        # Garbage in invalid rows must not overflow the calendar arithmetic.
+        year = np.where(valid, year, 1970)
+        month = np.where(valid, month, 1)
+        day = np.where(valid, day, 1)
+
+        month_start = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+        days_in_month = (
+            (month_start + 1).astype('datetime64[D]')
+            - month_start.astype('datetime64[D]')
+        ).astype(np.int32)
+        valid &= day <= days_in_month
+
+        dates = np.full(len(codes), np.datetime64('NaT'),
+                        dtype='datetime64[D]')
+        dates[valid] = (
+            month_start[valid].astype('datetime64[D]') + (day[valid] - 1)
+        )
+        missing = missing.reshape(-1)
+
+        return PARSED_DATES(
+            dates,
+            int(np.count_nonzero(~valid & ~missing)),
+            int(np.count_nonzero(missing)),
+        )
+
+    @staticmethod
+    def parse_number(field_codes, valid):
+        """Return the numbers in `field_codes`, invalidating non-digits."""
+
+        # Codes are unsigned, so characters before '0' wrap around above 9.
+        digits = field_codes - np.uint32(ord('0'))
+        valid &= (digits <= 9).all(axis=1)
+        weights = 10 ** np.arange(field_codes.shape[1] - 1, -1, -1)
+
+        return (np.clip(digits, 0, 9) @ weights).astype(np.int32)
+
+    @staticmethod
+    def parse_month(field_codes, valid):
+        """Return the numbers of month abbreviations in any case."""
+
+        # Clearing bit 5 upper cases ASCII letters.
+        letters = (field_codes & np.uint32(~0x20 & 0xFFFF)) - np.uint32(
+            ord('A'))
+        is_letter = (letters < 26).all(axis=1)
+        letters = np.where(is_letter[:, None], letters, 0)
+        month = MONTH_LOOKUP[
+            (letters[:, 0] * 26 + letters[:, 1]) * 26 + letters[:, 2]]
+        valid &= is_letter & (month > 0)
+
+        return month
+
+
+@functools.lru_cache(maxsize=None)
+def compile_date_format(date_format):
+    """Return the `DateParser` of a date format, compiled once."""
+
+    return DateParser(date_format)
+
+
+def compile_date_formats(date_format_dict):
+    """Return parsers by column name of a date format dictionary.
+
+    Args:
+        date_format_dict (dict): Column name -> date format of TO_DATE().
+
+    Returns:
+        (dict): Column name -> `DateParser`.
+
+    """
+    return {
+        col: compile_date_format(date_format)
+        for col, date_format in date_format_dict.items()
+    }
+
+
+def parse_dates(values, date_format):
+    """Parse a batch of values in a date format.
+
+    See `DateParser.parse()`.
+
+    """
+    return compile_date_format(date_format).parse(values)
+
+
+def get_date_metadata(dates):
+    """Get metadata from parsed dates.
+
+    Like `extract_metadata_helper.get_date_metadata()`, for a
+    ``datetime64[D]`` array in which NaT marks missing values.
+
+    Returns:
+        (datetime.date, datetime.date): Minimum and maximum, or None if all
+            values are missing.
+
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    dates = dates[~np.isnat(dates)]
+
+    if not dates.size:
+        return (None, None)
+
+    return (dates.min().item(), dates.max().item())
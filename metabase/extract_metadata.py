@@ -1,52 +1,300 @@
 """Class to extract metadata from a Data Table"""
 
-import getpass
+import contextlib
+import functools
+import itertools
+import os
+import tracemalloc
 
 import psycopg2
 import psycopg2.extras
-from psycopg2 import sql
 
 from . import settings
+from . import data_sources
 from . import extract_metadata_helper
+from . import instrumentation
+from . import prometheus
+
+
+class RunAborted(Exception):
+    """The run was stopped before it finished, e.g. by a lost job lease."""
 
 
 class ExtractMetadata():
     """Class to extract metadata from a Data Table."""
 
-    def __init__(self, data_table_id):
+    def __init__(self, data_table_id, data_conn=None, metabase_conn=None,
+                 data_source=None):
         """Set Data Table ID and connect to database.
 
+        Open connections can be passed in to reuse them across tables, e.g.
+        from a pool. They are left open after processing.
+
         Args:
            data_table_id (int): ID associated with this Data Table.
+           data_conn (psycopg2.extensions.connection): Connection to the data
+               database. A new connection is opened if None.
+           metabase_conn (psycopg2.extensions.connection): Connection to the
+               metabase. A new connection is opened per transaction if None.
+           data_source (data_sources.DataSource): Source of the Data Table
+               if it is not in the PostgreSQL data database, e.g. a
+               `sqlite_source.SqliteDataSource`. `data_conn` is ignored if
+               set. The source is closed after processing.
 
         """
         self.data_table_id = data_table_id
 
         self.metabase_connection_string = settings.metabase_connection_string
+        self.metabase_conn = metabase_conn
+
+        if data_source is None:
+            close_data_conn = data_conn is None
+            if data_conn is None:
+                data_conn = psycopg2.connect(settings.data_connection_string)
+            data_source = data_sources.PostgresDataSource(
+                data_conn,
+                close_conn=close_data_conn,
+            )
+        self.data_source = data_source
 
-        self.data_conn = psycopg2.connect(settings.data_connection_string)
-        self.data_conn.autocommit = True
-        self.data_cur = self.data_conn.cursor()
+        self.metrics = instrumentation.RunMetrics(data_table_id, enabled=False)
+        self.trace_sql = False
+        self.abort_event = None
 
     def process_table(self, categorical_threshold=10, type_overrides={},
-                      date_format_dict={}):
-        """Update the metabase with metadata from this Data Table."""
+                      date_format_dict={}, histogram_bins=10,
+                      histogram_method='equi_width', record_metrics=False,
+                      log_metrics=False, trace_sql=False,
+                      explain_filepath=None, profile_memory=False,
+                      prometheus_textfile_dir=None, resume=False,
+                      date_formats=None,
+                      candidate_key_pairs=(
+                          extract_metadata_helper.KEY_CHECK_MAX_PAIRS),
+                      abort_event=None):
+        """Update the metabase with metadata from this Data Table.
+
+        Table level metadata, every column and the GMETA cache of this Data
+        Table are committed in transactions of their own, so a failed run
+        keeps the columns processed before the failure. Once every column is
+        processed, the Data Table is validated against its expectations, see
+        `validate_table()`.
+
+        Args:
+            histogram_bins (int): Number of histogram bins of numeric columns
+                and of text lengths of text columns. No histogram is computed
+                if 0 or None.
+            histogram_method (str): 'equi_width' or 'equi_depth'.
+            record_metrics (bool): Store wall time, rows and bytes fetched and
+                queries issued of every stage, per column and for the whole
+                table, in metabase.profiling_run. Metrics are stored even if
+                the run fails.
+            log_metrics (bool): Log the metrics of every stage as JSON with
+                the `metabase.instrumentation` logger.
+            trace_sql (bool): Log every statement issued against the data and
+                metabase databases with its duration and row count.
+            explain_filepath (str): Diagnostic mode. Append the plans of the
+                SELECT statements issued against the data database, captured
+                with EXPLAIN (ANALYZE, BUFFERS), to this file as JSON lines.
+                Every such statement runs twice.
+            profile_memory (bool): Record process RSS before and after every
+                stage and the tracemalloc peak during it with the other
+                metrics, and print the columns using the most memory at the
+                end of the run. Tracing allocations slows the run down.
+            prometheus_textfile_dir (str): Write the metrics of the run to
+                this directory for node_exporter's textfile collector, also
+                if the run fails.
+            resume (bool): Skip columns already in metabase.column_info for
+                this Data Table, e.g. to finish a run that failed or was
+                killed.
+            date_formats ([str]): Candidate formats of TO_DATE() tried on a
+                sample of text columns without a format in
+                `date_format_dict`. `DEFAULT_DATE_FORMATS` of
+                `extract_metadata_helper` if None.
+            candidate_key_pairs (int): Largest number of pairs of columns
+                checked for uniqueness by reading their rows. Columns that
+                are unique on their own are found from their counts. No pair
+                is checked if 0.
+            abort_event (threading.Event): Stop the run once set, e.g. by
+                the heartbeat thread of a worker that lost its job. It is
+                checked before every column and before the candidate keys,
+                validation and GMETA cache are updated, so nothing is
+                committed after it is set but the transaction in progress.
+
+        Raises:
+            RunAborted: If `abort_event` was set.
+
+        """
+        self.abort_event = abort_event
+        self.metrics = instrumentation.RunMetrics(
+            self.data_table_id,
+            enabled=(record_metrics or log_metrics or profile_memory
+                     or prometheus_textfile_dir is not None),
+            log_metrics=log_metrics,
+            profile_memory=profile_memory,
+        )
+        start_tracemalloc = profile_memory and not tracemalloc.is_tracing()
+        if start_tracemalloc:
+            tracemalloc.start()
+
+        self.trace_sql = trace_sql or explain_filepath is not None
+        explain_file = None
+        if explain_filepath is not None:
+            explain_file = open(explain_filepath, 'a')
+
+        self.data_source.wrap_cursor(
+            functools.partial(
+                self.__wrap_cursor,
+                database='data',
+                explain_file=explain_file,
+            )
+        )
+
+        failed = True
+        try:
+            with self.__metabase_connection() as conn:
+                with self.metrics.stage('total'):
+                    self.__process_table(
+                        conn,
+                        categorical_threshold,
+                        type_overrides,
+                        date_format_dict,
+                        histogram_bins,
+                        histogram_method,
+                        resume,
+                        date_formats,
+                        candidate_key_pairs,
+                    )
+            failed = False
+
+        finally:
+            if explain_file is not None:
+                explain_file.close()
+
+            if start_tracemalloc:
+                tracemalloc.stop()
+
+            if profile_memory:
+                print('Columns using the most memory:')
+                print(instrumentation.format_memory_report(
+                    self.metrics.top_memory_stages()))
+
+            if record_metrics:
+                with self.__metabase_connection() as conn, conn:
+                    with conn.cursor() as cursor:
+                        self.metrics.save(cursor)
+
+            if prometheus_textfile_dir is not None:
+                prometheus.write_textfile(
+                    prometheus_textfile_dir,
+                    self.metrics,
+                    failed,
+                )
+
+            self.data_source.close()
+
+    @contextlib.contextmanager
+    def __metabase_connection(self):
+        """Yield the metabase connection, or a new one closed afterwards."""
+
+        if self.metabase_conn is not None:
+            yield self.metabase_conn
+            return
 
-        with psycopg2.connect(self.metabase_connection_string) as conn:
-            with conn.cursor() as cursor:
+        conn = psycopg2.connect(self.metabase_connection_string)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def __check_aborted(self):
+        """Raise RunAborted if the abort event of the run is set."""
+
+        if self.abort_event is not None and self.abort_event.is_set():
+            raise RunAborted(
+                'Run of Data Table {} aborted'.format(self.data_table_id))
+
+    def __process_table(self, conn, categorical_threshold, type_overrides,
+                        date_format_dict, histogram_bins, histogram_method,
+                        resume, date_formats, candidate_key_pairs):
+        """Update the metabase in one transaction per column.
+
+        Table level metadata, candidate keys, validation and the GMETA cache
+        are updated in transactions of their own.
+
+        """
+        with conn, conn.cursor() as cursor:
+            cursor = self.__wrap_cursor(cursor, 'metabase')
+
+            with self.metrics.stage('catalog'):
                 schema_name, table_name = self.__get_table_name(cursor)
+
+            with self.metrics.stage('table_level'):
                 self._get_table_level_metadata(cursor, schema_name, table_name)
-                self._get_column_level_metadata(
+
+        with conn.cursor() as cursor:
+            cursor = self.__wrap_cursor(cursor, 'metabase')
+
+            self._get_column_level_metadata(
+                cursor,
+                schema_name,
+                table_name,
+                categorical_threshold,
+                type_overrides,
+                date_format_dict,
+                histogram_bins,
+                histogram_method,
+                resume,
+                date_formats,
+            )
+
+        self.__check_aborted()
+        with conn, conn.cursor() as cursor:
+            cursor = self.__wrap_cursor(cursor, 'metabase')
+
+            with self.metrics.stage('candidate_keys'):
+                self._get_candidate_keys(
                     cursor,
                     schema_name,
                     table_name,
-                    categorical_threshold,
-                    type_overrides,
-                    date_format_dict,
+                    candidate_key_pairs,
+                )
+
+        self.__check_aborted()
+        with conn, conn.cursor() as cursor:
+            cursor = self.__wrap_cursor(cursor, 'metabase')
+
+            with self.metrics.stage('validation'):
+                extract_metadata_helper.validate_data_table(
+                    cursor,
+                    self.data_table_id,
+                )
+
+        self.__check_aborted()
+        with conn, conn.cursor(
+            cursor_factory=psycopg2.extras.DictCursor
+                ) as dict_cursor:
+            dict_cursor = self.__wrap_cursor(dict_cursor, 'metabase')
+
+            with self.metrics.stage('gmeta_cache'):
+                extract_metadata_helper.refresh_gmeta_cache(
+                    dict_cursor,
+                    [self.data_table_id],
                 )
 
-        self.data_cur.close()
-        self.data_conn.close()
+    def __wrap_cursor(self, cursor, database, explain_file=None):
+        """Wrap a cursor for SQL tracing and metrics if they are enabled."""
+
+        if self.trace_sql:
+            cursor = instrumentation.TracingCursor(
+                cursor,
+                database,
+                explain_file,
+            )
+
+        if self.metrics.enabled:
+            cursor = instrumentation.MetricsCursor(cursor, self.metrics)
+
+        return cursor
 
     def _get_table_level_metadata(self, metabase_cur, schema_name, table_name):
         """Extract table level metadata and store it in the metabase.
@@ -58,55 +306,21 @@ class ExtractMetadata():
         Size is in bytes
 
         """
-        self.data_cur.execute(
-            sql.SQL('SELECT COUNT(*) as n_rows FROM {}.{};').format(
-                sql.Identifier(schema_name),
-                sql.Identifier(table_name),
-            )
-        )
-        n_rows = self.data_cur.fetchone()[0]
-
-        self.data_cur.execute(
-            sql.SQL("""
-                SELECT COUNT(*)
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE
-                    TABLE_SCHEMA = %s
-                    AND TABLE_NAME = %s
-            """),
-            [schema_name, table_name]
-        )
-        n_cols = self.data_cur.fetchone()[0]
-
-        self.data_cur.execute(
-            sql.SQL('SELECT PG_RELATION_SIZE(%s);'),
-            [schema_name + '.' + table_name],
-        )
-        table_size = self.data_cur.fetchone()[0]
+        n_rows, n_cols, table_size = (
+            self.data_source.get_table_level_metadata(schema_name, table_name))
 
         if n_rows == 0:
             raise ValueError('Selected data table has 0 rows.')
             # This will also capture n_cols == 0 and size == 0.
 
-        metabase_cur.execute(
-            """
-                UPDATE metabase.data_table
-                SET
-                    number_rows = %(n_rows)s,
-                    number_columns = %(n_cols)s,
-                    size = %(table_size)s,
-                    updated_by = %(user_name)s,
-                    date_last_updated = (SELECT CURRENT_TIMESTAMP)
-                WHERE data_table_id = %(data_table_id)s
-                ;
-            """,
-            {
-                'n_rows': n_rows,
-                'n_cols': n_cols,
-                'table_size': table_size,
-                'user_name': getpass.getuser(),
-                'data_table_id': self.data_table_id,
-            }
+        self.metrics.rows_scanned = n_rows
+
+        extract_metadata_helper.update_table_level_metadata(
+            metabase_cur,
+            self.data_table_id,
+            n_rows,
+            n_cols,
+            table_size,
         )
 
         # TODO: Update create_by and date_created
@@ -114,49 +328,145 @@ class ExtractMetadata():
 
     def _get_column_level_metadata(
             self, metabase_cur, schema_name, table_name, categorical_threshold,
-            type_overrides, date_format_dict):
+            type_overrides, date_format_dict, histogram_bins=None,
+            histogram_method='equi_width', resume=False, date_formats=None):
         """Extract column level metadata and store it in the metabase.
 
         Process columns one by one, identify or infer type, update Column Info
-        and corresponding column table.
+        and corresponding column table. Histograms of numeric values and text
+        lengths are computed from the value frequencies fetched for the other
+        statistics.
+
+        Each column is committed in a transaction of its own, so its Column
+        Info row marks it as done. If `resume` is set, columns with a Column
+        Info row are skipped, e.g. to finish a run that was killed. Otherwise
+        metadata of columns processed before is replaced in place, and
+        metadata of columns no longer in the table is deleted.
+
+        Before any data is read, the scans of every column are planned from
+        the catalog, `type_overrides` and `date_format_dict`, so overridden
+        columns are scanned once and type probes that cannot change the
+        detected type are skipped.
+
+        Each column is timed in three stages: 'type_detection' (the scans of
+        its plan), 'update' (statistics in Python and metabase inserts) and
+        'histogram'. Text columns are summarized while their values are
+        streamed, within 'type_detection'. Memory is profiled per stage as
+        well.
 
         """
 
-        column_names = self.__get_column_names(schema_name, table_name)
+        if date_formats is None:
+            date_formats = extract_metadata_helper.DEFAULT_DATE_FORMATS
+
+        with self.metrics.stage('catalog'):
+            column_plans = [
+                extract_metadata_helper.plan_column(
+                    col_name,
+                    catalog_type,
+                    type_overrides,
+                    date_format_dict,
+                    date_formats,
+                )
+                for col_name, catalog_type in self.__get_columns(
+                    schema_name,
+                    table_name,
+                )
+            ]
+        column_names = [plan.column_name for plan in column_plans]
+
+        profiled_columns = set()
+        with metabase_cur.connection:
+            # Re-profiled tables may have lost columns.
+            extract_metadata_helper.delete_missing_columns(
+                metabase_cur,
+                self.data_table_id,
+                column_names,
+            )
+            if resume:
+                profiled_columns = self.__get_profiled_columns(metabase_cur)
+
+        for plan in column_plans:
+            if plan.column_name in profiled_columns:
+                continue
 
-        for col_name in column_names:
+            self.__check_aborted()
+            with metabase_cur.connection:
+                self.__get_column_metadata(
+                    metabase_cur,
+                    schema_name,
+                    table_name,
+                    plan,
+                    categorical_threshold,
+                    histogram_bins,
+                    histogram_method,
+                )
+
+    def _get_candidate_keys(self, metabase_cur, schema_name, table_name,
+                            max_pairs):
+        """Find the candidate keys of the table and store them.
+
+        Single columns are keys if their counts in Column Info say so. Pairs
+        of columns whose distinct counts allow it are read from the data
+        database, in batches, until a row repeats.
+
+        """
+        unique_columns, pairs = extract_metadata_helper.get_candidate_keys(
+            extract_metadata_helper.select_key_columns(
+                metabase_cur,
+                self.data_table_id,
+            ),
+            max_pairs,
+        )
+
+        candidate_keys = [[col_name] for col_name in unique_columns]
+        for pair in pairs:
+            with contextlib.closing(self.data_source.iter_row_batches(
+                    pair,
+                    schema_name,
+                    table_name,
+                    extract_metadata_helper.KEY_CHECK_BATCH_ROWS,
+                    )) as row_batches:
+                if not extract_metadata_helper.has_duplicate_rows(
+                        row_batches):
+                    candidate_keys.append(list(pair))
+
+        extract_metadata_helper.replace_candidate_keys(
+            metabase_cur,
+            self.data_table_id,
+            candidate_keys,
+        )
+
+    def __get_column_metadata(
+            self, metabase_cur, schema_name, table_name, plan,
+            categorical_threshold, histogram_bins, histogram_method):
+        """Extract metadata of one column and store it in the metabase."""
+
+        col_name = plan.column_name
+
+        with self.metrics.stage('type_detection', col_name):
             column_results = self.__get_column_type(
                 schema_name,
                 table_name,
-                col_name,
+                plan,
                 categorical_threshold,
-                date_format_dict,
             )
-            if col_name in type_overrides:
-                column_type = type_overrides[col_name]
-                if column_type in ['numeric', 'date']:
-                    msg = ('Invalid type override. Column {} cannot be '
-                           'converted to type {}').format(
-                               col_name,
-                               column_type)
-                    raise ValueError(msg)
-                if column_type == 'text':
-                    column_data = [str(i) for i in column_results.data]
-                else:
-                    column_data = column_results.data
-            else:
-                column_type = column_results.type
-                column_data = column_results.data
+        column_type = column_results.type
+        column_data = column_results.data
+        self.metrics.column_types[column_type] += 1
 
+        with self.metrics.stage('update', col_name):
             if column_type == 'numeric':
-                self.__update_numeric_metadata(
+                column_id = self.__update_numeric_metadata(
                     metabase_cur,
                     col_name, column_data)
+                histogram_type = 'numeric'
             elif column_type == 'text':
-                self.__update_text_metadata(
+                column_id = self.__update_text_metadata(
                     metabase_cur,
                     col_name,
                     column_data)
+                histogram_type = 'text_length'
             elif column_type == 'date':
                 self.__update_date_metadata(
                     metabase_cur,
@@ -170,27 +480,50 @@ class ExtractMetadata():
             else:
                 raise ValueError('Unknown column type')
 
-    def __get_column_names(self, schema_name, table_name):
-        """Returns the names of the columns in the data table.
+        if histogram_bins and column_type in ('numeric', 'text'):
+            with self.metrics.stage('histogram', col_name):
+                extract_metadata_helper.insert_histogram_bins(
+                    metabase_cur,
+                    col_name,
+                    column_id,
+                    self.data_table_id,
+                    histogram_type,
+                    histogram_method,
+                    extract_metadata_helper.get_histogram_from_counts(
+                        extract_metadata_helper.get_histogram_counts(
+                            column_results),
+                        histogram_bins,
+                        histogram_method,
+                    ),
+                )
+
+    def __get_profiled_columns(self, metabase_cur):
+        """Return the names of the columns with a Column Info row.
 
         Returns:
-            (str): Column names.
+            (set): Column names.
 
         """
-        self.data_cur.execute(
-                """
-                SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE table_schema = %(schema)s
-                AND table_name  = %(table)s;
-                """,
-                {
-                    'schema': schema_name,
-                    'table': table_name
-                },
-                )
+        metabase_cur.execute(
+            """
+            SELECT column_name
+            FROM metabase.column_info
+            WHERE data_table_id = %(data_table_id)s;
+            """,
+            {'data_table_id': self.data_table_id},
+        )
+
+        return {row[0] for row in metabase_cur.fetchall()}
 
-        columns = self.data_cur.fetchall()
-        return([c[0] for c in columns])
+    def __get_columns(self, schema_name, table_name):
+        """Returns the names and types of the columns in the data table.
+
+        Returns:
+            ([(str, str)]): Column names and catalog data types, in the order
+                of the columns.
+
+        """
+        return self.data_source.get_columns(schema_name, table_name)
 
     def __get_table_name(self, metabase_cur):
         """Return the the table schema and name using the Data Table ID.
@@ -224,24 +557,23 @@ class ExtractMetadata():
 
         return schema_name_table_name_tp
 
-    def __get_column_type(self, schema_name, table_name, col,
-                          categorical_threshold, date_format_dict):
+    def __get_column_type(self, schema_name, table_name, plan,
+                          categorical_threshold):
         """Identify or infer column type.
 
-        Infers the column type.
+        Runs the scans of the column plan.
 
         Returns:
-          str: 'numeric', 'text', 'date' or 'code'
+            (column_data): Type ('numeric', 'text', 'date' or 'code') and
+                contents of the column.
 
         """
 
-        column_data = extract_metadata_helper.get_column_type(
-            self.data_cur,
-            col,
+        column_data = self.data_source.execute_column_plan(
+            plan,
             categorical_threshold,
             schema_name,
             table_name,
-            date_format_dict,
         )
 
         return column_data
@@ -254,7 +586,7 @@ class ExtractMetadata():
 
         """
 
-        extract_metadata_helper.update_numeric(
+        return extract_metadata_helper.update_numeric(
             metabase_cur,
             col_name,
             col_data,
@@ -269,7 +601,7 @@ class ExtractMetadata():
 
         """
 
-        extract_metadata_helper.update_text(
+        return extract_metadata_helper.update_text(
             metabase_cur,
             col_name,
             col_data,
@@ -284,7 +616,7 @@ class ExtractMetadata():
 
         """
 
-        extract_metadata_helper.update_date(
+        return extract_metadata_helper.update_date(
             metabase_cur,
             col_name,
             col_data,
@@ -299,7 +631,7 @@ class ExtractMetadata():
         """
         # TODO: modify categorical_threshold to take percentage arguments.
 
-        extract_metadata_helper.update_code(
+        return extract_metadata_helper.update_code(
             metabase_cur,
             col_name,
             col_data,
@@ -311,30 +643,226 @@ class ExtractMetadata():
         Export GMETA (metadata in JSON format) for a processed table given
         data_table_id.
 
+        The cached GMETA document is exported if it is fresh. Otherwise the
+        document is rendered from the metadata tables and cached again.
+
         """
-        with psycopg2.connect(
-            self.metabase_connection_string
-                ) as metabase_conn:
+        with self.__metabase_connection() as metabase_conn, metabase_conn:
             with metabase_conn.cursor(
                 cursor_factory=psycopg2.extras.DictCursor
                     ) as metabase_cur:
 
-                table_gmeta_fields_dict = extract_metadata_helper.\
-                    select_table_level_gmeta_fields(
-                        metabase_cur,
-                        self.data_table_id,
-                    )
-
-                column_gmeta_fields_dict = extract_metadata_helper.\
-                    select_column_level_gmeta_fields(
-                        metabase_cur,
-                        self.data_table_id,
-                    )
+                gmeta_dict = extract_metadata_helper.select_gmeta(
+                    metabase_cur,
+                    self.data_table_id,
+                )
 
-        extract_metadata_helper.export_gmeta_in_json(
-            table_gmeta_fields_dict,
-            column_gmeta_fields_dict,
+        extract_metadata_helper.dump_gmeta_in_json(
+            gmeta_dict,
             output_filepath,
         )
 
         print('Exported GMETA to', output_filepath)
+
+
+def export_many(data_table_ids, output_path, output_format='ndjson',
+                batch_size=500):
+    """
+    Export GMETA for many processed tables.
+
+    Metadata is selected in batches of `batch_size` Data Tables and every
+    GMETA document is serialized as soon as it is shaped, so memory stays flat
+    regardless of the number of tables.
+
+    Args:
+        data_table_ids (iterable of int): Data Tables to export.
+        output_path (str): Newline-delimited JSON file if `output_format` is
+            'ndjson'. Existing directory if `output_format` is 'directory', in
+            which one `<data_table_id>.json` file is written per table.
+        output_format (str): 'ndjson' or 'directory'.
+        batch_size (int): Number of Data Tables selected per batch.
+
+    Returns:
+        (int): Number of exported tables.
+
+    """
+    conn = psycopg2.connect(settings.metabase_connection_string)
+    try:
+        with conn:
+            n_exported = _export_gmeta_batches(
+                conn,
+                _batched(data_table_ids, batch_size),
+                output_path,
+                output_format,
+            )
+    finally:
+        conn.close()
+
+    print('Exported GMETA of {} tables to'.format(n_exported), output_path)
+    return n_exported
+
+
+def export_all(output_path, output_format='ndjson', batch_size=500):
+    """
+    Export GMETA for every table in metabase.data_table.
+
+    Data Table IDs are streamed with a server-side cursor. See `export_many()`
+    for the arguments.
+
+    Returns:
+        (int): Number of exported tables.
+
+    """
+    conn = psycopg2.connect(settings.metabase_connection_string)
+    try:
+        with conn, conn.cursor(name='export_all_data_table_ids') as id_cursor:
+            id_cursor.itersize = batch_size
+            id_cursor.execute(
+                """
+                SELECT data_table_id
+                FROM metabase.data_table
+                ORDER BY data_table_id;
+                """
+            )
+
+            n_exported = _export_gmeta_batches(
+                conn,
+                _batched((row[0] for row in id_cursor), batch_size),
+                output_path,
+                output_format,
+            )
+    finally:
+        conn.close()
+
+    print('Exported GMETA of {} tables to'.format(n_exported), output_path)
+    return n_exported
+
+
+def find_joinable_columns(column_id, limit=10):
+    """
+    Find the columns of processed tables sharing values with a column.
+
+    Columns are compared by the MinHash signatures of their distinct values
+    stored in metabase.column_minhash, so no data is read. Estimates have a
+    standard error of about 0.05, and columns of Jaccard similarity below
+    about 0.1 are mostly not found.
+
+    Args:
+        column_id (int): Column of metabase.column_info.
+        limit (int): Largest number of columns returned.
+
+    Returns:
+        ([extract_metadata_helper.joinable_column]): Column ID, Data Table ID,
+            column name, estimated Jaccard similarity and estimated fraction
+            of the distinct values of the column found in the candidate, by
+            descending fraction.
+
+    Raises:
+        ValueError: If the column has no MinHash signature, e.g. it has no
+            value or was processed before signatures were computed.
+
+    """
+    conn = psycopg2.connect(settings.metabase_connection_string)
+    try:
+        with conn, conn.cursor() as cursor:
+            return extract_metadata_helper.select_joinable_columns(
+                cursor,
+                column_id,
+                limit,
+            )
+    finally:
+        conn.close()
+
+
+def validate_table(data_table_id):
+    """
+    Validate the metadata of a processed Data Table against its expectations.
+
+    Statistics of the columns are compared with metabase.numeric_range,
+    text_range, date_range and codebook, so no data is read. Violations are
+    stored in metabase.validation_violation and the validation_status of the
+    Data Table is updated, unless it is 'force_pass' or 'exempt'. Tables are
+    validated by `ExtractMetadata.process_table()`; call this after changing
+    expectations.
+
+    Returns:
+        ([extract_metadata_helper.validation_violation]): Column name,
+            expectation table, statistic, code, expected value, tolerance and
+            observed value of every violation.
+
+    """
+    conn = psycopg2.connect(settings.metabase_connection_string)
+    try:
+        with conn, conn.cursor() as cursor:
+            return extract_metadata_helper.validate_data_table(
+                cursor,
+                data_table_id,
+            )
+    finally:
+        conn.close()
+
+
+def _export_gmeta_batches(metabase_conn, data_table_id_batches, output_path,
+                          output_format):
+    """Write the GMETA documents of batches of Data Tables.
+
+    Returns:
+        (int): Number of exported tables.
+
+    """
+    if output_format not in ('ndjson', 'directory'):
+        raise ValueError('Unknown output format: {}'.format(output_format))
+
+    if output_format == 'directory' and not os.path.isdir(output_path):
+        raise ValueError('{} is not a directory'.format(output_path))
+
+    n_exported = 0
+
+    def iter_documents():
+        nonlocal n_exported
+        with metabase_conn.cursor(
+            cursor_factory=psycopg2.extras.DictCursor
+                ) as metabase_cur:
+            for data_table_ids in data_table_id_batches:
+                for data_table_id, gmeta_dict in \
+                        extract_metadata_helper.iter_gmeta_dicts(
+                            metabase_cur,
+                            data_table_ids,
+                        ):
+                    n_exported += 1
+                    yield data_table_id, gmeta_dict
+
+    if output_format == 'ndjson':
+        def write_ndjson(output_file):
+            for _data_table_id, gmeta_dict in iter_documents():
+                extract_metadata_helper.write_gmeta_document(
+                    output_file,
+                    gmeta_dict,
+                )
+
+        extract_metadata_helper.write_file_atomically(
+            output_path,
+            write_ndjson,
+        )
+
+    else:
+        for data_table_id, gmeta_dict in iter_documents():
+            extract_metadata_helper.write_file_atomically(
+                os.path.join(output_path, '{}.json'.format(data_table_id)),
+                functools.partial(
+                    extract_metadata_helper.write_gmeta_document,
+                    gmeta_dict=gmeta_dict,
+                ),
+            )
+
+    return n_exported
+
+
+def _batched(iterable, batch_size):
+    """Yield lists of at most `batch_size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
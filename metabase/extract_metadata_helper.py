@@ -1,45 +1,313 @@
 """Helper funtions for extract_metadata.
 """
 
+import bisect
 from collections import namedtuple, Counter
+import contextlib
+import decimal
+import fractions
 import getpass
+import hashlib
+import itertools
 import json
+import math
 import os
-import statistics
+import re
+import tempfile
 
 import psycopg2
+import psycopg2.extras
 from psycopg2 import sql
 
+from . import sketches
+
+
+GMETA_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+# Format of the documents rendered by `build_gmeta_dict()`. Bump it whenever
+# their content changes, so that documents cached before are rendered again.
+GMETA_FORMAT_VERSION = 1
+
+COLUMN_COUNTS = namedtuple('column_counts', ['missing', 'non_null', 'distinct'])
+
+# Type of a column and the frequencies of its values, a Counter of value ->
+# frequency in which None counts missing values, or the text_summary of a
+# text column.
+COLUMN_DATA = namedtuple('column_data', ['type', 'data'])
+
+# Statistics of a text column gathered while its values are streamed, by
+# `summarize_text()`.
+TEXT_SUMMARY = namedtuple(
+    'text_summary',
+    ['column_counts', 'length_counts', 'top_values', 'minhash'],
+)
+
+NUMERIC_STATS = namedtuple(
+    'numeric_stats',
+    ['min', 'max', 'mean', 'median', 'std'],
+)
+
+HISTOGRAM_BIN = namedtuple(
+    'histogram_bin',
+    ['bin_number', 'lower_bound', 'upper_bound', 'frequency'],
+)
+
+KEY_COLUMN = namedtuple(
+    'key_column',
+    ['column_name', 'missing', 'non_null', 'distinct'],
+)
+
+VALIDATION_VIOLATION = namedtuple(
+    'validation_violation',
+    ['column_name', 'expectation', 'statistic', 'code', 'expected',
+     'tolerance', 'observed'],
+)
+
+JOINABLE_COLUMN = namedtuple(
+    'joinable_column',
+    ['column_id', 'data_table_id', 'column_name', 'jaccard', 'containment'],
+)
+
+# Scans of a column planned by `plan_column()`.
+COLUMN_PLAN = namedtuple(
+    'column_plan',
+    ['column_name', 'probes', 'override', 'date_format', 'date_formats'],
+)
+
+# Catalog types whose values always cast to NUMERIC, or to DATE.
+NUMERIC_CATALOG_TYPES = {
+    'smallint',
+    'integer',
+    'bigint',
+    'numeric',
+    'real',
+    'double precision',
+}
+DATE_CATALOG_TYPES = {
+    'date',
+    'timestamp without time zone',
+    'timestamp with time zone',
+}
+
+# Candidate formats of TO_DATE() tried on text columns without a configured
+# date format.
+DEFAULT_DATE_FORMATS = (
+    'YYYY-MM-DD',
+    'YYYYMMDD',
+    'MM/DD/YYYY',
+    'DD-MON-YY',
+    'DD-MON-YYYY',
+)
+
+# Non-null values of a column sampled to choose its date format.
+DATE_SAMPLE_ROWS = 1000
+
+# Regular expressions guarding TO_DATE() against values that do not follow a
+# format, by format field, longest fields first.
+DATE_FIELD_PATTERNS = [
+    ('YYYY', '[0-9]{4}'),
+    ('HH24', '([01][0-9]|2[0-3])'),
+    ('MON', '(JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)'),
+    ('YY', '[0-9]{2}'),
+    ('MM', '(0[1-9]|1[0-2])'),
+    ('DD', '(0[1-9]|[12][0-9]|3[01])'),
+    ('MI', '[0-5][0-9]'),
+    ('SS', '[0-5][0-9]'),
+]
+
+# Values tracked by the heavy-hitter summary of a text column, and its most
+# frequent values stored in text_top_value, like the top codes exported.
+TEXT_TOP_VALUES_CAPACITY = 1000
+TEXT_TOP_K = 20
+
+# Distinct values of a column fetched at once from its grouped values.
+VALUE_COUNT_BATCH_ROWS = 10000
+
+# Hash functions of the MinHash signatures of columns, and LSH bands they are
+# cut into. Columns of Jaccard similarity 0.2 share a band with probability
+# 0.93, columns of similarity 0.1 with probability 0.47, so that small
+# columns contained in large ones are found too.
+MINHASH_NUM_PERM = 128
+MINHASH_BANDS = 64
+
+# Keys of more than one column are only looked for among pairs of columns,
+# at most KEY_CHECK_MAX_PAIRS per table, and not in tables of more than
+# KEY_CHECK_MAX_ROWS rows, whose row hashes would not fit in memory. Rows
+# are fetched in batches of KEY_CHECK_BATCH_ROWS.
+KEY_CHECK_MAX_PAIRS = 10
+KEY_CHECK_MAX_ROWS = 10000000
+KEY_CHECK_BATCH_ROWS = 10000
+
+# Tables holding the metadata of each data type, keyed by column_id.
+COLUMN_DETAIL_TABLES = {
+    'numeric': 'numeric_column',
+    'text': 'text_column',
+    'date': 'date_column',
+    'code': 'code_frequency',
+}
+
+
+def update_table_level_metadata(metabase_cursor, data_table_id, n_rows,
+                                n_cols, table_size):
+    """Store the number of rows and columns and the size of a Data Table.
 
-def get_column_type(data_cursor, col, categorical_threshold, schema_name,
-                    table_name, date_format_dict):
-    """Return the column type and the contents of the column."""
-
-    col_type = ''
-    data = []
-
-    numeric_flag, numeric_data = is_numeric(data_cursor, col, schema_name,
-                                            table_name)
-    date_flag, date_data = is_date(data_cursor, col, schema_name, table_name,
-                                   date_format_dict)
-    code_flag, code_data = is_code(data_cursor, col, schema_name, table_name,
-                                   categorical_threshold)
-
-    if numeric_flag:
-        col_type = 'numeric'
-        data = numeric_data
-    elif date_flag:
-        col_type = 'date'
-        data = date_data
-    elif code_flag:
-        col_type = 'code'
-        data = code_data
+    Args:
+        table_size (int): Size in bytes, e.g. of a table or of a file as
+            stored.
+
+    """
+    metabase_cursor.execute(
+        """
+            UPDATE metabase.data_table
+            SET
+                number_rows = %(n_rows)s,
+                number_columns = %(n_cols)s,
+                size = %(table_size)s,
+                updated_by = %(user_name)s,
+                date_last_updated = (SELECT CURRENT_TIMESTAMP)
+            WHERE data_table_id = %(data_table_id)s
+            ;
+        """,
+        {
+            'n_rows': n_rows,
+            'n_cols': n_cols,
+            'table_size': table_size,
+            'user_name': getpass.getuser(),
+            'data_table_id': data_table_id,
+        }
+    )
+
+
+def plan_column(column_name, catalog_type, type_overrides, date_format_dict,
+                date_formats=DEFAULT_DATE_FORMATS):
+    """Plan the scans of a column from the catalog and the configuration.
+
+    Overridden columns are scanned once, as the type they are overridden
+    with. Other columns are probed as date, numeric and code in turn, until a
+    probe succeeds. Probes made pointless by the type of the column in the
+    catalog are left out, e.g. an INTEGER column is only probed as numeric.
+    Text columns without a configured date format are probed as dates on a
+    sample first ('date_sample'), so that columns that are not dates cost no
+    full scan. The code probe always comes last and falls back to text.
+
+    Args:
+        column_name (str): Name of the column.
+        catalog_type (str): data_type of the column in
+            INFORMATION_SCHEMA.COLUMNS.
+        type_overrides (dict): Column name -> 'numeric', 'text', 'date' or
+            'code'.
+        date_format_dict (dict): Column name -> date format of TO_DATE().
+        date_formats ([str]): Candidate formats of TO_DATE() for columns
+            without a configured date format.
+
+    Returns:
+        (column_plan): Probes to run in order and whether the column is
+            overridden.
+
+    Raises:
+        ValueError: If the column is overridden with an unknown type, or a
+            candidate date format is not supported.
+
+    """
+    date_format = date_format_dict.get(column_name)
+    date_formats = tuple(date_formats)
+    for candidate_format in date_formats:
+        get_date_format_guard(candidate_format)
+
+    if column_name in type_overrides:
+        column_type = type_overrides[column_name]
+        if column_type not in COLUMN_DETAIL_TABLES:
+            raise ValueError(
+                'Invalid type override. Unknown type {} of column {}'.format(
+                    column_type,
+                    column_name,
+                )
+            )
+        return COLUMN_PLAN(column_name, (column_type,), True, date_format,
+                           date_formats)
+
+    if date_format is not None:
+        probes = ('date', 'numeric', 'code')
+    elif catalog_type in NUMERIC_CATALOG_TYPES:
+        probes = ('numeric', 'code')
+    elif catalog_type in DATE_CATALOG_TYPES:
+        probes = ('date', 'code')
+    elif catalog_type == 'boolean':
+        probes = ('code',)
     else:
-        col_type = 'text'
-        data = code_data  # If is_code is False, column assumed to be text.
+        probes = ('date_sample', 'numeric', 'code')
+
+    return COLUMN_PLAN(column_name, probes, False, date_format, date_formats)
 
-    column_data = namedtuple('column_data', ['type', 'data'])
-    return column_data(col_type, data)
+
+def execute_column_plan(data_cursor, plan, categorical_threshold, schema_name,
+                        table_name):
+    """Run the scans of a column plan.
+
+    Returns:
+        (column_data): Type of the column and frequencies of its values.
+
+    Raises:
+        ValueError: If an overridden column cannot be converted to the type
+            it is overridden with.
+
+    """
+    col = plan.column_name
+    date_format_dict = {col: plan.date_format} if plan.date_format else {}
+
+    if plan.override:
+        column_type, = plan.probes
+
+        if column_type == 'numeric':
+            flag, data = is_numeric(data_cursor, col, schema_name, table_name)
+        elif column_type == 'date':
+            flag, data = is_date(data_cursor, col, schema_name, table_name,
+                                 date_format_dict)
+        elif column_type == 'text':
+            value_counts = iter_value_counts(
+                data_cursor, col, schema_name, table_name)
+            with contextlib.closing(value_counts):
+                return COLUMN_DATA('text', summarize_text(
+                    (None if value is None else str(value), frequency)
+                    for value, frequency in value_counts
+                ))
+        else:
+            return COLUMN_DATA('code', get_value_counts(
+                data_cursor, col, schema_name, table_name))
+
+        if not flag:
+            raise ValueError(
+                'Invalid type override. Column {} cannot be converted to '
+                'type {}'.format(col, column_type)
+            )
+
+        return COLUMN_DATA(column_type, Counter(data))
+
+    for probe in plan.probes:
+        if probe == 'numeric':
+            flag, data = is_numeric(data_cursor, col, schema_name, table_name)
+            if flag:
+                return COLUMN_DATA('numeric', Counter(data))
+
+        elif probe == 'date':
+            flag, data = is_date(data_cursor, col, schema_name, table_name,
+                                 date_format_dict)
+            if flag:
+                return COLUMN_DATA('date', Counter(data))
+
+        elif probe == 'date_sample':
+            flag, data = is_date_in_formats(data_cursor, col, schema_name,
+                                            table_name, plan.date_formats)
+            if flag:
+                return COLUMN_DATA('date', Counter(data))
+
+        else:
+            flag, data = is_code(data_cursor, col, schema_name, table_name,
+                                 categorical_threshold)
+            # If is_code is False, column assumed to be text.
+            return COLUMN_DATA('code' if flag else 'text', data)
+
+    raise ValueError('Column plan of {} has no code probe'.format(col))
 
 
 def is_numeric(data_cursor, col, schema_name, table_name):
@@ -124,49 +392,224 @@ def is_date(data_cursor, col, schema_name, table_name, date_format_dict):
     return flag, data
 
 
+def is_date_in_formats(data_cursor, col, schema_name, table_name,
+                       date_formats):
+    """Return True and contents of column if column is date in some format.
+
+    Candidate formats are tried at once on a sample of the non-null values,
+    with TO_DATE() guarded by a regular expression per format. If one format
+    parses the whole sample, the column is converted with it in one scan.
+    Values that do not follow the format or are not valid dates make the
+    column not a date.
+    """
+    if not date_formats:
+        return False, []
+
+    guards = [get_date_format_guard(f) for f in date_formats]
+
+    try:
+        data_cursor.execute(
+            sql.SQL("""
+                SELECT COUNT(*), {}
+                FROM (
+                    SELECT {}::TEXT AS value
+                    FROM {}.{}
+                    WHERE {} IS NOT NULL
+                    LIMIT %s
+                ) AS date_sample
+            """).format(
+                sql.SQL(', ').join(
+                    sql.SQL(
+                        'COUNT(CASE WHEN value ~ {} THEN TO_DATE(value, {}) '
+                        'END)'
+                    ).format(sql.Literal(guard), sql.Literal(date_format))
+                    for date_format, guard in zip(date_formats, guards)
+                ),
+                sql.Identifier(col),
+                sql.Identifier(schema_name),
+                sql.Identifier(table_name),
+                sql.Identifier(col),
+            ),
+            [DATE_SAMPLE_ROWS],
+        )
+        n_sampled, *n_parsed = data_cursor.fetchone()
+    except (psycopg2.ProgrammingError, psycopg2.DataError):
+        # E.g. February 30th, which the guards let through.
+        return False, []
+
+    # The first format with the highest parse rate wins.
+    best_index = n_parsed.index(max(n_parsed))
+    if n_sampled == 0 or n_parsed[best_index] < n_sampled:
+        return False, []
+
+    date_format = date_formats[best_index]
+    guard = guards[best_index]
+
+    try:
+        data_cursor.execute(
+            sql.SQL("""
+                SELECT
+                    {col} IS NULL OR {col}::TEXT ~ %(guard)s,
+                    CASE WHEN {col}::TEXT ~ %(guard)s
+                        THEN TO_DATE({col}::TEXT, %(date_format)s)
+                    END
+                FROM {schema}.{table}
+            """).format(
+                col=sql.Identifier(col),
+                schema=sql.Identifier(schema_name),
+                table=sql.Identifier(table_name),
+            ),
+            {'guard': guard, 'date_format': date_format},
+        )
+        rows = data_cursor.fetchall()
+    except (psycopg2.ProgrammingError, psycopg2.DataError):
+        return False, []
+
+    if not all(row[0] for row in rows):
+        return False, []
+
+    return True, [row[1] for row in rows]
+
+
+def get_date_format_guard(date_format):
+    """Return a regular expression matching the values of a date format.
+
+    Args:
+        date_format (str): Format of TO_DATE() made of the fields of
+            `DATE_FIELD_PATTERNS` and separators.
+
+    Returns:
+        (str): Anchored, case-insensitive PostgreSQL regular expression.
+
+    Raises:
+        ValueError: If the format has fields that are not supported.
+
+    """
+    pattern = ''
+    position = 0
+    while position < len(date_format):
+        for field, field_pattern in DATE_FIELD_PATTERNS:
+            if date_format.upper().startswith(field, position):
+                pattern += field_pattern
+                position += len(field)
+                break
+        else:
+            char = date_format[position]
+            if char.isalnum():
+                raise ValueError(
+                    'Unsupported field in date format {}'.format(date_format))
+            pattern += re.escape(char)
+            position += 1
+
+    return '(?i)^' + pattern + '$'
+
+
 def is_code(data_cursor, col, schema_name, table_name,
             categorical_threshold):
-    """Return True and contents of column if column is categorical.
+    """Return True and value frequencies of column if column is categorical.
+
+    Values are grouped in the data database and streamed by
+    `iter_value_counts()`. As soon as there are more distinct values than
+    `categorical_threshold`, the column is text, and the rest of the stream
+    is summarized by `summarize_text()` without being held in memory.
+
+    Returns:
+        (bool, collections.Counter or text_summary): Whether the column is
+            categorical, and its value frequencies if it is, else its text
+            summary.
+
     """
+    value_counts = iter_value_counts(data_cursor, col, schema_name, table_name)
+    with contextlib.closing(value_counts):
+        code_counter = Counter()
+        for value, frequency in value_counts:
+            code_counter[value] = frequency
+            n_distinct = len(code_counter) - (None in code_counter)
+            if n_distinct > categorical_threshold:
+                return False, summarize_text(
+                    itertools.chain(code_counter.items(), value_counts))
+
+    return True, code_counter
+
+
+def get_value_counts(data_cursor, col, schema_name, table_name):
+    """Return the frequencies of the values of a column, grouped in one query.
+
+    For columns known to have few distinct values, e.g. overridden as codes.
+
+    Returns:
+        (collections.Counter): Value -> frequency. None counts missing values.
 
+    """
     data_cursor.execute(
-        sql.SQL(
-            """
-            SELECT COUNT(DISTINCT {}) FROM {}.{}
-            """).format(
-            sql.Identifier(col),
-            sql.Identifier(schema_name),
-            sql.Identifier(table_name),
+        sql.SQL("""
+            SELECT {col}, COUNT(*) FROM {schema}.{table} GROUP BY {col}
+        """).format(
+            col=sql.Identifier(col),
+            schema=sql.Identifier(schema_name),
+            table=sql.Identifier(table_name),
         )
     )
-    n_distinct = data_cursor.fetchall()[0][0]
+    return Counter(dict(data_cursor.fetchall()))
 
-    data_cursor.execute(sql.SQL("""
-        SELECT {} FROM {}.{}
-        """).format(
-                sql.Identifier(col),
-                sql.Identifier(schema_name),
-                sql.Identifier(table_name),
-        )
+
+def iter_value_counts(data_cursor, col, schema_name, table_name,
+                      batch_rows=VALUE_COUNT_BATCH_ROWS):
+    """Yield the distinct values of a column with their frequencies.
+
+    Values are grouped in the data database and fetched from a server-side
+    cursor in batches of `batch_rows` while they are consumed, so that only a
+    batch is held in memory. The cursor lives in a transaction of its own,
+    which the data connection being in autocommit mode is opened explicitly.
+    Close the generator to stop early.
+
+    Yields:
+        (object, int): Value, None for missing values, and its frequency.
+
+    """
+    data_cursor.execute('BEGIN')
+    try:
+        data_cursor.execute(
+            sql.SQL("""
+                DECLARE value_counts NO SCROLL CURSOR FOR
+                SELECT {col}, COUNT(*) FROM {schema}.{table} GROUP BY {col}
+            """).format(
+                col=sql.Identifier(col),
+                schema=sql.Identifier(schema_name),
+                table=sql.Identifier(table_name),
+            )
         )
-    data = [i[0] for i in data_cursor.fetchall()]
 
-    if n_distinct <= categorical_threshold:
-        flag = True
-    else:
-        flag = False
+        while True:
+            data_cursor.execute(
+                'FETCH %s FROM value_counts', [batch_rows])
+            batch = data_cursor.fetchall()
+            if not batch:
+                break
+            for value, frequency in batch:
+                yield value, frequency
+    finally:
+        data_cursor.execute('ROLLBACK')
 
-    return flag, data
 
+def update_numeric(metabase_cursor, col_name, value_counter, data_table_id):
+    """Update Column Info and Numeric Column for a numerical column.
 
-def update_numeric(metabase_cursor, col_name, col_data, data_table_id):
-    """Update Column Info and Numeric Column for a numerical column."""
+    Args:
+        value_counter (collections.Counter): Value -> frequency. None counts
+            missing values.
 
-    serial_column_id = update_column_info(metabase_cursor, col_name,
-                                          data_table_id, 'numeric')
+    """
+    serial_column_id = update_column_info(
+        metabase_cursor,
+        col_name,
+        data_table_id,
+        'numeric',
+        get_column_counts_from_counter(value_counter),
+    )
     # TODO: Update created by, created date.
 
-    numeric_stats = get_numeric_metadata(col_data)
+    numeric_stats = get_numeric_metadata(value_counter)
 
     metabase_cursor.execute(
         """
@@ -178,6 +621,7 @@ def update_numeric(metabase_cursor, col_name, col_data, data_table_id):
             maximum,
             mean,
             median,
+            std,
             updated_by,
             date_last_updated
         ) VALUES (
@@ -188,9 +632,18 @@ def update_numeric(metabase_cursor, col_name, col_data, data_table_id):
             %(maximum)s,
             %(mean)s,
             %(median)s,
+            %(std)s,
             %(updated_by)s,
             (SELECT CURRENT_TIMESTAMP)
         )
+        ON CONFLICT (column_id) DO UPDATE SET
+            minimum = EXCLUDED.minimum,
+            maximum = EXCLUDED.maximum,
+            mean = EXCLUDED.mean,
+            median = EXCLUDED.median,
+            std = EXCLUDED.std,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
         """,
         {
             'column_id': serial_column_id,
@@ -200,42 +653,142 @@ def update_numeric(metabase_cursor, col_name, col_data, data_table_id):
             'maximum': numeric_stats.max,
             'mean': numeric_stats.mean,
             'median': numeric_stats.median,
+            'std': numeric_stats.std,
             'updated_by': getpass.getuser(),
         }
     )
 
+    upsert_column_minhash(
+        metabase_cursor,
+        serial_column_id,
+        col_name,
+        data_table_id,
+        get_column_minhash(value_counter.keys()),
+    )
+
+    return serial_column_id
+
+
+def get_numeric_metadata(value_counter):
+    """Get metadata from the frequencies of the values of a numeric column.
 
-def get_numeric_metadata(col_data):
-    """Get metdata from a numeric column."""
+    Statistics are those of `statistics.mean()`, `statistics.median()` and
+    the sample `statistics.stdev()` of the values repeated by frequency,
+    computed from the distinct values only.
 
-    not_null_num_ls = [num for num in col_data if num is not None]
+    Returns:
+        (numeric_stats): Minimum, maximum, mean, median and standard
+            deviation, None if there are too few values.
 
-    if not_null_num_ls:
-        mean = statistics.mean(not_null_num_ls)
-        median = statistics.median(not_null_num_ls)
-        max_col = max(not_null_num_ls)
-        min_col = min(not_null_num_ls)
+    """
+    values = sorted(value for value in value_counter if value is not None)
+    if not values:
+        return NUMERIC_STATS(None, None, None, None, None)
+
+    frequencies = [value_counter[value] for value in values]
+    n_values = sum(frequencies)
+    value_type = type(values[0])
+
+    value_sum, square_sum = get_exact_sums(values, frequencies)
+    mean = convert_fraction(value_sum / n_values, value_type)
+
+    if n_values > 1:
+        # Sample standard deviation, from the exact sum of squared deviations.
+        sum_of_squares = square_sum - value_sum * value_sum / n_values
+        std = convert_fraction(sum_of_squares / (n_values - 1), value_type)
+        std = std.sqrt() if value_type is decimal.Decimal else math.sqrt(std)
     else:
-        mean = None
-        median = None
-        max_col = None
-        min_col = None
+        std = None
+
+    return NUMERIC_STATS(
+        values[0],
+        values[-1],
+        mean,
+        get_weighted_median(values, frequencies),
+        std,
+    )
+
+
+def get_exact_sums(values, frequencies):
+    """Return the exact sums of values and of their squares as fractions.
 
-    numeric_stats = namedtuple(
-        'numeric_stats',
-        ['min', 'max', 'mean', 'median'],
+    As in the statistics module, numerators are summed as integers for each
+    denominator, so that a fraction is only built per distinct denominator.
+
+    """
+    sums = Counter()
+    square_sums = Counter()
+    for value, frequency in zip(values, frequencies):
+        numerator, denominator = value.as_integer_ratio()
+        sums[denominator] += numerator * frequency
+        square_sums[denominator] += numerator * numerator * frequency
+
+    value_sum = sum(
+        fractions.Fraction(numerator, denominator)
+        for denominator, numerator in sums.items()
+    )
+    square_sum = sum(
+        fractions.Fraction(numerator, denominator * denominator)
+        for denominator, numerator in square_sums.items()
     )
-    return numeric_stats(min_col, max_col, mean, median)
+    return value_sum, square_sum
 
 
-def update_text(metabase_cursor, col_name, col_data, data_table_id):
-    """Update Column Info  and Numeric Column for a text column."""
+def convert_fraction(fraction, value_type):
+    """Return an exact fraction as a Decimal, or a float for other types."""
+
+    if issubclass(value_type, decimal.Decimal):
+        return (decimal.Decimal(fraction.numerator)
+                / decimal.Decimal(fraction.denominator))
+
+    return float(fraction)
+
+
+def get_weighted_median(values, frequencies):
+    """Return the median of sorted values repeated by their frequencies.
+
+    As `statistics.median()`, the mean of the two middle values if there is
+    an even number of values.
+
+    """
+    n_values = sum(frequencies)
+    middle_positions = [(n_values - 1) // 2, n_values // 2]
+    middle_values = []
+
+    position = 0
+    for value, frequency in zip(values, frequencies):
+        position += frequency
+        while middle_positions and middle_positions[0] < position:
+            middle_positions.pop(0)
+            middle_values.append(value)
+        if not middle_positions:
+            break
+
+    if n_values % 2:
+        return middle_values[0]
+
+    return (middle_values[0] + middle_values[1]) / 2
+
+
+def update_text(metabase_cursor, col_name, text_summary, data_table_id):
+    """Update Column Info and Text Column for a text column.
+
+    Args:
+        text_summary (text_summary): Statistics of the column from
+            `summarize_text()`.
 
-    serial_column_id = update_column_info(metabase_cursor, col_name,
-                                          data_table_id, 'text')
+    """
+    serial_column_id = update_column_info(
+        metabase_cursor,
+        col_name,
+        data_table_id,
+        'text',
+        text_summary.column_counts,
+    )
     # Update created by, created date.
 
-    (max_len, min_len, median_len) = get_text_metadata(col_data)
+    (max_len, min_len, median_len) = get_text_metadata(
+        text_summary.length_counts)
 
     metabase_cursor.execute(
         """
@@ -261,6 +814,12 @@ def update_text(metabase_cursor, col_name, col_data, data_table_id):
         %(updated_by)s,
         (SELECT CURRENT_TIMESTAMP)
         )
+        ON CONFLICT (column_id) DO UPDATE SET
+            max_length = EXCLUDED.max_length,
+            min_length = EXCLUDED.min_length,
+            median_length = EXCLUDED.median_length,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
         """,
         {
             'column_id': serial_column_id,
@@ -273,17 +832,92 @@ def update_text(metabase_cursor, col_name, col_data, data_table_id):
         }
     )
 
+    insert_text_top_values(
+        metabase_cursor,
+        serial_column_id,
+        col_name,
+        data_table_id,
+        text_summary.top_values,
+    )
+
+    upsert_column_minhash(
+        metabase_cursor,
+        serial_column_id,
+        col_name,
+        data_table_id,
+        text_summary.minhash,
+    )
+
+    return serial_column_id
+
 
-def get_text_metadata(col_data):
-    """Get metadata from a text column."""
+def summarize_text(value_counts, k=TEXT_TOP_K,
+                   capacity=TEXT_TOP_VALUES_CAPACITY,
+                   batch_rows=VALUE_COUNT_BATCH_ROWS):
+    """Gather the statistics of a text column from a stream of its values.
+
+    Memory is bounded by the number of distinct lengths, the capacity of the
+    Space-Saving summary of the most frequent values and the MinHash
+    signature, not by the number of values. Values that might occur only
+    once are left out of the top values.
+
+    Args:
+        value_counts (iterable): Distinct values, None for missing values,
+            with their frequencies, e.g. from `iter_value_counts()` or the
+            items of a Counter.
 
-    not_null_text_ls = [text for text in col_data if text is not None]
+    Returns:
+        (text_summary): Missing, non-null and distinct counts, frequencies of
+            the lengths, top values with their estimated frequency and error
+            by descending estimated frequency, and the MinHash signature of
+            the values, or None if there is no value.
 
-    if not_null_text_ls:
-        text_lens_ls = [len(text) for text in not_null_text_ls]
-        min_len = min(text_lens_ls)
-        max_len = max(text_lens_ls)
-        median_len = statistics.median(text_lens_ls)
+    """
+    missing = 0
+    non_null = 0
+    distinct = 0
+    length_counts = Counter()
+    top_values = sketches.SpaceSaving(capacity)
+    minhash = sketches.MinHash(MINHASH_NUM_PERM)
+
+    value_counts = iter(value_counts)
+    while True:
+        batch = list(itertools.islice(value_counts, batch_rows))
+        if not batch:
+            break
+
+        batch_counts = {}
+        for value, frequency in batch:
+            if value is None:
+                missing += frequency
+            else:
+                batch_counts[value] = frequency
+                length_counts[len(value)] += frequency
+
+        non_null += sum(batch_counts.values())
+        distinct += len(batch_counts)
+        top_values.add_counts(batch_counts)
+        minhash.update(get_join_key(value) for value in batch_counts)
+
+    return TEXT_SUMMARY(
+        COLUMN_COUNTS(missing, non_null, distinct),
+        length_counts,
+        top_values.top_k(k, min_frequency=2),
+        minhash if distinct else None,
+    )
+
+
+def get_text_metadata(length_counts):
+    """Get metadata from the frequencies of the lengths of a text column."""
+
+    if length_counts:
+        lengths = sorted(length_counts)
+        min_len = lengths[0]
+        max_len = lengths[-1]
+        median_len = get_weighted_median(
+            lengths,
+            [length_counts[length] for length in lengths],
+        )
     else:
         # Will only be needed if categorical_threshold = 0
         min_len = None
@@ -293,15 +927,64 @@ def get_text_metadata(col_data):
     return (max_len, min_len, median_len)
 
 
-def update_date(metabase_cursor, col_name, col_data,
+def insert_text_top_values(metabase_cursor, column_id, col_name,
+                           data_table_id, top_values):
+    """Store the most frequent values of a text column by rank.
+
+    Top values of columns processed before are deleted by
+    `update_column_info()`.
+
+    """
+    psycopg2.extras.execute_values(
+        metabase_cursor,
+        """
+        INSERT INTO metabase.text_top_value (
+            column_id,
+            data_table_id,
+            column_name,
+            rank,
+            value,
+            frequency,
+            frequency_error,
+            updated_by,
+            date_last_updated
+        ) VALUES %s
+        """,
+        [
+            (
+                column_id,
+                data_table_id,
+                col_name,
+                rank,
+                top_value.value,
+                top_value.frequency,
+                top_value.error,
+                getpass.getuser(),
+            )
+            for rank, top_value in enumerate(top_values, 1)
+        ],
+        template='(%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)',
+    )
+
+
+def update_date(metabase_cursor, col_name, value_counter,
                 data_table_id):
     """
     Update Column Info and Date Column for a date column.
+
+    Args:
+        value_counter (collections.Counter): Value -> frequency. None counts
+            missing values.
     """
-    serial_column_id = update_column_info(metabase_cursor, col_name,
-                                          data_table_id, 'date')
+    serial_column_id = update_column_info(
+        metabase_cursor,
+        col_name,
+        data_table_id,
+        'date',
+        get_column_counts_from_counter(value_counter),
+    )
 
-    (minimum, maximum) = get_date_metadata(col_data)
+    (minimum, maximum) = get_date_metadata(value_counter)
 
     metabase_cursor.execute(
         """
@@ -325,6 +1008,11 @@ def update_date(metabase_cursor, col_name, col_data,
         %(updated_by)s,
         (SELECT CURRENT_TIMESTAMP)
         )
+        ON CONFLICT (column_id) DO UPDATE SET
+            min_date = EXCLUDED.min_date,
+            max_date = EXCLUDED.max_date,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
         """,
         {
             'column_id': serial_column_id,
@@ -336,11 +1024,21 @@ def update_date(metabase_cursor, col_name, col_data,
         }
         )
 
+    upsert_column_minhash(
+        metabase_cursor,
+        serial_column_id,
+        col_name,
+        data_table_id,
+        get_column_minhash(value_counter.keys()),
+    )
+
+    return serial_column_id
 
-def get_date_metadata(col_data):
-    """Get metadata from a date column."""
 
-    not_null_date_ls = [date for date in col_data if date is not None]
+def get_date_metadata(value_counter):
+    """Get metadata from the frequencies of the values of a date column."""
+
+    not_null_date_ls = [date for date in value_counter if date is not None]
 
     if not_null_date_ls:
         min_date = min(not_null_date_ls)
@@ -352,104 +1050,977 @@ def get_date_metadata(col_data):
     return (min_date, max_date)
 
 
-def update_code(metabase_cursor, col_name, col_data,
+def update_code(metabase_cursor, col_name, code_counter,
                 data_table_id):
-    """Update Column Info and Code Frequency for a categorical column."""
+    """Update Column Info and Code Frequency for a categorical column.
+
+    Args:
+        code_counter (collections.Counter): Code -> frequency. None counts
+            missing values.
+
+    """
+
+    serial_column_id = update_column_info(
+        metabase_cursor,
+        col_name,
+        data_table_id,
+        'code',
+        get_column_counts_from_counter(code_counter),
+    )
+
+    upsert_code_frequency(
+        metabase_cursor,
+        serial_column_id,
+        col_name,
+        data_table_id,
+        code_counter,
+    )
+
+    upsert_column_minhash(
+        metabase_cursor,
+        serial_column_id,
+        col_name,
+        data_table_id,
+        get_column_minhash(code_counter.keys()),
+    )
+
+    return serial_column_id
+
+
+def upsert_code_frequency(metabase_cursor, column_id, col_name,
+                          data_table_id, code_counter):
+    """Replace the code frequencies of a column.
+
+    Frequencies are upserted in bulk and codes that are no longer in the
+    column are deleted. The NULL code has a unique index of its own, so it is
+    upserted separately.
+
+    """
+    code_insert = """
+        INSERT INTO metabase.code_frequency (
+            column_id,
+            data_table_id,
+            column_name,
+            code,
+            frequency,
+            updated_by,
+            date_last_updated
+        ) VALUES %s
+        ON CONFLICT {} DO UPDATE SET
+            frequency = EXCLUDED.frequency,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
+    """
+    code_rows = [
+        (
+            column_id,
+            data_table_id,
+            col_name,
+            code,
+            frequency,
+            getpass.getuser(),
+        )
+        for code, frequency in code_counter.items()
+    ]
+    template = '(%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)'
+
+    psycopg2.extras.execute_values(
+        metabase_cursor,
+        code_insert.format(
+            '(data_table_id, column_id, code) WHERE code IS NOT NULL'),
+        [row for row in code_rows if row[3] is not None],
+        template=template,
+    )
+    psycopg2.extras.execute_values(
+        metabase_cursor,
+        code_insert.format(
+            '(data_table_id, column_id) WHERE code IS NULL'),
+        [row for row in code_rows if row[3] is None],
+        template=template,
+    )
+
+    codes = [code for code in code_counter if code is not None]
+    metabase_cursor.execute(
+        """
+        DELETE FROM metabase.code_frequency
+        WHERE data_table_id = %(data_table_id)s
+            AND column_id = %(column_id)s
+            AND CASE
+                WHEN code IS NULL THEN NOT %(has_null_code)s
+                ELSE code <> ALL(%(codes)s::TEXT[])
+            END
+        """,
+        {
+            'data_table_id': data_table_id,
+            'column_id': column_id,
+            'has_null_code': None in code_counter,
+            'codes': codes,
+        },
+    )
+
+
+def get_column_counts_from_counter(value_counter):
+    """Count missing, non-null and distinct values from value frequencies.
+
+    Returns:
+        (column_counts): Named tuple of missing (null) count, non-null count
+            and distinct non-null count.
+
+    """
+
+    missing = value_counter.get(None, 0)
+    distinct = len(value_counter) - (1 if None in value_counter else 0)
+    non_null = sum(value_counter.values()) - missing
+
+    return COLUMN_COUNTS(missing, non_null, distinct)
+
+
+def get_join_key(value):
+    """Return the text a value is compared as across columns of any type.
+
+    Numbers are written without exponent or trailing zeros, so that e.g.
+    1.50 of a NUMERIC(4, 2) column and 1.5 of a DOUBLE PRECISION column
+    match. Dates are in ISO format.
+
+    """
+    if isinstance(value, float) and math.isfinite(value):
+        value = decimal.Decimal(repr(value))
+    if isinstance(value, decimal.Decimal) and value.is_finite():
+        return format(value.normalize(), 'f')
+
+    return str(value)
+
+
+def get_column_minhash(values, num_perm=MINHASH_NUM_PERM):
+    """Get the MinHash signature of the distinct values of a column.
+
+    Args:
+        values (iterable): Distinct values of the column. None is skipped.
+
+    Returns:
+        (sketches.MinHash): Signature of the join keys of the values, or None
+            if there is no value.
+
+    """
+    join_keys = {get_join_key(value) for value in values if value is not None}
+    if not join_keys:
+        return None
+
+    minhash = sketches.MinHash(num_perm)
+    minhash.update(join_keys)
+    return minhash
+
+
+def upsert_column_minhash(metabase_cursor, column_id, col_name,
+                          data_table_id, minhash):
+    """Store the MinHash signature of a column and its LSH band hashes.
+
+    The signature of a column without values is deleted.
+
+    Args:
+        minhash (sketches.MinHash): Signature of the column, e.g. from
+            `get_column_minhash()`, or None if it has no value.
+
+    """
+    if minhash is None:
+        metabase_cursor.execute(
+            """
+            DELETE FROM metabase.column_minhash
+            WHERE column_id = %(column_id)s
+            """,
+            {'column_id': column_id},
+        )
+        return
+
+    metabase_cursor.execute(
+        """
+        INSERT INTO metabase.column_minhash (
+            column_id,
+            data_table_id,
+            column_name,
+            signature,
+            band_hashes,
+            updated_by,
+            date_last_updated
+        ) VALUES (
+            %(column_id)s,
+            %(data_table_id)s,
+            %(column_name)s,
+            %(signature)s,
+            %(band_hashes)s,
+            %(updated_by)s,
+            (SELECT CURRENT_TIMESTAMP)
+        )
+        ON CONFLICT (column_id) DO UPDATE SET
+            column_name = EXCLUDED.column_name,
+            signature = EXCLUDED.signature,
+            band_hashes = EXCLUDED.band_hashes,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
+        """,
+        {
+            'column_id': column_id,
+            'data_table_id': data_table_id,
+            'column_name': col_name,
+            'signature': psycopg2.Binary(minhash.to_bytes()),
+            'band_hashes': sketches.get_band_hashes(
+                minhash.signature, MINHASH_BANDS),
+            'updated_by': getpass.getuser(),
+        }
+    )
+
+
+def update_column_info(cursor, col_name, data_table_id, data_type,
+                       column_counts=None):
+    """Add or update the row of this data column in the column info table.
+
+    When a column is profiled again, its column_id is kept. Metadata of the
+    column in the tables of other data types, its histogram bins and its top
+    values are deleted, since the caller replaces them.
+
+    Args:
+        column_counts (column_counts): Missing, non-null and distinct counts
+            from `get_column_counts_from_counter()`. Counts and uniqueness,
+            distinct values per row, are left NULL if not given.
+
+    Returns:
+        (int): column_id
+
+    """
+    uniqueness = None
+    if column_counts and column_counts.missing + column_counts.non_null:
+        uniqueness = decimal.Decimal(column_counts.distinct) / (
+            column_counts.missing + column_counts.non_null)
+
+    cursor.execute(
+        """
+        INSERT INTO metabase.column_info (
+            data_table_id,
+            column_name,
+            data_type,
+            missing_count,
+            non_null_count,
+            distinct_count,
+            uniqueness,
+            updated_by,
+            date_last_updated
+        )
+        VALUES (
+            %(data_table_id)s,
+            %(column_name)s,
+            %(data_type)s,
+            %(missing_count)s,
+            %(non_null_count)s,
+            %(distinct_count)s,
+            %(uniqueness)s,
+            %(updated_by)s,
+            (SELECT CURRENT_TIMESTAMP)
+        )
+        ON CONFLICT (data_table_id, column_name) DO UPDATE SET
+            data_type = EXCLUDED.data_type,
+            missing_count = EXCLUDED.missing_count,
+            non_null_count = EXCLUDED.non_null_count,
+            distinct_count = EXCLUDED.distinct_count,
+            uniqueness = EXCLUDED.uniqueness,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
+        -- xmax is 0 for inserted rows.
+        RETURNING column_id, xmax = 0 AS inserted
+        ;
+        """,
+        {
+            'data_table_id': data_table_id,
+            'column_name': col_name,
+            'data_type': data_type,
+            'missing_count': column_counts and column_counts.missing,
+            'non_null_count': column_counts and column_counts.non_null,
+            'distinct_count': column_counts and column_counts.distinct,
+            'uniqueness': uniqueness,
+            'updated_by': getpass.getuser(),
+        }
+    )
+
+    serial_column_id, inserted = cursor.fetchall()[0]
+
+    if not inserted:
+        delete_column_details(
+            cursor,
+            data_table_id,
+            [serial_column_id],
+            keep_table=COLUMN_DETAIL_TABLES[data_type],
+        )
+
+    return serial_column_id
+
+
+def delete_column_details(cursor, data_table_id, column_ids, keep_table=None):
+    """Delete type-specific metadata, histogram bins, top values and MinHash
+    signatures of columns.
+
+    Args:
+        data_table_id (int): Data Table of the columns. Rows are looked up
+            by data_table_id first, which also prunes the partitions of
+            code_frequency.
+        column_ids ([int]): Columns to delete the metadata of.
+        keep_table (str): Table of COLUMN_DETAIL_TABLES to keep rows of.
+
+    """
+    for table_name in (list(COLUMN_DETAIL_TABLES.values())
+                       + ['histogram_bin', 'text_top_value',
+                          'column_minhash']):
+        if table_name == keep_table:
+            continue
+
+        cursor.execute(
+            sql.SQL("""
+                DELETE FROM metabase.{}
+                WHERE data_table_id = %(data_table_id)s
+                    AND column_id = ANY(%(column_ids)s)
+            """).format(sql.Identifier(table_name)),
+            {'data_table_id': data_table_id, 'column_ids': column_ids},
+        )
+
+
+def delete_missing_columns(cursor, data_table_id, column_names):
+    """Delete metadata of columns that are no longer in a Data Table.
+
+    Args:
+        column_names ([str]): Current column names of the Data Table.
+
+    Returns:
+        ([str]): Names of the deleted columns.
+
+    """
+    cursor.execute(
+        """
+        SELECT column_id, column_name
+        FROM metabase.column_info
+        WHERE data_table_id = %(data_table_id)s
+            AND column_name <> ALL(%(column_names)s::TEXT[])
+        """,
+        {'data_table_id': data_table_id, 'column_names': list(column_names)},
+    )
+    missing_columns = cursor.fetchall()
+
+    if not missing_columns:
+        return []
+
+    column_ids = [row[0] for row in missing_columns]
+    delete_column_details(cursor, data_table_id, column_ids)
+    cursor.execute(
+        """
+        DELETE FROM metabase.column_info
+        WHERE column_id = ANY(%(column_ids)s)
+        """,
+        {'column_ids': column_ids},
+    )
+
+    return [row[1] for row in missing_columns]
+
+
+def insert_histogram_bins(metabase_cursor, col_name, column_id,
+                          data_table_id, histogram_type, method,
+                          histogram_bins):
+    """Store the bins of a histogram, replacing bins of the same number."""
+
+    psycopg2.extras.execute_values(
+        metabase_cursor,
+        """
+        INSERT INTO metabase.histogram_bin (
+            column_id,
+            data_table_id,
+            column_name,
+            histogram_type,
+            method,
+            bin_number,
+            lower_bound,
+            upper_bound,
+            frequency,
+            updated_by,
+            date_last_updated
+        ) VALUES %s
+        ON CONFLICT (column_id, histogram_type, bin_number) DO UPDATE SET
+            method = EXCLUDED.method,
+            lower_bound = EXCLUDED.lower_bound,
+            upper_bound = EXCLUDED.upper_bound,
+            frequency = EXCLUDED.frequency,
+            updated_by = EXCLUDED.updated_by,
+            date_last_updated = EXCLUDED.date_last_updated
+        """,
+        [
+            (
+                column_id,
+                data_table_id,
+                col_name,
+                histogram_type,
+                method,
+                histogram_bin.bin_number,
+                histogram_bin.lower_bound,
+                histogram_bin.upper_bound,
+                histogram_bin.frequency,
+                getpass.getuser(),
+            )
+            for histogram_bin in histogram_bins
+        ],
+        template='(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)',
+    )
+
+
+def get_histogram_counts(column_data):
+    """Return the frequencies binned by the histogram of a column.
+
+    Args:
+        column_data (column_data): Numeric column with its value frequencies,
+            or text column with its text summary.
+
+    Returns:
+        (dict): Number -> frequency of a numeric column, or text length ->
+            frequency of a text column.
+
+    """
+    if column_data.type == 'numeric':
+        return {
+            value: frequency for value, frequency in column_data.data.items()
+            if value is not None
+        }
+    elif column_data.type == 'text':
+        return column_data.data.length_counts
+    else:
+        raise ValueError(
+            'No histogram of {} columns'.format(column_data.type))
+
+
+def get_histogram_from_counts(value_counts, n_bins, method='equi_width'):
+    """Compute a histogram from the frequencies of values.
+
+    The frequencies are those fetched for the other statistics of the column,
+    so the table is not scanned again. Only non-empty bins are returned.
+
+    Args:
+        value_counts (dict): Non-null value (number or text length) ->
+            frequency, e.g. from `get_histogram_counts()`.
+        n_bins (int): Number of bins.
+        method (str): 'equi_width' for bins of equal width between minimum and
+            maximum, as with `WIDTH_BUCKET`, or 'equi_depth' for bins bounded
+            by quantiles, as with `PERCENTILE_DISC`, which hold roughly the
+            same number of values.
+
+    Returns:
+        ([histogram_bin]): Named tuples of bin number (1 to `n_bins`), lower
+            bound, upper bound and frequency, ordered by bin number.
+
+    """
+    if not value_counts:
+        return []
+
+    values = sorted(value_counts)
+    frequencies = Counter()
+
+    if method == 'equi_width':
+        minimum = decimal.Decimal(values[0])
+        maximum = decimal.Decimal(values[-1])
+        width = maximum - minimum
+        for value in values:
+            if width == 0:
+                bin_number = 1
+            else:
+                # Like WIDTH_BUCKET(), with the maximum in the last bin.
+                bin_number = min(
+                    int((value - minimum) * n_bins // width) + 1,
+                    n_bins,
+                )
+            frequencies[bin_number] += value_counts[value]
+
+        return [
+            HISTOGRAM_BIN(
+                bin_number,
+                minimum + width * (bin_number - 1) / n_bins,
+                minimum + width * bin_number / n_bins,
+                frequency,
+            )
+            for bin_number, frequency in sorted(frequencies.items())
+        ]
+
+    elif method == 'equi_depth':
+        # Like PERCENTILE_DISC(), the first value whose position reaches
+        # every fraction of the values.
+        total = sum(value_counts.values())
+        thresholds = []
+        position = 0
+        values_iter = iter(values)
+        for i in range(n_bins + 1):
+            target = max(math.ceil(i / n_bins * total), 1)
+            while position < target:
+                value = next(values_iter)
+                position += value_counts[value]
+            thresholds.append(value)
+
+        for value in values:
+            bin_number = min(bisect.bisect_right(thresholds, value), n_bins)
+            frequencies[bin_number] += value_counts[value]
+
+        return [
+            HISTOGRAM_BIN(
+                bin_number,
+                thresholds[bin_number - 1],
+                thresholds[bin_number],
+                frequency,
+            )
+            for bin_number, frequency in sorted(frequencies.items())
+        ]
+
+    else:
+        raise ValueError('Unknown histogram method')
+
+
+# #############################################################################
+#   Candidate keys
+# #############################################################################
+
+def select_key_columns(metabase_cursor, data_table_id):
+    """Select the counts of the columns of a Data Table.
+
+    Returns:
+        ([key_column]): Named tuples of column name, missing, non-null and
+            distinct counts, in the order of the columns.
+
+    """
+    metabase_cursor.execute(
+        """
+        SELECT column_name, missing_count, non_null_count, distinct_count
+        FROM metabase.column_info
+        WHERE data_table_id = %(data_table_id)s
+        ORDER BY column_id
+        """,
+        {'data_table_id': data_table_id},
+    )
+
+    return [KEY_COLUMN(*row) for row in metabase_cursor.fetchall()]
+
+
+def get_candidate_keys(key_columns, max_pairs=KEY_CHECK_MAX_PAIRS,
+                       max_rows=KEY_CHECK_MAX_ROWS):
+    """Find the columns that are keys and the pairs of columns to check.
+
+    A column without missing values whose values are all distinct is a key,
+    which its counts tell. A pair of other columns without missing values
+    can only be a key if the product of their distinct counts reaches the
+    number of rows. The pairs of highest products are checked first.
+
+    Args:
+        key_columns ([key_column]): Counts of the columns of a table.
+        max_pairs (int): Largest number of pairs returned.
+        max_rows (int): No pair is returned for tables of more rows.
+
+    Returns:
+        ([str], [(str, str)]): Names of the key columns, and pairs of column
+            names to check, in the order of the columns.
+
+    """
+    if not key_columns:
+        return [], []
+
+    n_rows = key_columns[0].missing + key_columns[0].non_null
+    complete_columns = [
+        column for column in key_columns
+        if column.missing == 0 and column.distinct
+    ]
+
+    unique_columns = [
+        column.column_name for column in complete_columns
+        if column.distinct == n_rows
+    ]
+    if n_rows > max_rows:
+        return unique_columns, []
+
+    pair_columns = [
+        column for column in complete_columns
+        if 1 < column.distinct < n_rows
+    ]
+    pairs = [
+        (column, other_column)
+        for i, column in enumerate(pair_columns)
+        for other_column in pair_columns[i + 1:]
+        if column.distinct * other_column.distinct >= n_rows
+    ]
+    pairs.sort(key=lambda pair: -pair[0].distinct * pair[1].distinct)
+
+    return unique_columns, [
+        (column.column_name, other_column.column_name)
+        for column, other_column in pairs[:max_pairs]
+    ]
+
+
+def has_duplicate_rows(row_batches):
+    """Return True as soon as a batch repeats a row of the batches before.
+
+    Only the hashes of the rows are kept. Rows of equal hashes are taken as
+    duplicates, so a collision may hide a key but never report a false one.
+
+    Args:
+        row_batches (iterable): Lists of tuples, e.g. from
+            `DataSource.iter_row_batches()`.
+
+    """
+    row_hashes = set()
+    for batch in row_batches:
+        n_hashes = len(row_hashes)
+        row_hashes.update(map(hash, batch))
+        if len(row_hashes) < n_hashes + len(batch):
+            return True
+
+    return False
+
+
+def replace_candidate_keys(metabase_cursor, data_table_id, candidate_keys):
+    """Replace the candidate keys of a Data Table.
+
+    Args:
+        candidate_keys ([[str]]): Column names of each key.
+
+    """
+    metabase_cursor.execute(
+        """
+        DELETE FROM metabase.candidate_key
+        WHERE data_table_id = %(data_table_id)s
+        """,
+        {'data_table_id': data_table_id},
+    )
+
+    psycopg2.extras.execute_values(
+        metabase_cursor,
+        """
+        INSERT INTO metabase.candidate_key (
+            data_table_id,
+            key_columns,
+            updated_by,
+            date_last_updated
+        ) VALUES %s
+        """,
+        [
+            (data_table_id, list(key_columns), getpass.getuser())
+            for key_columns in candidate_keys
+        ],
+        template='(%s, %s, %s, CURRENT_TIMESTAMP)',
+    )
+
+
+# #############################################################################
+#   Validation
+# #############################################################################
+
+# Every expected statistic further from the observed one than its tolerance,
+# a NULL tolerance being 0, and every code of a column with a codebook that
+# is not in it. Expected statistics are unpivoted with LATERAL VALUES, so
+# each range table is joined once with the column table it checks.
+VALIDATION_QUERY = """
+    SELECT
+        r.column_name, 'numeric_range', s.statistic, NULL,
+        s.expected::TEXT, s.tolerance::TEXT, s.observed::TEXT
+    FROM metabase.numeric_range AS r
+    LEFT JOIN metabase.numeric_column AS n
+        ON n.data_table_id = r.data_table_id
+        AND n.column_name = r.column_name
+    CROSS JOIN LATERAL (VALUES
+        ('minimum', r.minimum, r.minimum_tolerance, n.minimum),
+        ('maximum', r.maximum, r.maximum_tolerance, n.maximum),
+        ('mean', r.mean, r.mean_tolerance, n.mean),
+        ('median', r.median, r.median_tolerance, n.median)
+    ) AS s (statistic, expected, tolerance, observed)
+    WHERE r.data_table_id = %(data_table_id)s
+    AND s.expected IS NOT NULL
+    AND (
+        s.observed IS NULL
+        OR ABS(s.observed - s.expected) > COALESCE(s.tolerance, 0)
+    )
 
-    serial_column_id = update_column_info(metabase_cursor, col_name,
-                                          data_table_id, 'code')
+    UNION ALL
+
+    SELECT
+        r.column_name, 'text_range', s.statistic, NULL,
+        s.expected::TEXT, s.tolerance::TEXT, s.observed::TEXT
+    FROM metabase.text_range AS r
+    LEFT JOIN metabase.text_column AS t
+        ON t.data_table_id = r.data_table_id
+        AND t.column_name = r.column_name
+    CROSS JOIN LATERAL (VALUES
+        ('max_length', r.max_length, r.max_length_tolerance, t.max_length),
+        ('min_length', r.min_length, r.min_length_tolerance, t.min_length),
+        ('median_length', r.median_length, r.median_length_tolerance,
+         t.median_length)
+    ) AS s (statistic, expected, tolerance, observed)
+    WHERE r.data_table_id = %(data_table_id)s
+    AND s.expected IS NOT NULL
+    AND (
+        s.observed IS NULL
+        OR ABS(s.observed - s.expected) > COALESCE(s.tolerance, 0)
+    )
 
-    code_counter = get_code_metadata(col_data)
+    UNION ALL
+
+    SELECT
+        r.column_name, 'date_range', s.statistic, NULL,
+        s.expected::TEXT, s.tolerance::TEXT, s.observed::TEXT
+    FROM metabase.date_range AS r
+    LEFT JOIN metabase.date_column AS d
+        ON d.data_table_id = r.data_table_id
+        AND d.column_name = r.column_name
+    CROSS JOIN LATERAL (VALUES
+        ('max_date', r.max_date, r.max_date_range, d.max_date),
+        ('min_date', r.min_date, r.min_date_range, d.min_date)
+    ) AS s (statistic, expected, tolerance, observed)
+    WHERE r.data_table_id = %(data_table_id)s
+    AND s.expected IS NOT NULL
+    AND (
+        s.observed IS NULL
+        OR s.observed NOT BETWEEN
+            s.expected - COALESCE(s.tolerance, INTERVAL '0')
+            AND s.expected + COALESCE(s.tolerance, INTERVAL '0')
+    )
 
-    for code, frequency in code_counter.items():
-        metabase_cursor.execute(
-            """
-            INSERT INTO metabase.code_frequency (
-                column_id,
-                data_table_id,
-                column_name,
-                code,
-                frequency,
-                updated_by,
-                date_last_updated
-            ) VALUES (
-                %(column_id)s,
-                %(data_table_id)s,
-                %(column_name)s,
-                %(code)s,
-                %(frequency)s,
-                %(updated_by)s,
-               (SELECT CURRENT_TIMESTAMP)
-            )
-            """,
-            {
-                'column_id': serial_column_id,
-                'data_table_id': data_table_id,
-                'column_name': col_name,
-                'code': code,
-                'frequency': frequency,
-                'updated_by': getpass.getuser(),
-            },
-        )
+    UNION ALL
+
+    SELECT
+        c.column_name, 'codebook', 'frequency', c.code,
+        c.expected_frequency::TEXT, c.expected_frequency_interval::TEXT,
+        COALESCE(f.frequency, 0)::TEXT
+    FROM metabase.codebook AS c
+    LEFT JOIN metabase.code_frequency AS f
+        ON f.data_table_id = c.data_table_id
+        AND f.column_name = c.column_name
+        AND f.code = c.code
+    WHERE c.data_table_id = %(data_table_id)s
+    AND c.expected_frequency IS NOT NULL
+    AND ABS(COALESCE(f.frequency, 0) - c.expected_frequency)
+        > COALESCE(c.expected_frequency_interval, 0)
+
+    UNION ALL
+
+    SELECT
+        f.column_name, 'codebook', 'unexpected_code', f.code,
+        NULL, NULL, f.frequency::TEXT
+    FROM metabase.code_frequency AS f
+    WHERE f.data_table_id = %(data_table_id)s
+    AND f.code IS NOT NULL
+    AND f.column_name IN (
+        SELECT column_name FROM metabase.codebook
+        WHERE data_table_id = %(data_table_id)s
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM metabase.codebook AS c
+        WHERE c.data_table_id = f.data_table_id
+        AND c.column_name = f.column_name
+        AND c.code = f.code
+    )
+"""
 
 
-def get_code_metadata(col_data):
+def validate_data_table(metabase_cursor, data_table_id):
+    """Check the metadata of a Data Table against its expectations.
 
-    code_frequecy_counter = Counter(col_data)
+    Statistics in numeric_column, text_column, date_column and
+    code_frequency are compared with numeric_range, text_range, date_range
+    and codebook, within their tolerances, in a single statement reading the
+    metabase only. Violations replace those of the previous validation in
+    metabase.validation_violation.
 
-    return code_frequecy_counter
+    validation_status of the Data Table becomes 'rejected' if there is a
+    violation and 'passed' otherwise. It is left as it is if the Data Table
+    has no expectation, or is 'force_pass' or 'exempt'.
 
+    Returns:
+        ([validation_violation]): Violations found.
 
-def update_column_info(cursor, col_name, data_table_id, data_type):
-    """Add a row for this data column to the column info metadata table."""
+    """
+    params = {
+        'data_table_id': data_table_id,
+        'updated_by': getpass.getuser(),
+    }
 
-    # TODO How to handled existing rows?
+    metabase_cursor.execute(
+        """
+        DELETE FROM metabase.validation_violation
+        WHERE data_table_id = %(data_table_id)s
+        """,
+        params,
+    )
 
-    # Create Column Info entry
-    cursor.execute(
+    metabase_cursor.execute(
         """
-        INSERT INTO metabase.column_info (
-            data_table_id,
+        INSERT INTO metabase.validation_violation (
             column_name,
-            data_type,
+            expectation,
+            statistic,
+            code,
+            expected,
+            tolerance,
+            observed,
+            data_table_id,
             updated_by,
             date_last_updated
         )
-        VALUES (
+        SELECT
+            *,
             %(data_table_id)s,
-            %(column_name)s,
-            %(data_type)s,
             %(updated_by)s,
-            (SELECT CURRENT_TIMESTAMP)
+            CURRENT_TIMESTAMP
+        FROM ({}) AS violation
+        RETURNING
+            column_name, expectation, statistic, code, expected, tolerance,
+            observed
+        """.format(VALIDATION_QUERY),
+        params,
+    )
+    violations = [
+        VALIDATION_VIOLATION(*row) for row in metabase_cursor.fetchall()
+    ]
+
+    metabase_cursor.execute(
+        """
+        UPDATE metabase.data_table
+        SET validation_status = %(validation_status)s
+        WHERE data_table_id = %(data_table_id)s
+        AND validation_status IS DISTINCT FROM 'force_pass'
+        AND validation_status IS DISTINCT FROM 'exempt'
+        AND (
+            EXISTS (
+                SELECT 1 FROM metabase.numeric_range
+                WHERE data_table_id = %(data_table_id)s
+            )
+            OR EXISTS (
+                SELECT 1 FROM metabase.text_range
+                WHERE data_table_id = %(data_table_id)s
+            )
+            OR EXISTS (
+                SELECT 1 FROM metabase.date_range
+                WHERE data_table_id = %(data_table_id)s
+            )
+            OR EXISTS (
+                SELECT 1 FROM metabase.codebook
+                WHERE data_table_id = %(data_table_id)s
+            )
         )
-        RETURNING column_id
-        ;
         """,
-        {
-            'data_table_id': data_table_id,
-            'column_name': col_name,
-            'data_type': data_type,
-            'updated_by': getpass.getuser(),
-        }
+        dict(
+            params,
+            validation_status='rejected' if violations else 'passed',
+        ),
     )
 
-    serial_column_id = cursor.fetchall()[0][0]
-    return serial_column_id
+    return violations
+
+
+# #############################################################################
+#   Called by `find_joinable_columns()`
+# #############################################################################
+
+def select_joinable_columns(metabase_cur, column_id, limit=10):
+    """Select the columns sharing values with a column.
+
+    Candidates are the columns sharing an LSH band hash with the column,
+    looked up with the GIN index of column_minhash. Only their signatures are
+    compared, so no data is scanned.
+
+    Args:
+        column_id (int): Column to find joinable columns of.
+        limit (int): Largest number of columns returned.
+
+    Returns:
+        ([joinable_column]): Named tuples of column ID, Data Table ID, column
+            name, estimated Jaccard similarity and estimated containment of
+            the distinct values of the column in those of the candidate, by
+            descending containment, then Jaccard similarity.
+
+    Raises:
+        ValueError: If the column has no MinHash signature.
+
+    """
+    metabase_cur.execute(
+        """
+        SELECT m.signature, m.band_hashes, c.distinct_count
+        FROM metabase.column_minhash AS m
+        JOIN metabase.column_info AS c USING (column_id)
+        WHERE m.column_id = %(column_id)s
+        """,
+        {'column_id': column_id},
+    )
+    row = metabase_cur.fetchone()
+    if row is None:
+        raise ValueError(
+            'Column {} has no MinHash signature'.format(column_id))
+
+    signature = sketches.signature_from_bytes(row[0])
+    band_hashes = row[1]
+    n_distinct = row[2]
+
+    metabase_cur.execute(
+        """
+        SELECT
+            m.column_id,
+            m.data_table_id,
+            m.column_name,
+            m.signature,
+            c.distinct_count
+        FROM metabase.column_minhash AS m
+        JOIN metabase.column_info AS c USING (column_id)
+        WHERE m.band_hashes && %(band_hashes)s::BIGINT[]
+            AND m.column_id <> %(column_id)s
+        """,
+        {'band_hashes': band_hashes, 'column_id': column_id},
+    )
+
+    joinable_columns = []
+    for row in metabase_cur.fetchall():
+        jaccard = sketches.estimate_jaccard(
+            signature,
+            sketches.signature_from_bytes(row[3]),
+        )
+        if jaccard == 0:
+            continue
+
+        joinable_columns.append(JOINABLE_COLUMN(
+            row[0],
+            row[1],
+            row[2],
+            jaccard,
+            sketches.estimate_containment(jaccard, n_distinct, row[4]),
+        ))
+
+    joinable_columns.sort(
+        key=lambda column: (-column.containment, -column.jaccard,
+                            column.column_id),
+    )
+    return joinable_columns[:limit]
 
 
 # #############################################################################
-#   Called by `ExtractMetadata.export_table_metadata()`
+#   Called by `ExtractMetadata.export_table_metadata()` and `export_many()`
 # #############################################################################
 
 def select_table_level_gmeta_fields(metabase_cur, data_table_id):
     """
     Select metadata at data set and table levels.
     """
+    return select_table_level_gmeta_fields_batch(
+        metabase_cur,
+        [data_table_id],
+    )[data_table_id]
+
+
+def select_table_level_gmeta_fields_batch(metabase_cur, data_table_ids):
+    """
+    Select metadata at data set and table levels for a batch of Data Tables.
+
+    Returns:
+        (dict): Query results from psycopg2's DictCursor keyed by
+            data_table_id. Data Tables that are not found are left out.
+    """
     date_format_str = 'YYYY-MM-DD'
 
     metabase_cur.execute(
         """
             SELECT
+                data_table_id,
                 file_table_name AS file_name,
                 format AS file_type,
                 data_table.data_set_id AS dataset_id,
@@ -472,16 +2043,15 @@ def select_table_level_gmeta_fields(metabase_cur, data_table_id):
                 --   NOTE: not included in the sample file
             FROM metabase.data_table
                 -- JOIN metabase.data_set USING (data_set_id)
-            WHERE data_table_id = %(data_table_id)s
+            WHERE data_table_id = ANY(%(data_table_ids)s)
         """,
         {
             'date_format_str': date_format_str,
-            'data_table_id': data_table_id
+            'data_table_ids': list(data_table_ids),
         },
     )
 
-    return metabase_cur.fetchall()[0]
-    # Index by 0 since the result is a list of one dict.
+    return {row['data_table_id']: row for row in metabase_cur.fetchall()}
 
 
 def select_column_level_gmeta_fields(metabase_cur, data_table_id):
@@ -489,172 +2059,351 @@ def select_column_level_gmeta_fields(metabase_cur, data_table_id):
     Select column-level metadata. Gmeta fields to export are different by
     column type.
     """
+    return select_column_level_gmeta_fields_batch(
+        metabase_cur,
+        [data_table_id],
+    )[data_table_id]
+
+
+def select_column_level_gmeta_fields_batch(metabase_cur, data_table_ids):
+    """
+    Select column-level metadata for a batch of Data Tables.
+
+    Each column type is selected with one query for the whole batch instead of
+    one query per column.
+
+    Returns:
+        (dict): data_table_id -> {(column_id, column_name, Gmeta type):
+            column result}. Every requested data_table_id is a key.
+    """
+    data_table_ids = list(data_table_ids)
+
     metabase_cur.execute(
         """
-            SELECT column_id, column_name, data_type
+            SELECT
+                column_id,
+                data_table_id,
+                column_name,
+                data_type,
+                missing_count,
+                distinct_count
             FROM metabase.column_info
-            WHERE data_table_id = %(data_table_id)s;
+            WHERE data_table_id = ANY(%(data_table_ids)s)
+            ORDER BY data_table_id, column_id;
         """,
         {
-            'data_table_id': data_table_id,
+            'data_table_ids': data_table_ids,
         },
     )
 
-    column_id_name_type_tp_ls = metabase_cur.fetchall()
+    column_info_ls = metabase_cur.fetchall()
+
+    numeric_dict = select_numeric_gmeta_fields(metabase_cur, data_table_ids)
+    temporal_dict = select_temporal_gmeta_fields(metabase_cur, data_table_ids)
+    categorical_dict = select_categorical_gmeta_fields(
+        metabase_cur,
+        data_table_ids,
+    )
+    textual_dict = select_textual_gmeta_fields(metabase_cur, data_table_ids)
+    top_value_dict = select_text_top_value_gmeta_fields(
+        metabase_cur,
+        data_table_ids,
+    )
+    histogram_dict = select_histogram_gmeta_fields(
+        metabase_cur,
+        data_table_ids,
+    )
 
-    column_gmeta_fields_dict = {}
+    column_gmeta_fields_dict = {
+        data_table_id: {} for data_table_id in data_table_ids
+    }
 
-    for column_id, column_name, data_type in column_id_name_type_tp_ls:
+    for (column_id, data_table_id, column_name, data_type, missing,
+         values) in column_info_ls:
         if data_type == 'numeric':
-            column_gmeta_fields_dict[
+            column_gmeta_fields_dict[data_table_id][
                 (column_id, column_name, 'Numeric')
                 # Links Metabase data type terms to Gmeta terms.
                 # E.g. `text` in Metabase is `Textual` in Gmeta.
-            ] = select_numeric_gmeta_fields(
-                metabase_cur,
-                column_id,
+            ] = merge_gmeta_fields(
+                numeric_dict.get(column_id),
+                missing=missing,
+                values=values,
+                histogram=histogram_dict.get(column_id, {}),
             )
 
         elif data_type == 'date':
-            column_gmeta_fields_dict[
+            column_gmeta_fields_dict[data_table_id][
                 (column_id, column_name, 'Temporal')
-            ] = select_temporal_gmeta_fields(
-                metabase_cur,
-                column_id,
+            ] = merge_gmeta_fields(
+                temporal_dict.get(column_id),
+                missing=missing,
+                values=values,
             )
 
         elif data_type == 'code':
             # TODO: Categorical type is not presented in the Gmeta sample.
             # Currently treated the same as Textual columns.
-            column_gmeta_fields_dict[
+            codes = categorical_dict.get(column_id)
+            column_gmeta_fields_dict[data_table_id][
                 (column_id, column_name, 'Categorical')
-            ] = select_categorical_gmeta_fields(
-                metabase_cur,
-                column_id,
+            ] = merge_gmeta_fields(
+                {'codes': codes} if codes else None,
+                missing=missing,
+                values=values,
             )
 
         else:
             # data_type = 'text':
-            column_gmeta_fields_dict[
+            column_gmeta_fields_dict[data_table_id][
                 (column_id, column_name, 'Textual')
-            ] = select_textual_gmeta_fields(
-                metabase_cur,
-                column_id,
+            ] = merge_gmeta_fields(
+                textual_dict.get(column_id),
+                missing=missing,
+                values=values,
+                histogram=histogram_dict.get(column_id, {}),
+                top_values=top_value_dict.get(column_id, []),
             )
 
     return column_gmeta_fields_dict
 
 
-def select_numeric_gmeta_fields(metabase_cur, column_id):
+def select_numeric_gmeta_fields(metabase_cur, data_table_ids):
     """
     Select Gmeta fields related to numerical columns.
+
+    Returns:
+        (dict): Query results keyed by column_id.
     """
     metabase_cur.execute(
         """
             SELECT
+                column_id,
                 minimum::FLOAT AS min,
                 maximum::FLOAT AS max,
-                mean::FLOAT
+                mean::FLOAT,
+                std::FLOAT
                 -- Without type cast it will return in Decimal('#')
 
             FROM metabase.numeric_column
-            WHERE column_id = %(column_id)s
+            WHERE data_table_id = ANY(%(data_table_ids)s)
         """,
         {
-            'column_id': column_id,
+            'data_table_ids': data_table_ids,
         },
     )
 
-    result = metabase_cur.fetchall()
-    if result:
-        return result[0]
-    else:
-        return None
+    return {row['column_id']: row for row in metabase_cur.fetchall()}
 
 
-def select_temporal_gmeta_fields(metabase_cur, column_id):
+def select_temporal_gmeta_fields(metabase_cur, data_table_ids):
     """
     Select Gmeta fields related to temporal columns.
+
+    Returns:
+        (dict): Query results keyed by column_id.
     """
     metabase_cur.execute(
         """
             SELECT
+                column_id,
                 TO_CHAR(min_date, 'MM/DD/YYYY HH:MM:SS AM') AS min,
                 TO_CHAR(max_date, 'MM/DD/YYYY HH:MM:SS AM') AS max
             FROM metabase.date_column
-            WHERE column_id = %(column_id)s
+            WHERE data_table_id = ANY(%(data_table_ids)s)
         """,
         {
-            'column_id': column_id,
+            'data_table_ids': data_table_ids,
         },
     )
 
-    result = metabase_cur.fetchall()
-    if result:
-        return result[0]
-    else:
-        return None
+    return {row['column_id']: row for row in metabase_cur.fetchall()}
 
 
-def select_categorical_gmeta_fields(metabase_cur, column_id):
+def select_categorical_gmeta_fields(metabase_cur, data_table_ids):
     """
     Select Gmeta fields related to categorical columns.
 
-    Note that the return value is different from other column types.
+    Note that the values of the returned dictionary are different from other
+    column types.
 
     Args:
         metabase_cur
-        column_id
+        data_table_ids
 
     Return:
-        (Query result object fetched from psycopg2's DictCursor):
-            Like a list of dictionaries with column names as keys. An empty
-            list is returned if no record to fetch.
+        (dict): column_id -> Query result object fetched from psycopg2's
+            DictCursor. Like a list of dictionaries with column names as keys,
+            ordered by descending frequency. Columns without codes are left
+            out.
     """
     metabase_cur.execute(
         """
-            SELECT code, frequency
-            FROM metabase.code_frequency
-            WHERE column_id = %(column_id)s
-            ORDER BY frequency DESC
-            LIMIT 20    -- Top-k
+            SELECT column_id, code, frequency
+            FROM (
+                SELECT
+                    column_id,
+                    code,
+                    frequency,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY column_id
+                        ORDER BY frequency DESC
+                    ) AS frequency_rank
+                FROM metabase.code_frequency
+                WHERE data_table_id = ANY(%(data_table_ids)s)
+            ) AS ranked_code_frequency
+            WHERE frequency_rank <= 20    -- Top-k
+            ORDER BY column_id, frequency_rank
         """,
         {
-            'column_id': column_id,
+            'data_table_ids': data_table_ids,
+        },
+    )
+
+    categorical_dict = {}
+    for row in metabase_cur.fetchall():
+        categorical_dict.setdefault(row['column_id'], []).append(row)
+
+    return categorical_dict
+
+
+def select_histogram_gmeta_fields(metabase_cur, data_table_ids):
+    """
+    Select histogram bins of numeric values and text lengths.
+
+    Returns:
+        (dict): column_id -> Histogram Data JSON.
+    """
+    metabase_cur.execute(
+        """
+            SELECT
+                column_id,
+                method,
+                lower_bound::FLOAT,
+                upper_bound::FLOAT,
+                frequency
+            FROM metabase.histogram_bin
+            WHERE data_table_id = ANY(%(data_table_ids)s)
+            ORDER BY column_id, bin_number
+        """,
+        {
+            'data_table_ids': data_table_ids,
         },
     )
 
-    return metabase_cur.fetchall()
+    histogram_dict = {}
+    for row in metabase_cur.fetchall():
+        histogram = histogram_dict.setdefault(
+            row['column_id'],
+            {'method': row['method'], 'bins': []},
+        )
+        histogram['bins'].append({
+            'lower_bound': row['lower_bound'],
+            'upper_bound': row['upper_bound'],
+            'frequency': row['frequency'],
+        })
+
+    return histogram_dict
+
+
+def merge_gmeta_fields(column_result, **fields):
+    """
+    Add fields selected from other tables to the Gmeta fields of a column.
+
+    Columns without a type-specific result are left out of GMETA, so `None` is
+    returned for them.
+    """
+    if not column_result:
+        return None
+
+    column_result = dict(column_result)
+    column_result.update(fields)
+    return column_result
 
 
-def select_textual_gmeta_fields(metabase_cur, column_id):
+def select_textual_gmeta_fields(metabase_cur, data_table_ids):
     """
     Select Gmeta fields related to textual columns.
+
+    Returns:
+        (dict): Query results keyed by column_id.
     """
     metabase_cur.execute(
         # Placeholder query for now
         """
             SELECT
+                column_id,
                 max_length::FLOAT
             FROM metabase.text_column
-            WHERE column_id = %(column_id)s
+            WHERE data_table_id = ANY(%(data_table_ids)s)
         """,
         {
-            'column_id': column_id,
+            'data_table_ids': data_table_ids,
         },
     )
 
-    result = metabase_cur.fetchall()
-    if result:
-        return result[0]
-    else:
-        return None
+    return {row['column_id']: row for row in metabase_cur.fetchall()}
+
+
+def select_text_top_value_gmeta_fields(metabase_cur, data_table_ids):
+    """
+    Select the most frequent values of textual columns.
+
+    Returns:
+        (dict): column_id -> Query result rows of value and frequency, by
+            rank. Columns without top values are left out.
+    """
+    metabase_cur.execute(
+        """
+            SELECT column_id, value, frequency
+            FROM metabase.text_top_value
+            WHERE data_table_id = ANY(%(data_table_ids)s)
+            ORDER BY column_id, rank
+        """,
+        {
+            'data_table_ids': data_table_ids,
+        },
+    )
+
+    top_value_dict = {}
+    for row in metabase_cur.fetchall():
+        top_value_dict.setdefault(row['column_id'], []).append(row)
+
+    return top_value_dict
 
 
 def export_gmeta_in_json(table_gmeta_dict, column_gmeta_dict, output_filepath):
     """
     Shape and export GMETA fields in JSON format.
     """
+    dump_gmeta_in_json(
+        build_gmeta_dict(table_gmeta_dict, column_gmeta_dict),
+        output_filepath,
+    )
+
+
+def dump_gmeta_in_json(output_dict, output_filepath):
+    """
+    Export a GMETA document in JSON format.
+    """
+    try:
+        with open(output_filepath, 'w') as output_file:
+            json.dump(output_dict, output_file, indent=4)
+
+    except Exception as e:
+        if os.path.exists(output_filepath):
+            os.remove(output_filepath)
+
+        raise e
+
+
+def build_gmeta_dict(table_gmeta_dict, column_gmeta_dict):
+    """
+    Shape GMETA fields into the GMETA document of one Data Table.
+
+    Returns:
+        (dict): GMETA document, ready to be serialized as JSON.
+    """
     columns_metadata_dict = {}
 
     for ((_column_id, column_name, data_type),
@@ -664,13 +2413,13 @@ def export_gmeta_in_json(table_gmeta_dict, column_gmeta_dict, output_filepath):
                 columns_metadata_dict[column_name] = {
                     'profiler-type': data_type,
                     'profiler-most-detected': None,
-                    'missing': None,
-                    'values': None,
+                    'missing': column_result['missing'],
+                    'values': column_result['values'],
                     'min': column_result['min'],
                     'max': column_result['max'],
-                    'std': None,
+                    'std': column_result['std'],
                     'mean': column_result['mean'],
-                    'Histogram Data JSON': {},
+                    'Histogram Data JSON': column_result['histogram'],
                     'top-k': {},
                     'top-value': None,
                     'freq-top-value': None,
@@ -681,8 +2430,8 @@ def export_gmeta_in_json(table_gmeta_dict, column_gmeta_dict, output_filepath):
                 columns_metadata_dict[column_name] = {
                     'profiler-type': data_type,
                     'profiler-most-detected': None,
-                    'missing': None,
-                    'values': None,
+                    'missing': column_result['missing'],
+                    'values': column_result['values'],
                     'min': column_result['min'],
                     'max': column_result['max'],
                     'std': None,
@@ -695,30 +2444,38 @@ def export_gmeta_in_json(table_gmeta_dict, column_gmeta_dict, output_filepath):
 
             elif data_type == 'Categorical':
                 top_k_dict = {}
-                for row_dict in column_result:
+                for row_dict in column_result['codes']:
                     top_k_dict[row_dict['code']] = row_dict['frequency']
 
                 columns_metadata_dict[column_name] = {
                     'profiler-type': data_type,
                     'profiler-most-detected': None,
-                    'missing': None,
-                    'values': None,
+                    'missing': column_result['missing'],
+                    'values': column_result['values'],
                     'top-k': top_k_dict,
-                    'top-value': column_result[0]['code'],
-                    'freq-top-value': column_result[0]['frequency'],
+                    'top-value': column_result['codes'][0]['code'],
+                    'freq-top-value': column_result['codes'][0]['frequency'],
                     'description': None,
                 }
 
             else:
                 # data_type == 'Textual':
+                # Frequencies of top values are estimates, see
+                # `summarize_text()`.
+                top_values = column_result.get('top_values') or []
                 columns_metadata_dict[column_name] = {
                     'profiler-type': data_type,
                     'profiler-most-detected': None,
-                    'missing': None,
-                    'values': None,
-                    'top-k': {},
-                    'top-value': None,
-                    'freq-top-value': None,
+                    'missing': column_result['missing'],
+                    'values': column_result['values'],
+                    'Histogram Data JSON': column_result['histogram'],
+                    'top-k': {
+                        row['value']: row['frequency'] for row in top_values
+                    },
+                    'top-value': (
+                        top_values[0]['value'] if top_values else None),
+                    'freq-top-value': (
+                        top_values[0]['frequency'] if top_values else None),
                     'description': None,
                 }
 
@@ -771,12 +2528,234 @@ def export_gmeta_in_json(table_gmeta_dict, column_gmeta_dict, output_filepath):
         }],
     }
 
+    return output_dict
+
+
+def iter_gmeta_dicts(metabase_cur, data_table_ids):
+    """
+    Yield the GMETA document of each Data Table in a batch.
+
+    Documents are read from the GMETA cache, and only the Data Tables whose
+    cached document is missing or stale are rendered (and cached again), with
+    a fixed number of queries for the whole batch.
+
+    Yields:
+        (int, dict): (data_table_id, GMETA document). Data Tables that are not
+            found in the metabase are skipped.
+    """
+    gmeta_dict = select_cached_gmeta(metabase_cur, data_table_ids)
+
+    stale_data_table_ids = [
+        data_table_id for data_table_id in data_table_ids
+        if data_table_id not in gmeta_dict
+    ]
+    if stale_data_table_ids:
+        gmeta_dict.update(
+            refresh_gmeta_cache(metabase_cur, stale_data_table_ids)
+        )
+
+    for data_table_id in data_table_ids:
+        if data_table_id in gmeta_dict:
+            yield data_table_id, gmeta_dict[data_table_id]
+
+
+def select_gmeta(metabase_cur, data_table_id):
+    """
+    Return the GMETA document of one Data Table, from the cache if it is fresh.
+    """
+    for _data_table_id, gmeta_dict in iter_gmeta_dicts(
+            metabase_cur, [data_table_id]):
+        return gmeta_dict
+
+    raise ValueError('data_table_id not found in metabase.data_table')
+
+
+def select_cached_gmeta(metabase_cur, data_table_ids):
+    """
+    Select cached GMETA documents that are still fresh.
+
+    A cached document is stale once `data_table.date_last_updated` differs
+    from the value it was rendered from, i.e. once the table is processed
+    again, or once it was rendered in another format than
+    `GMETA_FORMAT_VERSION`.
+
+    Returns:
+        (dict): data_table_id -> GMETA document.
+    """
+    metabase_cur.execute(
+        """
+            SELECT data_table_id, gmeta
+            FROM metabase.gmeta_cache
+                JOIN metabase.data_table USING (data_table_id)
+            WHERE
+                data_table_id = ANY(%(data_table_ids)s)
+                AND gmeta_cache.source_date_last_updated
+                    IS NOT DISTINCT FROM data_table.date_last_updated
+                AND gmeta_cache.format_version = %(format_version)s
+        """,
+        {
+            'data_table_ids': list(data_table_ids),
+            'format_version': GMETA_FORMAT_VERSION,
+        },
+    )
+
+    return {
+        data_table_id: gmeta
+        for data_table_id, gmeta in metabase_cur.fetchall()
+    }
+
+
+def refresh_gmeta_cache(metabase_cur, data_table_ids):
+    """
+    Render GMETA documents and store them in the GMETA cache.
+
+    The version of a cached document is only bumped when its hash changes, so
+    consumers can poll `gmeta_hash` or `version` instead of the document.
+
+    Returns:
+        (dict): data_table_id -> GMETA document. Data Tables that are not
+            found in the metabase are left out.
+    """
+    table_gmeta_fields_dict = select_table_level_gmeta_fields_batch(
+        metabase_cur,
+        data_table_ids,
+    )
+    column_gmeta_fields_dict = select_column_level_gmeta_fields_batch(
+        metabase_cur,
+        data_table_ids,
+    )
+
+    gmeta_dict = {}
+    cache_rows = []
+    for data_table_id in data_table_ids:
+        if data_table_id not in table_gmeta_fields_dict:
+            continue
+
+        gmeta = build_gmeta_dict(
+            table_gmeta_fields_dict[data_table_id],
+            column_gmeta_fields_dict[data_table_id],
+        )
+        gmeta_dict[data_table_id] = gmeta
+        cache_rows.append((
+            data_table_id,
+            psycopg2.extras.Json(gmeta),
+            get_gmeta_hash(gmeta),
+            GMETA_FORMAT_VERSION,
+            getpass.getuser(),
+        ))
+
+    if cache_rows:
+        psycopg2.extras.execute_values(
+            metabase_cur,
+            """
+            INSERT INTO metabase.gmeta_cache (
+                data_table_id,
+                gmeta,
+                gmeta_hash,
+                version,
+                source_date_last_updated,
+                format_version,
+                created_by,
+                date_created,
+                updated_by,
+                date_last_updated
+            )
+            SELECT
+                cache_row.data_table_id,
+                cache_row.gmeta,
+                cache_row.gmeta_hash,
+                1,
+                data_table.date_last_updated,
+                cache_row.format_version,
+                cache_row.updated_by,
+                CURRENT_TIMESTAMP,
+                cache_row.updated_by,
+                CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS cache_row (
+                data_table_id,
+                gmeta,
+                gmeta_hash,
+                format_version,
+                updated_by
+            )
+                JOIN metabase.data_table USING (data_table_id)
+            ON CONFLICT (data_table_id) DO UPDATE SET
+                gmeta = EXCLUDED.gmeta,
+                gmeta_hash = EXCLUDED.gmeta_hash,
+                version = CASE
+                    WHEN gmeta_cache.gmeta_hash = EXCLUDED.gmeta_hash
+                        THEN gmeta_cache.version
+                    ELSE gmeta_cache.version + 1
+                END,
+                source_date_last_updated = EXCLUDED.source_date_last_updated,
+                format_version = EXCLUDED.format_version,
+                updated_by = EXCLUDED.updated_by,
+                date_last_updated = EXCLUDED.date_last_updated
+            """,
+            cache_rows,
+            template='(%s, %s::JSONB, %s, %s, %s)',
+        )
+
+    return gmeta_dict
+
+
+def get_gmeta_hash(gmeta_dict):
+    """Return a stable MD5 hex digest of a GMETA document."""
+
+    # Round trip through JSON first so that keys are strings (e.g. a `None`
+    # code becomes "null") and can be sorted.
+    canonical_dict = json.loads(json.dumps(gmeta_dict))
+
+    return hashlib.md5(
+        json.dumps(canonical_dict, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def write_gmeta_document(output_file, gmeta_dict):
+    """
+    Serialize one GMETA document incrementally as a single line of JSON.
+    """
+    for chunk in GMETA_ENCODER.iterencode(gmeta_dict):
+        output_file.write(chunk)
+    output_file.write('\n')
+
+
+def get_umask():
+    """Return the umask of the process, which can only be read by setting it.
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def write_file_atomically(output_filepath, write_func):
+    """
+    Write a file through a temporary file in the same directory.
+
+    The temporary file is renamed to `output_filepath` only after `write_func`
+    returns, so readers never see a partially written file. It is given the
+    permissions of a file created with open(), 0o666 less the umask, since
+    temporary files are only readable by their owner.
+
+    Args:
+        output_filepath (str): Final path of the file.
+        write_func (callable): Called with the open temporary file.
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_filepath))
+    fd, tmp_filepath = tempfile.mkstemp(
+        dir=output_dir,
+        prefix='.' + os.path.basename(output_filepath),
+        suffix='.tmp',
+    )
+
     try:
-        with open(output_filepath, 'w') as output_file:
-            json.dump(output_dict, output_file, indent=4)
+        with os.fdopen(fd, 'w') as output_file:
+            os.fchmod(output_file.fileno(), 0o666 & ~get_umask())
+            write_func(output_file)
+        os.replace(tmp_filepath, output_filepath)
 
     except Exception as e:
-        if os.path.exists(output_filepath):
-            os.remove(output_filepath)
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
 
         raise e
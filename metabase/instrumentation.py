@@ -0,0 +1,465 @@
+"""Per-stage metrics, memory profiling and SQL tracing of extraction runs."""
+
+from collections import Counter, OrderedDict
+import contextlib
+import datetime
+import getpass
+import json
+import logging
+import os
+import time
+import tracemalloc
+import uuid
+
+import psycopg2
+import psycopg2.extras
+
+
+logger = logging.getLogger(__name__)
+
+METRIC_FIELDS = [
+    'wall_seconds',
+    'execute_seconds',
+    'fetch_seconds',
+    'rows_fetched',
+    'bytes_fetched',
+    'queries_issued',
+    'rows_written',
+]
+
+# Not added up like METRIC_FIELDS: RSS is sampled when the first run of a stage
+# starts and when its last run ends, the tracemalloc peak is the highest one.
+MEMORY_FIELDS = [
+    'rss_before_bytes',
+    'rss_after_bytes',
+    'peak_traced_bytes',
+]
+
+
+class RunMetrics():
+    """Collect per-stage metrics of one `ExtractMetadata.process_table()` run.
+
+    Stages are timed with `stage()`. Cursors wrapped with `MetricsCursor`
+    report the queries they issue and the rows they fetch to every running
+    stage. Metrics of a stage that runs several times for the same column are
+    added up.
+
+    For every stage, `execute_seconds` is the time spent in `execute()`
+    (running queries and receiving their results) and `fetch_seconds` the time
+    spent converting fetched rows to Python objects. The rest of
+    `wall_seconds` is spent in Python, e.g. computing statistics.
+    `rows_written` counts rows inserted, updated or deleted.
+
+    If `profile_memory` is set, the process RSS before and after every stage
+    and the peak of memory allocated by Python during it are recorded as well.
+    The peak is only measured while `tracemalloc` is tracing.
+
+    """
+
+    def __init__(self, data_table_id, enabled=True, log_metrics=False,
+                 profile_memory=False):
+        """Start a run.
+
+        Args:
+            data_table_id (int): Data Table being processed.
+            enabled (bool): If False, `stage()` records nothing.
+            log_metrics (bool): Log every finished stage as a JSON object.
+            profile_memory (bool): Record memory usage of every stage.
+
+        """
+        self.data_table_id = data_table_id
+        self.enabled = enabled
+        self.log_metrics = log_metrics
+        self.profile_memory = profile_memory
+
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.datetime.now()
+        self.records = OrderedDict()
+        # Run-level counts, not stored in metabase.profiling_run.
+        self.rows_scanned = 0
+        self.column_types = Counter()
+        self._running = []
+
+    @contextlib.contextmanager
+    def stage(self, stage, column_name=None):
+        """Time a stage, optionally for a single column.
+
+        Column-level stages nested in a table-level stage are counted in both.
+
+        """
+        if not self.enabled:
+            yield
+            return
+
+        key = (column_name, stage)
+        if key not in self.records:
+            self.records[key] = dict.fromkeys(METRIC_FIELDS, 0)
+            self.records[key].update(dict.fromkeys(MEMORY_FIELDS))
+        record = self.records[key]
+
+        if self.profile_memory:
+            self._update_traced_peak()
+            if record['rss_before_bytes'] is None:
+                record['rss_before_bytes'] = get_rss_bytes()
+
+        self._running.append(record)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['wall_seconds'] += time.perf_counter() - start
+            if self.profile_memory:
+                self._update_traced_peak()
+                record['rss_after_bytes'] = get_rss_bytes()
+            self._running.pop()
+
+            if self.log_metrics:
+                logger.info(json.dumps(dict(
+                    record,
+                    run_id=self.run_id,
+                    data_table_id=self.data_table_id,
+                    column_name=column_name,
+                    stage=stage,
+                )))
+
+    def add(self, **metrics):
+        """Add metrics to every running stage."""
+
+        for record in self._running:
+            for field, value in metrics.items():
+                record[field] += value
+
+    def _update_traced_peak(self):
+        """Fold the tracemalloc peak since the last call into running stages.
+
+        The peak is reset afterwards, so that a stage starting now is not
+        charged with the peak of the stages before it.
+
+        """
+        if not tracemalloc.is_tracing():
+            return
+
+        peak = tracemalloc.get_traced_memory()[1]
+        for record in self._running:
+            record['peak_traced_bytes'] = max(
+                record['peak_traced_bytes'] or 0,
+                peak,
+            )
+
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            # Before Python 3.9 the peak can only be reset with the traces.
+            tracemalloc.clear_traces()
+
+    def top_memory_stages(self, n=5):
+        """Return the column-level stages with the highest memory usage.
+
+        Stages are ranked by tracemalloc peak, or by RSS growth if the peak
+        was not measured.
+
+        Returns:
+            (list): Up to n (column_name, stage, record) tuples.
+
+        """
+        def memory_usage(item):
+            (column_name, stage), record = item
+            if record['peak_traced_bytes'] is not None:
+                return record['peak_traced_bytes']
+            if record['rss_before_bytes'] is None:
+                return 0
+            return record['rss_after_bytes'] - record['rss_before_bytes']
+
+        column_stages = [
+            item for item in self.records.items() if item[0][0] is not None
+        ]
+        column_stages.sort(key=memory_usage, reverse=True)
+
+        return [
+            (column_name, stage, record)
+            for (column_name, stage), record in column_stages[:n]
+        ]
+
+    def save(self, metabase_cur):
+        """Insert the metrics of this run into metabase.profiling_run."""
+
+        if not self.records:
+            return
+
+        psycopg2.extras.execute_values(
+            metabase_cur,
+            """
+            INSERT INTO metabase.profiling_run (
+                run_id,
+                data_table_id,
+                column_name,
+                stage,
+                run_started_at,
+                wall_seconds,
+                execute_seconds,
+                fetch_seconds,
+                rows_fetched,
+                bytes_fetched,
+                queries_issued,
+                rows_written,
+                rss_before_bytes,
+                rss_after_bytes,
+                peak_traced_bytes,
+                created_by,
+                date_created
+            ) VALUES %s
+            """,
+            [
+                (
+                    self.run_id,
+                    self.data_table_id,
+                    column_name,
+                    stage,
+                    self.started_at,
+                    record['wall_seconds'],
+                    record['execute_seconds'],
+                    record['fetch_seconds'],
+                    record['rows_fetched'],
+                    record['bytes_fetched'],
+                    record['queries_issued'],
+                    record['rows_written'],
+                    record['rss_before_bytes'],
+                    record['rss_after_bytes'],
+                    record['peak_traced_bytes'],
+                    getpass.getuser(),
+                )
+                for (column_name, stage), record in self.records.items()
+            ],
+            template=('(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '
+                      '%s, %s, %s, CURRENT_TIMESTAMP)'),
+        )
+
+
+class MetricsCursor():
+    """psycopg2 cursor wrapper reporting queries and fetches to RunMetrics.
+
+    Every other attribute is delegated to the wrapped cursor, so the wrapper
+    can be passed wherever a cursor is expected.
+
+    """
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def execute(self, query, vars=None):
+        rows_written = 0
+        start = time.perf_counter()
+        try:
+            result = self._cursor.execute(query, vars)
+            rows_written = self._rows_written()
+            return result
+        finally:
+            self._metrics.add(
+                execute_seconds=time.perf_counter() - start,
+                queries_issued=1,
+                rows_written=rows_written,
+            )
+
+    def _rows_written(self):
+        """Return the number of rows written by the last statement."""
+
+        status = self._cursor.statusmessage or ''
+        if status.startswith(('INSERT', 'UPDATE', 'DELETE')):
+            return max(self._cursor.rowcount, 0)
+        return 0
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone, single_row=True)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._fetch(self._cursor.fetchmany)
+        return self._fetch(lambda: self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def _fetch(self, fetch_func, single_row=False):
+        start = time.perf_counter()
+        result = fetch_func()
+        fetch_seconds = time.perf_counter() - start
+
+        if single_row:
+            rows = [] if result is None else [result]
+        else:
+            rows = result
+
+        self._metrics.add(
+            fetch_seconds=fetch_seconds,
+            rows_fetched=len(rows),
+            bytes_fetched=estimate_bytes(rows),
+        )
+        return result
+
+
+def estimate_bytes(rows):
+    """Estimate the size of fetched rows.
+
+    Text values count their length and other non-null values 8 bytes, which is
+    close to what is transferred for typical columns without measuring every
+    Python object.
+
+    """
+    n_bytes = 0
+    for row in rows:
+        for value in row:
+            if value is None:
+                continue
+            elif isinstance(value, str):
+                n_bytes += len(value)
+            else:
+                n_bytes += 8
+
+    return n_bytes
+
+
+def get_rss_bytes():
+    """Return the resident set size of this process.
+
+    Read from /proc, so only available on Linux.
+
+    Returns:
+        (int): RSS in bytes, or None if it cannot be read.
+
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def format_memory_report(stages):
+    """Format the output of `RunMetrics.top_memory_stages()` for printing."""
+
+    def megabytes(n_bytes):
+        return '-' if n_bytes is None else '{:.1f}'.format(n_bytes / 2**20)
+
+    lines = ['{:<30} {:<15} {:>10} {:>14} {:>13}'.format(
+        'column', 'stage', 'peak MB', 'RSS before MB', 'RSS after MB')]
+    for column_name, stage, record in stages:
+        lines.append('{:<30} {:<15} {:>10} {:>14} {:>13}'.format(
+            column_name,
+            stage,
+            megabytes(record['peak_traced_bytes']),
+            megabytes(record['rss_before_bytes']),
+            megabytes(record['rss_after_bytes']),
+        ))
+
+    return '\n'.join(lines)
+
+
+class TracingCursor():
+    """psycopg2 cursor wrapper logging every statement it issues.
+
+    Each statement is logged as a JSON object with the database it runs
+    against, its duration and row count. If `explain_file` is given, the
+    plans of SELECT statements are captured with EXPLAIN (ANALYZE, BUFFERS)
+    and written with the statement to that file, one JSON object per line.
+    EXPLAIN ANALYZE runs the statement a second time, so this is only meant
+    for diagnosing slow tables, and the wrapped cursor must be on an
+    autocommit connection so that a failing EXPLAIN does not abort a
+    transaction.
+
+    Every other attribute is delegated to the wrapped cursor.
+
+    """
+
+    def __init__(self, cursor, database, explain_file=None):
+        """
+        Args:
+            cursor: psycopg2 cursor to wrap.
+            database (str): Name of the database in the trace, e.g. 'data'.
+            explain_file (file): Open file to write traces with plans to.
+
+        """
+        self._cursor = cursor
+        self._database = database
+        self._explain_file = explain_file
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def execute(self, query, vars=None):
+        plan = None
+        if self._explain_file is not None:
+            plan = self._explain(query, vars)
+
+        error = None
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(query, vars)
+        except Exception as e:
+            error = str(e).strip()
+            raise
+        finally:
+            trace = OrderedDict([
+                ('database', self._database),
+                ('statement', self._statement(query, vars)),
+                ('seconds', time.perf_counter() - start),
+                ('rowcount', self._cursor.rowcount),
+                ('error', error),
+            ])
+            logger.info(json.dumps(trace))
+
+            if plan is not None:
+                trace['plan'] = plan
+                self._explain_file.write(json.dumps(trace) + '\n')
+
+    def _statement(self, query, vars, max_length=2000):
+        """Return the statement sent to the server, truncated for logging."""
+
+        if self._cursor.query is not None:
+            statement = self._cursor.query.decode('utf-8', 'replace')
+        else:
+            statement = str(query)
+
+        statement = ' '.join(statement.split())
+        if len(statement) > max_length:
+            statement = statement[:max_length] + '...'
+
+        return statement
+
+    def _explain(self, query, vars):
+        """Capture the plan of a SELECT statement with EXPLAIN ANALYZE.
+
+        Returns:
+            (list or dict): JSON plan, or an error if the statement fails.
+                None for statements other than SELECT.
+
+        """
+        statement = self._cursor.mogrify(query, vars).decode('utf-8')
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+
+        with self._cursor.connection.cursor() as explain_cursor:
+            try:
+                explain_cursor.execute(
+                    'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement
+                )
+                return explain_cursor.fetchone()[0]
+            except psycopg2.Error as e:
+                return {'error': str(e).strip()}
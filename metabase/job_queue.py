@@ -0,0 +1,464 @@
+"""Queue of extraction jobs in the metabase, drained by workers on any host.
+
+Jobs are rows of metabase.extraction_job. Workers claim the pending job with
+the highest priority with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+workers never claim the same job, and hold a lease on it that they renew with
+heartbeats. Jobs whose lease expired, e.g. because their worker was killed,
+are released for another attempt or failed after `max_attempts`. All times
+come from the database clock.
+
+Enqueue processed Data Tables and start workers with::
+
+    python -m metabase.job_queue enqueue 1 2 3 --priority 10
+    python -m metabase.job_queue work
+
+"""
+
+import argparse
+from collections import namedtuple
+import getpass
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import psycopg2
+
+from . import settings
+from . import extract_metadata
+
+
+logger = logging.getLogger(__name__)
+
+queued_job = namedtuple(
+    'queued_job',
+    ['job_id', 'data_table_id', 'options', 'attempts'],
+)
+
+# Arguments of `ExtractMetadata.process_table()` set by the worker, not by
+# the options of a job.
+WORKER_OPTIONS = {'abort_event'}
+
+
+def check_options(options):
+    """Check that options are keyword arguments of a job's run.
+
+    Raises:
+        ValueError: If an option is not an argument of
+            `ExtractMetadata.process_table()`, or is set by the worker.
+
+    """
+    parameters = inspect.signature(
+        extract_metadata.ExtractMetadata.process_table).parameters
+    unknown = sorted(
+        set(options) - (set(parameters) - {'self'} - WORKER_OPTIONS))
+
+    if unknown:
+        raise ValueError(
+            'Options {} are not arguments of process_table(). Options '
+            'are its keyword arguments, e.g. date_format_dict rather than '
+            'date_format of the input file of extract.py'.format(
+                ', '.join(unknown))
+        )
+
+
+def enqueue(metabase_cur, data_table_ids, priority=0, options=None,
+            max_attempts=3):
+    """Add jobs for Data Tables to the queue.
+
+    Args:
+        metabase_cur: Cursor on the metabase. The caller commits.
+        data_table_ids ([int]): Data Tables to process.
+        priority (int): Jobs with higher priority are claimed first.
+        options (dict): Keyword arguments of
+            `ExtractMetadata.process_table()`, checked by `check_options()`.
+        max_attempts (int): Attempts before a job is marked as failed.
+
+    Returns:
+        ([int]): job_id of the new jobs.
+
+    Raises:
+        ValueError: If an option is not an argument of the run.
+
+    """
+    options = options or {}
+    check_options(options)
+
+    metabase_cur.execute(
+        """
+        INSERT INTO metabase.extraction_job (
+            data_table_id,
+            priority,
+            options,
+            max_attempts,
+            created_by,
+            date_created,
+            updated_by,
+            date_last_updated
+        )
+        SELECT
+            data_table_id,
+            %(priority)s,
+            %(options)s::JSONB,
+            %(max_attempts)s,
+            %(user_name)s,
+            CURRENT_TIMESTAMP,
+            %(user_name)s,
+            CURRENT_TIMESTAMP
+        FROM UNNEST(%(data_table_ids)s::INT[]) AS data_table_id
+        RETURNING job_id
+        """,
+        {
+            'priority': priority,
+            'options': json.dumps(options),
+            'max_attempts': max_attempts,
+            'user_name': getpass.getuser(),
+            'data_table_ids': list(data_table_ids),
+        },
+    )
+
+    return [row[0] for row in metabase_cur.fetchall()]
+
+
+def claim_job(metabase_conn, worker_id, lease_seconds):
+    """Claim the pending job with the highest priority.
+
+    Args:
+        metabase_conn (psycopg2.extensions.connection): Connection to the
+            metabase. The claim is committed.
+        worker_id (str): ID of the claiming worker.
+        lease_seconds (int): Seconds until the job is released unless the
+            worker sends a heartbeat.
+
+    Returns:
+        (queued_job): Claimed job, or None if no job is pending.
+
+    """
+    with metabase_conn:
+        with metabase_conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE metabase.extraction_job
+                SET
+                    status = 'running',
+                    attempts = attempts + 1,
+                    worker_id = %(worker_id)s,
+                    started_at = CURRENT_TIMESTAMP,
+                    heartbeat_at = CURRENT_TIMESTAMP,
+                    lease_expires_at = CURRENT_TIMESTAMP
+                        + %(lease_seconds)s * INTERVAL '1 second',
+                    finished_at = NULL,
+                    error = NULL,
+                    date_last_updated = CURRENT_TIMESTAMP
+                WHERE job_id = (
+                    SELECT job_id
+                    FROM metabase.extraction_job
+                    WHERE status = 'pending'
+                    ORDER BY priority DESC, job_id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING job_id, data_table_id, options, attempts
+                """,
+                {'worker_id': worker_id, 'lease_seconds': lease_seconds},
+            )
+            row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    return queued_job(*row)
+
+
+def heartbeat(metabase_conn, job_id, worker_id, lease_seconds):
+    """Extend the lease of a running job.
+
+    Returns:
+        (bool): False if the worker lost the job, e.g. because its lease
+            expired and the job was released.
+
+    """
+    with metabase_conn:
+        with metabase_conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE metabase.extraction_job
+                SET
+                    heartbeat_at = CURRENT_TIMESTAMP,
+                    lease_expires_at = CURRENT_TIMESTAMP
+                        + %(lease_seconds)s * INTERVAL '1 second'
+                WHERE job_id = %(job_id)s
+                    AND status = 'running'
+                    AND worker_id = %(worker_id)s
+                """,
+                {
+                    'job_id': job_id,
+                    'worker_id': worker_id,
+                    'lease_seconds': lease_seconds,
+                },
+            )
+            return cursor.rowcount == 1
+
+
+def complete_job(metabase_conn, job_id, worker_id, error=None):
+    """Record the outcome of a job.
+
+    Failed jobs are pending again until they used up their attempts.
+
+    Args:
+        error (str): Error of a failed job. None if the job succeeded.
+
+    Returns:
+        (bool): False if the worker lost the job before it finished.
+
+    """
+    with metabase_conn:
+        with metabase_conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE metabase.extraction_job
+                SET
+                    status = CASE
+                        WHEN %(error)s IS NULL THEN 'succeeded'
+                        WHEN attempts >= max_attempts THEN 'failed'
+                        ELSE 'pending'
+                    END,
+                    finished_at = CURRENT_TIMESTAMP,
+                    lease_expires_at = NULL,
+                    error = %(error)s,
+                    date_last_updated = CURRENT_TIMESTAMP
+                WHERE job_id = %(job_id)s
+                    AND status = 'running'
+                    AND worker_id = %(worker_id)s
+                """,
+                {'job_id': job_id, 'worker_id': worker_id, 'error': error},
+            )
+            return cursor.rowcount == 1
+
+
+def release_expired_jobs(metabase_conn):
+    """Release running jobs whose lease expired.
+
+    Returns:
+        (int): Number of released jobs.
+
+    """
+    with metabase_conn:
+        with metabase_conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE metabase.extraction_job
+                SET
+                    status = CASE
+                        WHEN attempts >= max_attempts THEN 'failed'
+                        ELSE 'pending'
+                    END,
+                    lease_expires_at = NULL,
+                    error = 'Lease of worker ' || worker_id || ' expired',
+                    date_last_updated = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+                    AND lease_expires_at < CURRENT_TIMESTAMP
+                """
+            )
+            return cursor.rowcount
+
+
+def get_worker_id():
+    """Return <host>:<pid> of this process."""
+
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def run_worker(lease_seconds=300, heartbeat_seconds=60, poll_seconds=5,
+               stop_when_empty=False, max_jobs=None):
+    """Claim and run jobs until stopped.
+
+    Args:
+        lease_seconds (int): Lease of claimed jobs. Should be several times
+            `heartbeat_seconds`.
+        heartbeat_seconds (int): Interval between heartbeats of a running
+            job.
+        poll_seconds (int): Wait between polls of an empty queue.
+        stop_when_empty (bool): Return when no job is pending.
+        max_jobs (int): Return after running this many jobs.
+
+    Returns:
+        (int): Number of jobs run.
+
+    """
+    worker_id = get_worker_id()
+    metabase_conn = psycopg2.connect(settings.metabase_connection_string)
+
+    n_jobs = 0
+    try:
+        while max_jobs is None or n_jobs < max_jobs:
+            release_expired_jobs(metabase_conn)
+
+            job = claim_job(metabase_conn, worker_id, lease_seconds)
+            if job is None:
+                if stop_when_empty:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            error = run_claimed_job(
+                job,
+                worker_id,
+                lease_seconds,
+                heartbeat_seconds,
+            )
+            complete_job(metabase_conn, job.job_id, worker_id, error)
+            n_jobs += 1
+
+    finally:
+        metabase_conn.close()
+
+    return n_jobs
+
+
+def run_claimed_job(job, worker_id, lease_seconds, heartbeat_seconds):
+    """Run a claimed job while a thread sends heartbeats.
+
+    If the worker lost the job, or heartbeats cannot be sent, the run is
+    aborted before its next column, since another worker may run the job
+    once its lease expired.
+
+    Returns:
+        (str): Error of the job, None if it succeeded.
+
+    """
+    stop_heartbeat = threading.Event()
+    lease_lost = threading.Event()
+
+    def send_heartbeats():
+        try:
+            conn = psycopg2.connect(settings.metabase_connection_string)
+        except psycopg2.Error as e:
+            logger.error('Heartbeats of job %s cannot be sent: %s',
+                         job.job_id, e)
+            lease_lost.set()
+            return
+
+        try:
+            while not stop_heartbeat.wait(heartbeat_seconds):
+                try:
+                    renewed = heartbeat(
+                        conn, job.job_id, worker_id, lease_seconds)
+                except psycopg2.Error as e:
+                    logger.error('Heartbeat of job %s failed: %s',
+                                 job.job_id, e)
+                    renewed = False
+                else:
+                    if not renewed:
+                        logger.error('Worker %s lost job %s',
+                                     worker_id, job.job_id)
+
+                if not renewed:
+                    lease_lost.set()
+                    break
+        finally:
+            conn.close()
+
+    heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeat_thread.start()
+
+    options = dict(job.options)
+    if job.attempts > 1:
+        # Keep the columns committed by previous attempts.
+        options.setdefault('resume', True)
+
+    try:
+        extract = extract_metadata.ExtractMetadata(
+            data_table_id=job.data_table_id)
+        extract.process_table(abort_event=lease_lost, **options)
+    except Exception as e:
+        return '{}: {}'.format(type(e).__name__, e)
+    finally:
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+
+    return None
+
+
+def parse_command_line_args(args):
+    """Parse command line arguments of the queue.
+
+    Args:
+        args ([str]): List of command line arguments and flags.
+
+    Returns
+        (argparse.Namespace): Parsed arguments from argparse
+
+    """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    enqueue_parser = subparsers.add_parser(
+        'enqueue', help='Add jobs for Data Tables')
+    enqueue_parser.add_argument(
+        'data_table_ids', type=int, nargs='+',
+        help='IDs of the Data Tables to process')
+    enqueue_parser.add_argument(
+        '--priority', type=int, default=0,
+        help='Jobs with higher priority are claimed first')
+    enqueue_parser.add_argument(
+        '-f', '--input_file', type=str,
+        help='JSON file with the options of process_table()')
+    enqueue_parser.add_argument(
+        '--max_attempts', type=int, default=3,
+        help='Attempts before a job is marked as failed')
+
+    work_parser = subparsers.add_parser('work', help='Claim and run jobs')
+    work_parser.add_argument(
+        '--lease_seconds', type=int, default=300,
+        help='Seconds until a job of an unresponsive worker is released')
+    work_parser.add_argument(
+        '--heartbeat_seconds', type=int, default=60,
+        help='Interval between heartbeats of a running job')
+    work_parser.add_argument(
+        '--poll_seconds', type=int, default=5,
+        help='Wait between polls of an empty queue')
+    work_parser.add_argument(
+        '--stop_when_empty', action='store_true',
+        help='Exit when no job is pending')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_command_line_args(args)
+
+    if args.command == 'enqueue':
+        options = None
+        if args.input_file is not None:
+            with open(args.input_file) as f:
+                options = json.load(f)
+
+        with psycopg2.connect(settings.metabase_connection_string) as conn:
+            with conn.cursor() as cursor:
+                job_ids = enqueue(
+                    cursor,
+                    args.data_table_ids,
+                    priority=args.priority,
+                    options=options,
+                    max_attempts=args.max_attempts,
+                )
+        conn.close()
+        print('Enqueued jobs', ', '.join(str(i) for i in job_ids))
+
+    else:
+        n_jobs = run_worker(
+            lease_seconds=args.lease_seconds,
+            heartbeat_seconds=args.heartbeat_seconds,
+            poll_seconds=args.poll_seconds,
+            stop_when_empty=args.stop_when_empty,
+        )
+        print('Ran {} jobs'.format(n_jobs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Extraction jobs run by extract.py, in process or by the daemon."""
+
+import getpass
+
+import psycopg2
+
+from . import settings
+from . import extract_metadata
+
+
+def run_job(job, data_conn=None, metabase_conn=None):
+    """Register a table, extract its metadata and export its GMETA.
+
+    Args:
+        job (dict): 'full_table_name' (<schema>.<table>), 'options' (keyword
+            arguments of `ExtractMetadata.process_table()`) and optionally
+            'gmeta_output' (filepath of the exported GMETA).
+        data_conn (psycopg2.extensions.connection): Connection to the data
+            database to reuse. A new connection is opened if None.
+        metabase_conn (psycopg2.extensions.connection): Connection to the
+            metabase to reuse. A new connection is opened if None.
+
+    Returns:
+        (int): data_table_id of the registered table.
+
+    """
+    if metabase_conn is None:
+        conn = psycopg2.connect(settings.metabase_connection_string)
+        try:
+            with conn:
+                data_table_id = register_data_table(
+                    conn,
+                    job['full_table_name'],
+                )
+        finally:
+            conn.close()
+    else:
+        with metabase_conn:
+            data_table_id = register_data_table(
+                metabase_conn,
+                job['full_table_name'],
+            )
+
+    extract = extract_metadata.ExtractMetadata(
+        data_table_id=data_table_id,
+        data_conn=data_conn,
+        metabase_conn=metabase_conn,
+    )
+    extract.process_table(**job.get('options', {}))
+
+    if job.get('gmeta_output'):
+        extract.export_table_metadata(job['gmeta_output'])
+
+    return data_table_id
+
+
+def register_data_table(metabase_conn, full_table_name):
+    """Add a new table to metabase.data_table.
+
+    This function is not intended to be part of the final metabase design but
+    it is useful for testing in this stage.
+
+    Args:
+        metabase_conn (psycopg2.extensions.connection): Connection to the
+            metabase. The caller commits.
+        full_table_name (str): <schema>.<table>
+
+    Returns:
+        (int): New data_table_id.
+
+    """
+    return register_data_tables(metabase_conn, [full_table_name])[0]
+
+
+def get_or_register_data_table(metabase_conn, full_table_name):
+    """Return the Data Table of a table, registering it if it is new.
+
+    Args:
+        metabase_conn (psycopg2.extensions.connection): Connection to the
+            metabase. The caller commits.
+        full_table_name (str): <schema>.<table>
+
+    Returns:
+        (int): data_table_id of the table, the first one if it was
+            registered more than once.
+
+    """
+    with metabase_conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT MIN(data_table_id)
+            FROM metabase.data_table
+            WHERE file_table_name = %(full_table_name)s
+            """,
+            {'full_table_name': full_table_name},
+        )
+        data_table_id, = cursor.fetchone()
+
+    if data_table_id is None:
+        data_table_id = register_data_table(metabase_conn, full_table_name)
+
+    return data_table_id
+
+
+def register_data_tables(metabase_conn, full_table_names):
+    """Add new tables to metabase.data_table in one INSERT ... RETURNING.
+
+    IDs are drawn from the data_table_id sequence, so concurrent
+    registrations never get the same ID.
+
+    Args:
+        metabase_conn (psycopg2.extensions.connection): Connection to the
+            metabase. The caller commits.
+        full_table_names ([str]): <schema>.<table> of every table.
+
+    Returns:
+        ([int]): New data_table_id of every table, in the same order.
+
+    """
+    with metabase_conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO metabase.data_table (
+                file_table_name,
+                created_by,
+                date_created
+            )
+            SELECT
+                file_table_name,
+                %(user_name)s,
+                CURRENT_TIMESTAMP
+            FROM UNNEST(%(full_table_names)s::TEXT[])
+                WITH ORDINALITY AS t (file_table_name, table_order)
+            ORDER BY table_order
+            RETURNING data_table_id
+            """,
+            {
+                'full_table_names': list(full_table_names),
+                'user_name': getpass.getuser(),
+            },
+        )
+
+        # Rows are inserted in order, and the IDs of their column default
+        # drawn from the sequence increase with every row, so sorted IDs are
+        # in the order of the tables.
+        return sorted(row[0] for row in cursor.fetchall())
@@ -3,6 +3,8 @@
 import argparse
 import json
 
+from . import settings
+
 
 class ParseInput():
     """Class to parse json input."""
@@ -14,6 +16,15 @@ class ParseInput():
         self.categorical_threshold = ''
         self.date_format = ''
         self.type_overrides = ''
+        self.histogram_bins = 10
+        self.histogram_method = 'equi_width'
+        self.record_metrics = False
+        self.log_metrics = False
+        self.trace_sql = False
+        self.explain_file = None
+        self.profile_memory = False
+        self.prometheus_textfile_dir = None
+        self.date_formats = None
 
     def parse(self, file_name):
         """Load and parse input data in file_name.
@@ -35,6 +46,17 @@ class ParseInput():
         self.date_format = data['date_format']
         self.type_overrides = data['type_overrides']
         self.gmeta_output = data['gmeta_output']
+        self.histogram_bins = data.get('histogram_bins', self.histogram_bins)
+        self.histogram_method = data.get('histogram_method',
+                                         self.histogram_method)
+        self.record_metrics = data.get('record_metrics', self.record_metrics)
+        self.log_metrics = data.get('log_metrics', self.log_metrics)
+        self.trace_sql = data.get('trace_sql', self.trace_sql)
+        self.explain_file = data.get('explain_file') or None
+        self.profile_memory = data.get('profile_memory', self.profile_memory)
+        self.prometheus_textfile_dir = (
+            data.get('prometheus_textfile_dir') or None)
+        self.date_formats = data.get('date_formats', self.date_formats)
 
 
 def parse_command_line_args(args):
@@ -61,6 +83,12 @@ def parse_command_line_args(args):
     parser.add_argument(
         '-f', '--input_file', type=str,
         help='JSON file containing input parameters')
+    parser.add_argument(
+        '--daemon_socket', type=str, default=settings.daemon_socket_path,
+        help='Unix socket of the extraction daemon')
+    parser.add_argument(
+        '--no_daemon', action='store_true',
+        help='Run in process even if the extraction daemon is running')
 
     out = parser.parse_args(args)
 
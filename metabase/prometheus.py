@@ -0,0 +1,152 @@
+"""Export metrics of extraction runs for the Prometheus textfile collector."""
+
+import os
+import time
+
+from . import extract_metadata_helper
+
+
+TEXTFILE_NAME = 'metabase_extract.prom'
+
+# Upper bounds in seconds of the stage duration histogram buckets.
+STAGE_DURATION_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300]
+
+
+def format_run_metrics(metrics, failed, timestamp=None):
+    """Format the metrics of a run in the Prometheus text exposition format.
+
+    Every run of `extract.py` overwrites the file, so the values describe the
+    last run on this node rather than totals since the exporter started.
+
+    Args:
+        metrics (instrumentation.RunMetrics): Metrics of the run.
+        failed (bool): Whether the run raised an exception.
+        timestamp (float): End of the run in seconds since the epoch.
+            Defaults to now.
+
+    Returns:
+        (str): Text with a trailing newline.
+
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    total = metrics.records.get((None, 'total'), {})
+
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for labels, value in samples:
+            lines.append('{}{} {}'.format(name, labels, value))
+
+    add_metric(
+        'metabase_extract_last_run_timestamp_seconds',
+        'gauge',
+        'Time the last extraction run ended.',
+        [('', timestamp)],
+    )
+    add_metric(
+        'metabase_extract_last_run_data_table_id',
+        'gauge',
+        'Data Table processed by the last extraction run.',
+        [('', metrics.data_table_id)],
+    )
+    add_metric(
+        'metabase_extract_last_run_failed',
+        'gauge',
+        'Whether the last extraction run failed.',
+        [('', int(failed))],
+    )
+    add_metric(
+        'metabase_extract_tables_processed',
+        'gauge',
+        'Data Tables processed successfully by the last extraction run.',
+        [('', 0 if failed else 1)],
+    )
+    add_metric(
+        'metabase_extract_columns',
+        'gauge',
+        'Columns processed by the last extraction run, by detected type.',
+        [
+            ('{{type="{}"}}'.format(column_type), n_columns)
+            for column_type, n_columns in sorted(metrics.column_types.items())
+        ],
+    )
+    add_metric(
+        'metabase_extract_rows_scanned',
+        'gauge',
+        'Rows of the Data Table processed by the last extraction run.',
+        [('', metrics.rows_scanned)],
+    )
+    add_metric(
+        'metabase_extract_duration_seconds',
+        'gauge',
+        'Wall time of the last extraction run.',
+        [('', total.get('wall_seconds', 0))],
+    )
+
+    for field, help_text in [
+            ('rows_fetched', 'Rows fetched'),
+            ('bytes_fetched', 'Estimated bytes fetched'),
+            ('queries_issued', 'Queries issued'),
+            ('rows_written', 'Metabase rows written'),
+    ]:
+        add_metric(
+            'metabase_extract_' + field,
+            'gauge',
+            '{} by the last extraction run.'.format(help_text),
+            [('', total.get(field, 0))],
+        )
+
+    stage_durations = {}
+    for (column_name, stage), record in metrics.records.items():
+        if stage != 'total':
+            stage_durations.setdefault(stage, []).append(
+                record['wall_seconds'])
+
+    samples = []
+    for stage, durations in sorted(stage_durations.items()):
+        for upper_bound in STAGE_DURATION_BUCKETS + ['+Inf']:
+            n_observations = sum(
+                1 for d in durations
+                if upper_bound == '+Inf' or d <= upper_bound
+            )
+            samples.append((
+                '_bucket{{stage="{}",le="{}"}}'.format(stage, upper_bound),
+                n_observations,
+            ))
+        samples.append(('_sum{{stage="{}"}}'.format(stage), sum(durations)))
+        samples.append(('_count{{stage="{}"}}'.format(stage), len(durations)))
+
+    add_metric(
+        'metabase_extract_stage_duration_seconds',
+        'histogram',
+        'Wall time of the stages of the last extraction run, one '
+        'observation per column for column-level stages.',
+        samples,
+    )
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(textfile_dir, metrics, failed):
+    """Write the metrics of a run to the textfile collector directory.
+
+    The file is replaced atomically so node_exporter never reads a partially
+    written file.
+
+    Args:
+        textfile_dir (str): Directory read by node_exporter's textfile
+            collector.
+        metrics (instrumentation.RunMetrics): Metrics of the run.
+        failed (bool): Whether the run raised an exception.
+
+    """
+    text = format_run_metrics(metrics, failed)
+
+    extract_metadata_helper.write_file_atomically(
+        os.path.join(textfile_dir, TEXTFILE_NAME),
+        lambda output_file: output_file.write(text),
+    )
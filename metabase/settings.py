@@ -5,3 +5,6 @@ metabase_connection_string = 'postgresql://metaadmin@localhost:5432/postgres'
 
 # Database connection strings for database containing data.
 data_connection_string = 'postgresql://metaadmin@localhost:5432/postgres'
+
+# Unix socket of the extraction daemon (python -m metabase.daemon).
+daemon_socket_path = '/tmp/metabase-extract.sock'
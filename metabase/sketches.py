@@ -0,0 +1,271 @@
+"""Summaries of column values streamed in bounded memory."""
+
+from collections import Counter, namedtuple
+import hashlib
+import heapq
+import itertools
+import zlib
+
+import numpy as np
+
+
+# Values counted with a Counter before they are added to a summary.
+BATCH_SIZE = 100000
+
+# Values hashed at once by a MinHash signature. Every value is hashed by
+# every hash function, so memory grows with both.
+MINHASH_BATCH_SIZE = 2000
+
+# Hash functions of MinHash signatures are the 32 high bits of
+# (a * x + b) mod 2 ** 64 for odd a, of the CRC-32 x of a value.
+MINHASH_MAX_HASH = (1 << 32) - 1
+
+# Seed drawing a and b. Signatures are only comparable if they are computed
+# with the same seed and number of hash functions.
+MINHASH_SEED = 1
+
+TOP_VALUE = namedtuple('top_value', ['value', 'frequency', 'error'])
+
+
+class SpaceSaving():
+    """Space-Saving summary of the most frequent values of a stream.
+
+    At most `capacity` values are tracked with a count. A value that is not
+    tracked replaces the tracked value of lowest count, and counts from there,
+    which is its error. For a stream of n values:
+
+    - The frequency of a tracked value is overestimated by at most its error,
+      which is at most n / capacity.
+    - Every value more frequent than n / capacity is tracked.
+    - Frequencies are exact if the stream has at most `capacity` distinct
+      values.
+
+    Values are counted in batches first, so that repeated values of a batch
+    are added to the summary once with their count, which keeps the bounds.
+
+    Args:
+        capacity (int): Number of values tracked.
+
+    """
+
+    def __init__(self, capacity):
+
+        if capacity < 1:
+            raise ValueError('Capacity must be positive.')
+
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+
+        # Min-heap of (count, sequence number, value). Entries of values
+        # whose count changed since are stale and skipped. Built on the first
+        # replacement.
+        self.heap = None
+        self.sequence = itertools.count()
+
+    def update(self, values):
+        """Add the values of a stream. None values are skipped."""
+
+        values = iter(values)
+        while True:
+            batch = Counter(itertools.islice(values, BATCH_SIZE))
+            if not batch:
+                break
+
+            batch.pop(None, None)
+            self.add_counts(batch)
+
+    def add_counts(self, value_counts):
+        """Add values with their counts, e.g. from a Counter."""
+
+        for value, count in value_counts.items():
+            self.total += count
+
+            if value in self.counts:
+                self.counts[value] += count
+            elif len(self.counts) < self.capacity:
+                self.counts[value] = count
+                self.errors[value] = 0
+            else:
+                min_count, min_value = self.pop_minimum()
+                del self.counts[min_value]
+                del self.errors[min_value]
+                self.counts[value] = min_count + count
+                self.errors[value] = min_count
+
+            if self.heap is not None:
+                heapq.heappush(
+                    self.heap,
+                    (self.counts[value], next(self.sequence), value),
+                )
+
+                # Rebuilt when stale entries outnumber the tracked values, so
+                # that the heap stays within a few times the capacity.
+                if len(self.heap) > 4 * self.capacity:
+                    self.build_heap()
+
+    def build_heap(self):
+        """Build the heap from the tracked values, dropping stale entries."""
+
+        self.heap = [
+            (count, next(self.sequence), value)
+            for value, count in self.counts.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def pop_minimum(self):
+        """Return the lowest count and its value, and forget its entry."""
+
+        if self.heap is None:
+            self.build_heap()
+
+        while True:
+            count, _sequence, value = heapq.heappop(self.heap)
+            if self.counts.get(value) == count:
+                return count, value
+
+    def top_k(self, k, min_frequency=1):
+        """Return the most frequent values.
+
+        Args:
+            k (int): Largest number of values returned.
+            min_frequency (int): Lowest guaranteed frequency, i.e. estimated
+                frequency minus error, of the values returned. Values that
+                might be rare are left out, such as the values that happen
+                to be tracked at the end of a stream of distinct values.
+
+        Returns:
+            ([TOP_VALUE]): Values with their estimated frequency and error,
+                by descending estimated frequency.
+
+        """
+        return heapq.nlargest(
+            k,
+            (
+                TOP_VALUE(value, count, self.errors[value])
+                for value, count in self.counts.items()
+                if count - self.errors[value] >= min_frequency
+            ),
+            key=lambda top_value: top_value.frequency,
+        )
+
+
+class MinHash():
+    """MinHash signature of the set of distinct values of a stream.
+
+    The signature keeps the lowest hash of the values by each of `num_perm`
+    hash functions. The fraction of equal entries of the signatures of two
+    sets estimates their Jaccard similarity, with a standard error of at most
+    1 / (2 * sqrt(num_perm)).
+
+    Args:
+        num_perm (int): Number of hash functions.
+        seed (int): Seed of the hash functions.
+
+    """
+
+    def __init__(self, num_perm, seed=MINHASH_SEED):
+
+        if num_perm < 1:
+            raise ValueError('Number of hash functions must be positive.')
+
+        rng = np.random.RandomState(seed)
+        self.a = (rng.randint(0, 1 << 63, num_perm, dtype=np.uint64)
+                  * np.uint64(2) + np.uint64(1))
+        self.b = rng.randint(0, 1 << 63, num_perm, dtype=np.uint64)
+        self.signature = np.full(num_perm, MINHASH_MAX_HASH, dtype=np.uint64)
+
+    def update(self, values):
+        """Add text values. Repeated values leave the signature unchanged."""
+
+        values = iter(values)
+        while True:
+            batch = list(itertools.islice(values, MINHASH_BATCH_SIZE))
+            if not batch:
+                break
+
+            hashes = np.fromiter(
+                (zlib.crc32(value.encode('utf-8')) for value in batch),
+                dtype=np.uint64,
+                count=len(batch),
+            )
+
+            # Products wrap around 2 ** 64. The high bits are taken after the
+            # minimum, which they do not change.
+            permuted = np.outer(hashes, self.a)
+            permuted += self.b
+            minimum = permuted.min(axis=0) >> np.uint64(32)
+            np.minimum(self.signature, minimum, out=self.signature)
+
+    def to_bytes(self):
+        """Return the signature as little-endian 32-bit integers."""
+
+        return self.signature.astype('<u4').tobytes()
+
+
+def signature_from_bytes(signature_bytes):
+    """Return a signature stored with `MinHash.to_bytes()`."""
+
+    return np.frombuffer(signature_bytes, dtype='<u4')
+
+
+def estimate_jaccard(signature, other_signature):
+    """Estimate the Jaccard similarity of two sets from their signatures."""
+
+    if len(signature) != len(other_signature):
+        raise ValueError('Signatures have different numbers of hashes.')
+
+    return float(np.mean(signature == other_signature))
+
+
+def estimate_containment(jaccard, n_distinct, other_n_distinct):
+    """Estimate the fraction of the values of a set found in another set.
+
+    The intersection is estimated from the Jaccard similarity and the sizes
+    of both sets, as J / (1 + J) * (|A| + |B|).
+
+    Args:
+        jaccard (float): Jaccard similarity of the sets.
+        n_distinct (int): Size of the set contained.
+        other_n_distinct (int): Size of the set containing it.
+
+    Returns:
+        (float): Estimated |A & B| / |A|, at most 1.
+
+    """
+    if not n_distinct:
+        return 0.0
+
+    intersection = jaccard / (1 + jaccard) * (n_distinct + other_n_distinct)
+    return min(intersection / n_distinct, 1.0)
+
+
+def get_band_hashes(signature, n_bands):
+    """Return the LSH band hashes of a signature.
+
+    The signature is cut into `n_bands` bands of consecutive entries. Two
+    sets of Jaccard similarity J share at least one band hash with
+    probability 1 - (1 - J ** r) ** n_bands, r being the number of entries
+    per band. The band number is hashed with its entries, so that hashes of
+    different bands never match.
+
+    Returns:
+        ([int]): Signed 64-bit hash of each band.
+
+    """
+    if len(signature) % n_bands:
+        raise ValueError('Signature length is not a multiple of the bands.')
+
+    bands = np.asarray(signature, dtype='<u4').reshape(n_bands, -1)
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                band_number.to_bytes(4, 'little') + band.tobytes(),
+                digest_size=8,
+            ).digest(),
+            'little',
+            signed=True,
+        )
+        for band_number, band in enumerate(bands)
+    ]
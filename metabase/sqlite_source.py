@@ -0,0 +1,298 @@
+"""Extract metadata from the tables of SQLite database files.
+
+A SQLite file is profiled in place, opened read-only, by `ExtractMetadata`
+with a `SqliteDataSource`. SQLite counts the rows of a table and groups every
+column by value, so only the distinct values of a column and their
+frequencies are fetched. Types, statistics, top values and histograms are
+computed from those frequencies in Python as for CSV files, by
+`csv_source.execute_csv_column_plan()`, and the metabase in PostgreSQL is
+updated with the same records as for a table of the data database.
+
+Tables are registered in the metabase as ``<file>.<table>``, where
+``<file>`` is the name of the database file without extension, dots
+replaced by underscores, under which the file is attached in SQLite.
+Profiling a file again updates the Data Tables registered for it before.
+
+Run from the root directory of the project, e.g.::
+
+    python -m metabase.sqlite_source extract.sqlite table_a table_b -c 10
+
+"""
+
+import argparse
+import collections
+import json
+import os
+import sqlite3
+import urllib.request
+
+import psycopg2
+
+from . import csv_source
+from . import data_sources
+from . import extract_metadata
+from . import extract_metadata_helper
+from . import jobs
+from . import settings
+
+
+SCHEMA_NAME = 'main'
+
+
+def quote_identifier(name):
+    """Return a name quoted as an SQLite identifier."""
+
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def connect(filepath, schema_name=SCHEMA_NAME):
+    """Open a SQLite file read-only, without creating it.
+
+    Args:
+        schema_name (str): Schema of the tables of the file. Files are
+            attached to an in-memory database under schema names other than
+            ``main``.
+
+    """
+    uri = 'file:{}?mode=ro'.format(
+        urllib.request.pathname2url(os.path.abspath(filepath)))
+
+    if schema_name == SCHEMA_NAME:
+        return sqlite3.connect(uri, uri=True)
+
+    conn = sqlite3.connect(':memory:', uri=True)
+    try:
+        conn.execute(
+            'ATTACH DATABASE ? AS {}'.format(quote_identifier(schema_name)),
+            [uri],
+        )
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def get_schema_name(filepath):
+    """Return the schema a SQLite file is registered under.
+
+    It is the name of the file without extension, with dots replaced so
+    that ``<schema>.<table>`` names can be split.
+
+    """
+    file_stem, _extension = os.path.splitext(os.path.basename(filepath))
+    return file_stem.replace('.', '_')
+
+
+def get_catalog_type(declared_type):
+    """Return the PostgreSQL data type of a column of a SQLite table.
+
+    Types follow the type affinity of the declared type in SQLite. Columns of
+    INTEGER and REAL affinity are numeric. Other columns are probed like text
+    columns, since SQLite keeps e.g. the dates of DATE columns as text.
+
+    Args:
+        declared_type (str): Type of the column in CREATE TABLE, possibly
+            empty.
+
+    Returns:
+        (str): data_type as in PostgreSQL's INFORMATION_SCHEMA.COLUMNS.
+
+    """
+    declared_type = declared_type.upper()
+
+    if 'INT' in declared_type:
+        return 'bigint'
+    elif any(name in declared_type for name in ('CHAR', 'CLOB', 'TEXT')):
+        return 'text'
+    elif any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+        return 'double precision'
+    else:
+        return 'text'
+
+
+class SqliteDataSource(data_sources.DataSource):
+    """Tables of a SQLite database file."""
+
+    def __init__(self, filepath, schema_name=SCHEMA_NAME):
+        """Open a SQLite file read-only.
+
+        Args:
+            filepath (str): SQLite database file. It is not created if it does
+                not exist.
+            schema_name (str): Schema of its tables in the registered table
+                names, e.g. from `get_schema_name()`.
+
+        """
+        self.filepath = filepath
+        self.conn = connect(filepath, schema_name)
+
+    def get_table_level_metadata(self, schema_name, table_name):
+        """Return the number of rows and columns and the size of a table.
+
+        Size is that of the pages of the table if SQLite is built with the
+        dbstat virtual table, and that of the database file otherwise.
+
+        """
+        n_rows, = self.conn.execute(
+            'SELECT COUNT(*) FROM {}.{}'.format(
+                quote_identifier(schema_name),
+                quote_identifier(table_name),
+            )
+        ).fetchone()
+
+        n_cols = len(self.get_columns(schema_name, table_name))
+
+        try:
+            table_size, = self.conn.execute(
+                'SELECT SUM(pgsize) FROM dbstat(?) WHERE name = ?',
+                [schema_name, table_name],
+            ).fetchone()
+        except sqlite3.OperationalError:
+            table_size = os.path.getsize(self.filepath)
+
+        return n_rows, n_cols, table_size
+
+    def get_columns(self, schema_name, table_name):
+        return [
+            (column_name, get_catalog_type(declared_type))
+            for column_name, declared_type in self.conn.execute(
+                'SELECT name, type FROM pragma_table_info(?, ?) ORDER BY cid',
+                [table_name, schema_name],
+            )
+        ]
+
+    def execute_column_plan(self, plan, categorical_threshold, schema_name,
+                            table_name):
+        return csv_source.execute_csv_column_plan(
+            plan,
+            self.count_values(plan.column_name, schema_name, table_name),
+            categorical_threshold,
+        )
+
+    def iter_row_batches(self, columns, schema_name, table_name, batch_rows):
+        cursor = self.conn.execute(
+            'SELECT {} FROM {}.{}'.format(
+                ', '.join(map(quote_identifier, columns)),
+                quote_identifier(schema_name),
+                quote_identifier(table_name),
+            )
+        )
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_rows)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            cursor.close()
+
+    def count_values(self, col, schema_name, table_name):
+        """Return the frequencies of the values of a column.
+
+        Values are grouped by SQLite and compared as stored, whatever the
+        collation of the column.
+
+        Returns:
+            (collections.Counter): Value -> frequency. None counts missing
+                values.
+
+        """
+        value_counts = collections.Counter()
+        for value, count in self.conn.execute(
+            'SELECT {col}, COUNT(*) FROM {schema}.{table} '
+            'GROUP BY {col} COLLATE BINARY'.format(
+                col=quote_identifier(col),
+                schema=quote_identifier(schema_name),
+                table=quote_identifier(table_name),
+            )
+        ):
+            value_counts[value] += count
+
+        return value_counts
+
+    def close(self):
+        self.conn.close()
+
+
+def get_table_names(filepath):
+    """Return the names of the tables of a SQLite file, in order.
+
+    Internal tables of SQLite are left out.
+
+    """
+    conn = connect(filepath)
+    try:
+        return [
+            row[0] for row in conn.execute(
+                """
+                SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name NOT LIKE 'sqlite!_%' ESCAPE '!'
+                ORDER BY name
+                """
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def parse_command_line_args(args):
+    """Parse command line arguments of the SQLite extractor.
+
+    Args:
+        args ([str]): List of command line arguments and flags.
+
+    Returns
+        (argparse.Namespace): Parsed arguments from argparse
+
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('filepath', type=str, help='SQLite database file')
+    parser.add_argument(
+        'tables', type=str, nargs='*',
+        help='Tables to profile, every table of the file by default')
+    parser.add_argument(
+        '-c', '--categorical', type=int, default=10,
+        help='Max number of distinct values in all categorical columns')
+    parser.add_argument(
+        '-f', '--input_file', type=str,
+        help='JSON file with the options of process_table()')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_command_line_args(args)
+
+    options = {'categorical_threshold': args.categorical}
+    if args.input_file is not None:
+        with open(args.input_file) as f:
+            options.update(json.load(f))
+
+    table_names = args.tables or get_table_names(args.filepath)
+    schema_name = get_schema_name(args.filepath)
+
+    conn = psycopg2.connect(settings.metabase_connection_string)
+    try:
+        for table_name in table_names:
+            with conn:
+                data_table_id = jobs.get_or_register_data_table(
+                    conn,
+                    '{}.{}'.format(schema_name, table_name),
+                )
+
+            extract = extract_metadata.ExtractMetadata(
+                data_table_id,
+                metabase_conn=conn,
+                data_source=SqliteDataSource(args.filepath, schema_name),
+            )
+            extract.process_table(**options)
+
+            print('data_table_id is {} for table {} of {}'.format(
+                data_table_id, table_name, args.filepath))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Tests for client.py
+"""
+
+import json
+import socket
+import threading
+
+import pytest
+
+from metabase import client
+
+
+def serve_one(socket_path, response):
+    """Answer one job on a Unix socket and return the received job."""
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    received = []
+
+    def handle():
+        conn, _ = server.accept()
+        with conn, conn.makefile('rwb') as f:
+            received.append(json.loads(f.readline().decode('utf-8')))
+            f.write(json.dumps(response).encode('utf-8') + b'\n')
+        server.close()
+
+    thread = threading.Thread(target=handle)
+    thread.start()
+
+    return thread, received
+
+
+def test_submit_job(tmpdir):
+    """The job is sent as one JSON line and its data_table_id returned."""
+
+    socket_path = str(tmpdir.join('extract.sock'))
+    thread, received = serve_one(socket_path, {'data_table_id': 5})
+
+    job = {'full_table_name': 'data.table_1', 'options': {}}
+    assert 5 == client.submit_job(job, socket_path)
+    thread.join()
+
+    assert [job] == received
+
+
+def test_submit_job_failed(tmpdir):
+    """Errors raised in the daemon are raised as JobFailed."""
+
+    socket_path = str(tmpdir.join('extract.sock'))
+    thread, _ = serve_one(
+        socket_path,
+        {
+            'error': 'Selected data table has 0 rows.',
+            'error_type': 'ValueError',
+        },
+    )
+
+    with pytest.raises(client.JobFailed) as excinfo:
+        client.submit_job({'full_table_name': 'data.table_1'}, socket_path)
+    thread.join()
+
+    assert 'ValueError: Selected data table has 0 rows.' == str(excinfo.value)
+
+
+def test_submit_job_no_daemon(tmpdir):
+    """DaemonUnavailable is raised if nothing listens on the socket."""
+
+    with pytest.raises(client.DaemonUnavailable):
+        client.submit_job({}, str(tmpdir.join('missing.sock')))
@@ -0,0 +1,88 @@
+"""
+Tests for csv_source.py
+"""
+
+import collections
+
+import pytest
+
+from metabase import csv_source
+from metabase import extract_metadata_helper
+
+
+def test_split_lines(tmpdir):
+    """Chunks end at line boundaries and cover the file after the header."""
+
+    filepath = str(tmpdir.join('data.csv'))
+    lines = [b'a,b\n'] + [
+        '{},{}\n'.format(i, 'x' * i).encode() for i in range(20)]
+    with open(filepath, 'wb') as f:
+        f.write(b''.join(lines))
+
+    column_names, start = csv_source.read_header(filepath)
+    ranges = csv_source.split_lines(filepath, start, chunk_bytes=10)
+
+    assert ['a', 'b'] == column_names
+    assert len(lines[0]) == ranges[0][0]
+    assert sum(len(line) for line in lines) == ranges[-1][1]
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start
+        assert data[end - 1:end] == b'\n'
+
+
+def test_count_values():
+    """Empty values are missing and ragged lines are rejected."""
+
+    n_rows, value_counts = csv_source.count_values('1,a\n2,\n\n1, "b,c"\n', 2)
+
+    assert 3 == n_rows
+    assert collections.Counter({'1': 2, '2': 1}) == value_counts[0]
+    assert collections.Counter({'a': 1, None: 1, 'b,c': 1}) == value_counts[1]
+
+    with pytest.raises(ValueError):
+        csv_source.count_values('1,a\n2\n', 2)
+
+
+def test_count_file_values_max_distinct_values(tmpdir):
+    """Files with too many distinct values are rejected while read."""
+
+    filepath = str(tmpdir.join('data.csv'))
+    with open(filepath, 'w') as f:
+        f.write('id,code\n')
+        f.writelines('{},{}\n'.format(i, i % 2) for i in range(100))
+
+    column_names, n_rows, value_counts = csv_source.count_file_values(
+        filepath, processes=1, chunk_bytes=64, max_distinct_values=102)
+    assert (['id', 'code'], 100) == (column_names, n_rows)
+    assert [100, 2] == [len(counter) for counter in value_counts]
+
+    with pytest.raises(ValueError, match='in column id'):
+        csv_source.count_file_values(
+            filepath, processes=1, chunk_bytes=64, max_distinct_values=101)
+
+
+@pytest.mark.parametrize('values,expected_type', [
+    (['1', ' 2.5', '-3e2', None], 'numeric'),
+    (['20180101', '20181231'], 'date'),
+    (['01-JAN-18', '31-dec-18'], 'date'),
+    (['1', 'NaN', '1,000'], 'text'),
+    (['A', 'B', None, 'A'], 'code'),
+])
+def test_execute_csv_column_plan(values, expected_type):
+    """Types are probed on the distinct values."""
+
+    plan = extract_metadata_helper.plan_column('col', 'text', {}, {})
+    column_data = csv_source.execute_csv_column_plan(
+        plan,
+        collections.Counter(values),
+        categorical_threshold=2,
+    )
+
+    assert expected_type == column_data.type
+    if expected_type == 'text':
+        column_counts = column_data.data.column_counts
+        assert len(values) == column_counts.missing + column_counts.non_null
+    else:
+        assert len(values) == sum(column_data.data.values())
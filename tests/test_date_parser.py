@@ -0,0 +1,100 @@
+"""
+Tests for date_parser.py
+"""
+
+import datetime
+
+import numpy as np
+import pytest
+
+from metabase import date_parser
+
+
+def test_parse_dates_counts_invalid_values():
+    """Invalid values become NaT and are counted, missing values apart."""
+
+    parsed = date_parser.parse_dates(
+        [
+            '2019-01-31',
+            '2020-02-29',
+            None,
+            '2019-02-29',
+            '2019-1-1',
+            '2019-01-011',
+            'abcd-ef-gh',
+            '',
+        ],
+        'YYYY-MM-DD',
+    )
+
+    assert (
+        ['2019-01-31', '2020-02-29'] + ['NaT'] * 6
+        == [str(date) for date in parsed.dates]
+    )
+    assert 5 == parsed.invalid_count
+    assert 1 == parsed.missing_count
+
+
+@pytest.mark.parametrize('date_format,values,expected', [
+    ('YYYYMMDD', ['20190131', 20191231, '20191301'],
+     ['2019-01-31', '2019-12-31', 'NaT']),
+    ('MM/DD/YYYY', ['12/31/2019', '1/1/2019', '04/31/2019'],
+     ['2019-12-31', 'NaT', 'NaT']),
+    ('DD-MON-YY', ['01-jan-19', '31-DEC-99', '30-FEB-20', '01-JXN-19'],
+     ['2019-01-01', '1999-12-31', 'NaT', 'NaT']),
+    ('DD-MON-YYYY', ['15-Mar-2001', '15-MAR-01'],
+     ['2001-03-15', 'NaT']),
+    ('YYYY-MM-DD HH24:MI:SS', ['2019-01-01 23:59:59', '2019-01-01 24:00:00'],
+     ['2019-01-01', 'NaT']),
+])
+def test_parse_dates_formats(date_format, values, expected):
+    """Values are parsed like TO_DATE() guarded by the format."""
+
+    parsed = date_parser.parse_dates(values, date_format)
+
+    assert expected == [str(date) for date in parsed.dates]
+    assert expected.count('NaT') == parsed.invalid_count
+
+
+def test_parse_dates_numpy_strings():
+    """Arrays of strings are parsed as they are, without missing values."""
+
+    parsed = date_parser.parse_dates(
+        np.array(['2019-01-31', '2019-13-01'] * 1000),
+        'YYYY-MM-DD',
+    )
+
+    assert 'datetime64[D]' == parsed.dates.dtype
+    assert 1000 == parsed.invalid_count
+    assert 0 == parsed.missing_count
+
+
+def test_compile_date_formats():
+    """Parsers are compiled once per format and reject unknown fields."""
+
+    parsers = date_parser.compile_date_formats(
+        {'c1': 'YYYY-MM-DD', 'c2': 'YYYY-MM-DD'})
+
+    assert parsers['c1'] is parsers['c2']
+
+    with pytest.raises(ValueError):
+        date_parser.compile_date_format('YYYY-Q')
+
+
+def test_get_date_metadata():
+    """Minimum and maximum skip NaT and are dates."""
+
+    dates = date_parser.parse_dates(
+        ['2019-01-31', None, '2001-05-05', 'invalid'],
+        'YYYY-MM-DD',
+    ).dates
+
+    assert (
+        (datetime.date(2001, 5, 5), datetime.date(2019, 1, 31))
+        == date_parser.get_date_metadata(dates)
+    )
+    assert (
+        (None, None)
+        == date_parser.get_date_metadata(
+            date_parser.parse_dates([None], 'YYYY-MM-DD').dates)
+    )
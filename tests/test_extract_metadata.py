@@ -10,16 +10,33 @@ References:
 """
 
 import collections
+import csv
 import datetime
+import decimal
+import gzip
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
 import alembic.config
 from alembic.config import Config
+import psycopg2
 import pytest
 import sqlalchemy
 import testing.postgresql
 
+from metabase import client
+from metabase import csv_source
+from metabase import daemon
 from metabase import extract_metadata
+from metabase import extract_metadata_helper
+from metabase import job_queue
+from metabase import jobs
+from metabase import sqlite_source
 
 
 # #############################################################################
@@ -242,6 +259,95 @@ def test_get_column_level_metadata_text(
     assert isinstance(results['date_last_updated'], datetime.datetime)
 
 
+def test_get_column_level_metadata_text_top_values(
+        setup_module,
+        setup_get_column_level_metadata,
+        tmpdir):
+    """Most frequent values of text columns are stored and exported."""
+
+    engine = setup_module.engine
+    engine.execute("""
+        INSERT INTO data.col_level_meta (c_text) VALUES
+            ('efgh'), ('efgh'), ('abc');
+    """)
+
+    def process_table(categorical_threshold):
+        with patch(
+                'metabase.extract_metadata.settings',
+                setup_module.mock_params):
+            extract = extract_metadata.ExtractMetadata(data_table_id=1)
+        extract.process_table(categorical_threshold=categorical_threshold)
+        return extract
+
+    extract = process_table(categorical_threshold=2)
+
+    results = engine.execute("""
+        SELECT column_name, rank, value, frequency, frequency_error
+        FROM metabase.text_top_value
+        ORDER BY rank
+    """).fetchall()
+
+    # 'ijklm' occurs once and is left out.
+    assert [
+        ('c_text', 1, 'efgh', 3, 0),
+        ('c_text', 2, 'abc', 2, 0),
+    ] == [tuple(row) for row in results]
+
+    output_filepath = str(tmpdir.join('gmeta.json'))
+    extract.export_table_metadata(output_filepath)
+    with open(output_filepath) as f:
+        document = json.load(f)
+
+    column = (document['gmeta'][0]['data.col_level_meta']['content']
+              ['files'][0]['columns_metadata']['c_text'])
+    assert {'efgh': 3, 'abc': 2} == column['top-k']
+    assert 'efgh' == column['top-value']
+    assert 3 == column['freq-top-value']
+
+    # Top values are deleted once the column is no longer a text column.
+    process_table(categorical_threshold=3)
+
+    assert 0 == engine.execute(
+        'SELECT COUNT(*) FROM metabase.text_top_value').scalar()
+
+
+def test_is_code_streams_text_columns(
+        setup_module, setup_get_column_level_metadata):
+    """Text columns are summarized from batches of grouped values."""
+
+    conn = psycopg2.connect(setup_module.mock_params.data_connection_string)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            assert [('F', 2), ('M', 1), (None, 1)] == sorted(
+                extract_metadata_helper.iter_value_counts(
+                    cursor, 'c_code', 'data', 'col_level_meta',
+                    batch_rows=1),
+                key=lambda value_count: (value_count[0] is None,
+                                         value_count[0]),
+            )
+
+            flag, code_counter = extract_metadata_helper.is_code(
+                cursor, 'c_code', 'data', 'col_level_meta', 2)
+            assert flag
+            assert collections.Counter(
+                {'F': 2, 'M': 1, None: 1}) == code_counter
+
+            flag, text_summary = extract_metadata_helper.is_code(
+                cursor, 'c_text', 'data', 'col_level_meta', 2)
+            assert not flag
+            assert (1, 3, 3) == text_summary.column_counts
+            assert {3: 1, 4: 1, 5: 1} == text_summary.length_counts
+            assert [] == text_summary.top_values
+            assert text_summary.minhash is not None
+
+        # The server-side cursors are closed with their transaction.
+        assert (psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                == conn.get_transaction_status())
+    finally:
+        conn.close()
+
+
 def test_get_column_level_metadata_date(
         setup_module,
         setup_get_column_level_metadata):
@@ -533,6 +639,208 @@ def test_get_column_level_metadata_invalid_override(
             type_overrides=type_overrides)
 
 
+def test_get_column_level_metadata_type_overrides_scan_once(
+        setup_module, setup_get_column_level_metadata):
+    """Overridden columns are scanned once, as the overriding type."""
+
+    with patch(
+            'metabase.extract_metadata.settings',
+            setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    extract.process_table(
+        categorical_threshold=2,
+        type_overrides={'c_num': 'numeric', 'c_text': 'code',
+                        'c_date': 'date'},
+        record_metrics=True,
+    )
+
+    engine = setup_module.engine
+    results = dict(engine.execute("""
+        SELECT column_name, queries_issued
+        FROM metabase.profiling_run
+        WHERE run_id = %s AND stage = 'type_detection'
+    """, extract.metrics.run_id).fetchall())
+
+    assert (1, 1, 1) == (results['c_num'], results['c_text'],
+                         results['c_date'])
+    # c_code is probed as numeric and date before it is counted.
+    assert 1 < results['c_code']
+
+    data_types = dict(engine.execute("""
+        SELECT column_name, data_type FROM metabase.column_info
+    """).fetchall())
+    assert ({'c_num': 'numeric', 'c_text': 'code', 'c_date': 'date',
+             'c_code': 'code'} == data_types)
+
+
+def test_plan_column():
+    """Column plans follow overrides and skip pointless type probes."""
+
+    plan = extract_metadata_helper.plan_column(
+        'c', 'text', {'c': 'text'}, {'c': 'YYYY-MM-DD'})
+    assert (('text',), True, 'YYYY-MM-DD') == plan[1:4]
+
+    assert (('date_sample', 'numeric', 'code')
+            == extract_metadata_helper.plan_column('c', 'text', {}, {}).probes)
+    assert (('date', 'numeric', 'code')
+            == extract_metadata_helper.plan_column(
+                'c', 'text', {}, {'c': 'YYYY-DD-MM'}).probes)
+    assert (('numeric', 'code')
+            == extract_metadata_helper.plan_column(
+                'c', 'integer', {}, {}).probes)
+    assert (('date', 'code')
+            == extract_metadata_helper.plan_column('c', 'date', {}, {}).probes)
+    assert (('code',)
+            == extract_metadata_helper.plan_column(
+                'c', 'boolean', {}, {}).probes)
+
+    with pytest.raises(ValueError):
+        extract_metadata_helper.plan_column(
+            'c', 'text', {'c': 'categorical'}, {})
+    with pytest.raises(ValueError):
+        extract_metadata_helper.plan_column(
+            'c', 'text', {}, {}, date_formats=['YYYY-Q'])
+
+
+def test_process_table_commits_columns(
+        setup_module, setup_get_column_level_metadata):
+    """Columns processed before a failure are kept and skipped on resume."""
+
+    with patch(
+            'metabase.extract_metadata.settings',
+            setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    with pytest.raises(ValueError):
+        extract.process_table(
+            categorical_threshold=2,
+            type_overrides={'c_code': 'numeric'})
+
+    engine = setup_module.engine
+    get_column_names = """
+        SELECT column_name
+        FROM metabase.column_info
+        WHERE data_table_id = 1
+        ORDER BY column_name
+    """
+    committed = [row[0] for row in engine.execute(get_column_names)]
+
+    assert 'c_code' not in committed
+    assert committed
+
+    with patch(
+            'metabase.extract_metadata.settings',
+            setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    extract.process_table(categorical_threshold=2, resume=True)
+
+    results = [row[0] for row in engine.execute(get_column_names)]
+    assert ['c_code', 'c_date', 'c_num', 'c_text'] == results
+
+    # Resumed runs refresh the GMETA cache as well.
+    result = engine.execute("""
+        SELECT COUNT(*) FROM metabase.gmeta_cache WHERE data_table_id = 1
+    """).fetchone()[0]
+    assert 1 == result
+
+
+def test_process_table_reprofile_in_place(
+        setup_module, setup_get_column_level_metadata):
+    """Profiling a table again replaces its metadata instead of adding rows."""
+
+    engine = setup_module.engine
+
+    def get_row_counts():
+        return engine.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM metabase.column_info),
+                (SELECT COUNT(*) FROM metabase.numeric_column),
+                (SELECT COUNT(*) FROM metabase.text_column),
+                (SELECT COUNT(*) FROM metabase.date_column),
+                (SELECT COUNT(*) FROM metabase.code_frequency),
+                (SELECT COUNT(*) FROM metabase.histogram_bin),
+                (SELECT COUNT(*) FROM metabase.text_top_value)
+        """).fetchone()
+
+    def get_column_ids():
+        return dict(engine.execute("""
+            SELECT column_name, column_id FROM metabase.column_info
+        """).fetchall())
+
+    def process_table():
+        with patch(
+                'metabase.extract_metadata.settings',
+                setup_module.mock_params):
+            extract = extract_metadata.ExtractMetadata(data_table_id=1)
+        extract.process_table(categorical_threshold=2)
+
+    process_table()
+    row_counts = get_row_counts()
+    column_ids = get_column_ids()
+
+    process_table()
+
+    assert row_counts == get_row_counts()
+    assert column_ids == get_column_ids()
+
+    # A code disappears, the NULL code as well, a column changes type and
+    # another one is dropped.
+    engine.execute("""
+        UPDATE data.col_level_meta SET c_code = 'F' WHERE c_code = 'M';
+        UPDATE data.col_level_meta SET c_code = 'X' WHERE c_code IS NULL;
+        UPDATE data.col_level_meta SET c_num = 'n/a' WHERE c_num = '1';
+        ALTER TABLE data.col_level_meta DROP COLUMN c_date;
+    """)
+
+    process_table()
+
+    assert ({'c_num': 'text', 'c_text': 'text', 'c_code': 'code'}
+            == dict(engine.execute("""
+                SELECT column_name, data_type FROM metabase.column_info
+            """).fetchall()))
+    assert column_ids['c_num'] == get_column_ids()['c_num']
+
+    codes = engine.execute("""
+        SELECT code, frequency FROM metabase.code_frequency ORDER BY code
+    """).fetchall()
+    assert [('F', 3), ('X', 1)] == codes
+
+    results = engine.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM metabase.numeric_column),
+            (SELECT COUNT(*) FROM metabase.text_column),
+            (SELECT COUNT(*) FROM metabase.date_column),
+            (SELECT COUNT(DISTINCT histogram_type) FROM metabase.histogram_bin
+             WHERE column_id = %(c_num)s)
+    """, {'c_num': column_ids['c_num']}).fetchone()
+    assert (0, 2, 0, 1) == tuple(results)
+
+
+def test_code_frequency_partitions(
+        setup_module, setup_get_column_level_metadata):
+    """Code frequencies of a table are stored in a single partition."""
+
+    engine = setup_module.engine
+    if int(engine.execute('SHOW server_version_num').scalar()) < 110000:
+        pytest.skip('Hash partitioning needs PostgreSQL 11')
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(categorical_threshold=2)
+
+    results = engine.execute("""
+        SELECT tableoid::REGCLASS::TEXT, COUNT(*)
+        FROM metabase.code_frequency
+        GROUP BY tableoid
+    """).fetchall()
+
+    assert 1 == len(results)
+    assert results[0][0].startswith('metabase.code_frequency_')
+    assert 3 == results[0][1]
+
+
 # Tests for `date_format_dict` in `extract_metadata_helper.is_date()`
 # =========================================================================
 
@@ -637,6 +945,97 @@ def test_get_column_level_metadata_date_format_partly_specified(
     assert 'c_date_date' in date_column_names_set
 
 
+@pytest.fixture
+def setup_date_formats(setup_module, request):
+    engine = setup_module.engine
+
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name) VALUES
+            (1, 'data.test_date_formats');
+
+        CREATE TABLE data.test_date_formats (
+            c_iso       TEXT,
+            c_compact   TEXT,
+            c_us        TEXT,
+            c_oracle    TEXT,
+            c_mixed     TEXT,
+            c_invalid   TEXT
+        );
+
+        INSERT INTO data.test_date_formats VALUES
+            ('2019-01-11', '20190111', '01/11/2019', '11-JAN-19',
+             '2019-01-11', '2019-01-11'),
+            ('2019-02-28', '20190228', '02/28/2019', '28-Feb-19',
+             '02/28/2019', '2019-02-30'),
+            (NULL, NULL, NULL, NULL, NULL, NULL)
+        ;
+    """)
+
+    def teardown_date_formats():
+        engine.execute("""
+            TRUNCATE TABLE metabase.data_table CASCADE;
+            DROP TABLE data.test_date_formats;
+        """)
+
+    request.addfinalizer(teardown_date_formats)
+
+
+def test_get_column_level_metadata_date_formats(
+        setup_module, setup_date_formats):
+    """Date columns are detected in any candidate format in two queries."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    extract.process_table(categorical_threshold=0, record_metrics=True)
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT column_name, min_date, max_date
+        FROM metabase.date_column
+        ORDER BY column_name
+    """).fetchall()
+
+    expected_dates = (datetime.date(2019, 1, 11), datetime.date(2019, 2, 28))
+    assert ['c_compact', 'c_iso', 'c_oracle', 'c_us'] == [
+        row['column_name'] for row in results]
+    for row in results:
+        assert expected_dates == (row['min_date'], row['max_date'])
+
+    data_types = dict(engine.execute("""
+        SELECT column_name, data_type FROM metabase.column_info
+        WHERE column_name IN ('c_mixed', 'c_invalid')
+    """).fetchall())
+    assert {'c_mixed': 'text', 'c_invalid': 'text'} == data_types
+
+    queries_issued = dict(engine.execute("""
+        SELECT column_name, queries_issued
+        FROM metabase.profiling_run
+        WHERE run_id = %s AND stage = 'type_detection'
+    """, extract.metrics.run_id).fetchall())
+    assert 2 == queries_issued['c_iso']
+
+
+def test_get_column_level_metadata_date_formats_configured(
+        setup_module, setup_date_formats):
+    """Only the configured candidate formats are tried."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    extract.process_table(
+        categorical_threshold=0,
+        date_formats=['MM/DD/YYYY'],
+    )
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT column_name FROM metabase.column_info WHERE data_type = 'date'
+    """).fetchall()
+
+    assert [('c_us',)] == results
+
+
 def test_get_column_level_metadata_date_format_wrong_format_treat_as_text(
         setup_module, setup_date_format):
     with patch('metabase.extract_metadata.settings', setup_module.mock_params):
@@ -653,3 +1052,1644 @@ def test_get_column_level_metadata_date_format_wrong_format_treat_as_text(
     """).fetchall()[0]
 
     assert 'text' == result['data_type']
+
+
+# Tests for `export_many()` and `export_all()`
+# =========================================================================
+
+@pytest.fixture
+def setup_export_many(setup_module, request):
+    """
+    Setup function-level fixtures for `export_many()` and `export_all()`.
+    """
+    engine = setup_module.engine
+
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name) VALUES
+            (1, 'data.export_many_1'),
+            (2, 'data.export_many_2');
+
+        CREATE TABLE data.export_many_1 (c_num INT, c_code TEXT);
+        CREATE TABLE data.export_many_2 (c_text TEXT, c_date DATE);
+
+        INSERT INTO data.export_many_1 VALUES (1, 'A'), (2, 'B'), (3, 'A');
+        INSERT INTO data.export_many_2 VALUES
+            ('abc', '2019-01-01'),
+            ('defgh', '2019-02-01'),
+            ('ij', '2019-03-01');
+    """)
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        for data_table_id in (1, 2):
+            extract = extract_metadata.ExtractMetadata(data_table_id)
+            extract.process_table(categorical_threshold=2)
+
+    def teardown_export_many():
+        engine.execute("""
+            TRUNCATE TABLE metabase.data_table CASCADE;
+            DROP TABLE data.export_many_1;
+            DROP TABLE data.export_many_2;
+        """)
+
+    request.addfinalizer(teardown_export_many)
+
+
+def test_export_many_ndjson(setup_module, setup_export_many, tmpdir):
+    """One GMETA document per line, identical to the single-table export."""
+
+    output_filepath = str(tmpdir.join('gmeta.ndjson'))
+
+    umask = os.umask(0o027)
+    try:
+        with patch('metabase.extract_metadata.settings',
+                   setup_module.mock_params):
+            n_exported = extract_metadata.export_many(
+                [1, 2, 3],  # 3 is not in the metabase and is skipped.
+                output_filepath,
+                batch_size=1,
+            )
+    finally:
+        os.umask(umask)
+
+    # Exports are readable as the umask allows, not by their owner only.
+    assert 0o640 == os.stat(output_filepath).st_mode & 0o777
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    single_filepath = str(tmpdir.join('gmeta_1.json'))
+    extract.export_table_metadata(single_filepath)
+
+    with open(output_filepath) as f:
+        documents = [json.loads(line) for line in f]
+    with open(single_filepath) as f:
+        single_document = json.load(f)
+
+    assert 2 == n_exported
+    assert 2 == len(documents)
+    assert single_document == documents[0]
+
+    columns = (documents[1]['gmeta'][0]['data.export_many_2']['content']
+               ['files'][0]['columns_metadata'])
+    assert 'Textual' == columns['c_text']['profiler-type']
+    assert 'Temporal' == columns['c_date']['profiler-type']
+    assert [os.path.basename(output_filepath),
+            'gmeta_1.json'] == sorted(os.listdir(str(tmpdir)))
+
+
+def test_export_all_directory(setup_module, setup_export_many, tmpdir):
+    """Every Data Table is written to its own file."""
+
+    connections = []
+    psycopg2_connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        connections.append(psycopg2_connect(*args, **kwargs))
+        return connections[-1]
+
+    with patch('metabase.extract_metadata.settings',
+               setup_module.mock_params), \
+            patch('metabase.extract_metadata.psycopg2.connect', connect):
+        n_exported = extract_metadata.export_all(
+            str(tmpdir),
+            output_format='directory',
+        )
+
+    assert 2 == n_exported
+    # Exports from the daemon would leak connections left open.
+    assert [True] == [bool(conn.closed) for conn in connections]
+    assert ['1.json', '2.json'] == sorted(os.listdir(str(tmpdir)))
+
+    with open(str(tmpdir.join('1.json'))) as f:
+        document = json.load(f)
+
+    columns = (document['gmeta'][0]['data.export_many_1']['content']
+               ['files'][0]['columns_metadata'])
+    assert 3 == columns['c_num']['max']
+    assert {'A': 2, 'B': 1} == columns['c_code']['top-k']
+
+
+# Tests for the GMETA cache
+# =========================================================================
+
+def test_gmeta_cache_refreshed_by_process_table(
+        setup_module, setup_export_many):
+    """Processing a table stores its rendered GMETA document."""
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT data_table_id, gmeta, gmeta_hash, version
+        FROM metabase.gmeta_cache
+        ORDER BY data_table_id
+    """).fetchall()
+
+    assert [1, 2] == [row['data_table_id'] for row in results]
+    assert [1, 1] == [row['version'] for row in results]
+    assert 32 == len(results[0]['gmeta_hash'])
+    assert 'data.export_many_1' in results[0]['gmeta']['gmeta'][0]
+
+
+def test_gmeta_cache_used_by_export_until_stale(
+        setup_module, setup_export_many, tmpdir):
+    """A fresh cached document is exported as is, a stale one is rebuilt."""
+
+    engine = setup_module.engine
+    engine.execute("""
+        UPDATE metabase.gmeta_cache
+        SET gmeta = '{"cached": true}'
+        WHERE data_table_id = 1
+    """)
+
+    output_filepath = str(tmpdir.join('gmeta.json'))
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.export_table_metadata(output_filepath)
+
+    with open(output_filepath) as f:
+        assert {'cached': True} == json.load(f)
+
+    engine.execute("""
+        UPDATE metabase.data_table
+        SET date_last_updated = CURRENT_TIMESTAMP
+        WHERE data_table_id = 1
+    """)
+    extract.export_table_metadata(output_filepath)
+
+    with open(output_filepath) as f:
+        assert 'gmeta' in json.load(f)
+
+    result = engine.execute("""
+        SELECT gmeta ? 'gmeta' AS rebuilt, version
+        FROM metabase.gmeta_cache
+        WHERE data_table_id = 1
+    """).fetchall()[0]
+
+    assert result['rebuilt']
+    assert 1 == result['version']  # Same document, same hash.
+
+
+def test_gmeta_cache_stale_after_format_change(
+        setup_module, setup_export_many, tmpdir):
+    """Documents cached in another format are rendered again."""
+
+    engine = setup_module.engine
+    engine.execute("""
+        UPDATE metabase.gmeta_cache
+        SET gmeta = '{"cached": true}', format_version = NULL
+        WHERE data_table_id = 1
+    """)
+
+    output_filepath = str(tmpdir.join('gmeta.json'))
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.export_table_metadata(output_filepath)
+
+    with open(output_filepath) as f:
+        assert 'gmeta' in json.load(f)
+
+    format_version = engine.execute("""
+        SELECT format_version FROM metabase.gmeta_cache
+        WHERE data_table_id = 1
+    """).scalar()
+    assert extract_metadata_helper.GMETA_FORMAT_VERSION == format_version
+
+
+# Tests for histograms
+# =========================================================================
+
+def test_get_column_level_metadata_histogram_equi_width(
+        setup_module, setup_get_column_level_metadata):
+    """Numeric values and text lengths are binned between min and max."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(categorical_threshold=2, histogram_bins=2)
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT
+            column_name,
+            histogram_type,
+            method,
+            bin_number,
+            lower_bound,
+            upper_bound,
+            frequency
+        FROM metabase.histogram_bin
+        ORDER BY column_name, bin_number
+    """).fetchall()
+
+    assert [
+        ('c_num', 'numeric', 'equi_width', 1, 1, 2, 1),
+        ('c_num', 'numeric', 'equi_width', 2, 2, 3, 2),
+        ('c_text', 'text_length', 'equi_width', 1, 3, 4, 1),
+        ('c_text', 'text_length', 'equi_width', 2, 4, 5, 2),
+    ] == [tuple(row) for row in results]
+
+
+def test_get_column_level_metadata_histogram_equi_depth(
+        setup_module, setup_get_column_level_metadata):
+    """Equi-depth bins are bounded by quantiles."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(
+        categorical_threshold=2,
+        histogram_bins=2,
+        histogram_method='equi_depth',
+    )
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT bin_number, lower_bound, upper_bound, frequency
+        FROM metabase.histogram_bin
+        WHERE column_name = 'c_num'
+        ORDER BY bin_number
+    """).fetchall()
+
+    assert [(1, 1, 2, 1), (2, 2, 3, 2)] == [
+        (row['bin_number'], row['lower_bound'], row['upper_bound'],
+         row['frequency'])
+        for row in results
+    ]
+
+
+def test_get_column_level_metadata_histogram_disabled(
+        setup_module, setup_get_column_level_metadata):
+    """No histogram is computed when histogram_bins is 0."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(categorical_threshold=2, histogram_bins=0)
+
+    engine = setup_module.engine
+    results = engine.execute('SELECT * FROM metabase.histogram_bin').fetchall()
+
+    assert [] == results
+
+
+def test_export_table_metadata_histogram(
+        setup_module, setup_export_many, tmpdir):
+    """Histogram bins are exported as Histogram Data JSON."""
+
+    output_filepath = str(tmpdir.join('gmeta.json'))
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.export_table_metadata(output_filepath)
+
+    with open(output_filepath) as f:
+        document = json.load(f)
+
+    columns = (document['gmeta'][0]['data.export_many_1']['content']
+               ['files'][0]['columns_metadata'])
+    histogram = columns['c_num']['Histogram Data JSON']
+
+    assert 'equi_width' == histogram['method']
+    assert 3 == sum(b['frequency'] for b in histogram['bins'])
+    assert 1 == histogram['bins'][0]['lower_bound']
+    assert 3 == histogram['bins'][-1]['upper_bound']
+
+
+# Tests for missing, non-null and distinct counts and standard deviation
+# =========================================================================
+
+def test_get_column_level_metadata_column_counts(
+        setup_module, setup_get_column_level_metadata):
+    """Every column records its missing, non-null and distinct counts."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(
+        categorical_threshold=2,
+        type_overrides={'c_num': 'text'},
+    )
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT column_name, missing_count, non_null_count, distinct_count
+        FROM metabase.column_info
+        ORDER BY column_name
+    """).fetchall()
+
+    assert [
+        ('c_code', 1, 3, 2),
+        ('c_date', 1, 3, 3),
+        ('c_num', 1, 3, 3),
+        ('c_text', 1, 3, 3),
+    ] == [tuple(row) for row in results]
+
+
+def test_get_column_level_metadata_numeric_std(
+        setup_module, setup_get_column_level_metadata):
+    """Numeric columns record their sample standard deviation."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(categorical_threshold=2)
+
+    engine = setup_module.engine
+    result = engine.execute(
+        'SELECT std FROM metabase.numeric_column').fetchall()[0]
+
+    assert 1 == result['std']
+
+
+@pytest.mark.parametrize('values', [
+    [decimal.Decimal(v) for v in ('1.5', '2', '2', '-3.25', '10')] + [None],
+    [decimal.Decimal(v) for v in ('0.1', '0.2', '0.2', '7')],
+    [decimal.Decimal('4')],
+])
+def test_get_numeric_metadata_from_frequencies(values):
+    """Statistics of value frequencies are those of the repeated values."""
+
+    numeric_stats = extract_metadata_helper.get_numeric_metadata(
+        collections.Counter(values))
+
+    not_null = [v for v in values if v is not None]
+    assert min(not_null) == numeric_stats.min
+    assert max(not_null) == numeric_stats.max
+    assert statistics.mean(not_null) == numeric_stats.mean
+    assert statistics.median(not_null) == numeric_stats.median
+    if len(not_null) > 1:
+        assert (
+            statistics.stdev(not_null)
+            == pytest.approx(numeric_stats.std, rel=1e-20)
+        )
+    else:
+        assert numeric_stats.std is None
+
+    text_summary = extract_metadata_helper.summarize_text(
+        collections.Counter(
+            None if v is None else str(v) for v in values).items(),
+        batch_rows=2,
+    )
+    lengths = [len(str(v)) for v in not_null]
+    assert (
+        (max(lengths), min(lengths), statistics.median(lengths))
+        == extract_metadata_helper.get_text_metadata(
+            text_summary.length_counts)
+    )
+    assert (
+        (values.count(None), len(not_null), len(set(not_null)))
+        == text_summary.column_counts
+    )
+
+
+def test_export_table_metadata_column_counts(
+        setup_module, setup_export_many, tmpdir):
+    """Missing and distinct counts and std are exported."""
+
+    output_filepath = str(tmpdir.join('gmeta.json'))
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.export_table_metadata(output_filepath)
+
+    with open(output_filepath) as f:
+        document = json.load(f)
+
+    columns = (document['gmeta'][0]['data.export_many_1']['content']
+               ['files'][0]['columns_metadata'])
+
+    assert 0 == columns['c_num']['missing']
+    assert 3 == columns['c_num']['values']
+    assert 1 == columns['c_num']['std']
+    assert 0 == columns['c_code']['missing']
+    assert 2 == columns['c_code']['values']
+
+
+# Tests for per-stage metrics
+# =========================================================================
+
+def test_process_table_record_metrics(
+        setup_module, setup_get_column_level_metadata):
+    """Metrics of every stage are stored per column and for the table."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(categorical_threshold=2, record_metrics=True)
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT *
+        FROM metabase.profiling_run
+        WHERE run_id = %s
+    """, extract.metrics.run_id).fetchall()
+
+    stages = {(row['column_name'], row['stage']): row for row in results}
+
+    assert {
+        (None, 'total'),
+        (None, 'catalog'),
+        (None, 'table_level'),
+        (None, 'gmeta_cache'),
+        ('c_num', 'type_detection'),
+        ('c_num', 'update'),
+        ('c_num', 'histogram'),
+        ('c_date', 'type_detection'),
+        ('c_date', 'update'),
+    } <= set(stages)
+
+    assert 1 == stages[(None, 'total')]['data_table_id']
+    assert 4 <= stages[('c_num', 'type_detection')]['rows_fetched']
+    assert 0 < stages[('c_num', 'type_detection')]['bytes_fetched']
+    assert 0 < stages[('c_num', 'type_detection')]['queries_issued']
+    assert (stages[(None, 'total')]['queries_issued']
+            > stages[('c_num', 'update')]['queries_issued']
+            > 0)
+    assert (stages[(None, 'total')]['wall_seconds']
+            >= stages[('c_num', 'update')]['wall_seconds'])
+
+
+def test_process_table_profile_memory(
+        setup_module, setup_get_column_level_metadata, capsys):
+    """Memory of every stage is stored and the top columns are printed."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(
+        categorical_threshold=2,
+        record_metrics=True,
+        profile_memory=True,
+    )
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT column_name, rss_before_bytes, rss_after_bytes,
+            peak_traced_bytes
+        FROM metabase.profiling_run
+        WHERE run_id = %s
+    """, extract.metrics.run_id).fetchall()
+
+    assert results
+    for row in results:
+        assert row['peak_traced_bytes'] > 0
+        if os.path.exists('/proc/self/statm'):
+            assert row['rss_before_bytes'] > 0
+            assert row['rss_after_bytes'] > 0
+
+    output = capsys.readouterr().out
+    assert 'Columns using the most memory:' in output
+    # Header and the five stages using the most memory.
+    assert 7 == len(output.strip().splitlines())
+
+
+def test_process_table_prometheus_textfile(
+        setup_module, setup_get_column_level_metadata, tmpdir):
+    """Metrics of the run are written for node_exporter."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    extract.process_table(
+        categorical_threshold=2,
+        prometheus_textfile_dir=str(tmpdir),
+    )
+
+    with open(str(tmpdir.join('metabase_extract.prom'))) as f:
+        lines = f.read().splitlines()
+
+    assert 'metabase_extract_last_run_failed 0' in lines
+    assert 'metabase_extract_rows_scanned 4' in lines
+    for column_type in ['numeric', 'text', 'date', 'code']:
+        assert 'metabase_extract_columns{{type="{}"}} 1'.format(
+            column_type) in lines
+    assert ('metabase_extract_stage_duration_seconds_count'
+            '{stage="update"} 4') in lines
+
+    rows_written = [
+        line for line in lines
+        if line.startswith('metabase_extract_rows_written ')
+    ]
+    assert int(rows_written[0].split()[1]) > 4
+
+
+def test_process_table_record_metrics_on_failure(
+        setup_module, setup_empty_table):
+    """Metrics are stored even if the run fails."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    with pytest.raises(ValueError):
+        extract.process_table(record_metrics=True)
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT stage
+        FROM metabase.profiling_run
+        WHERE run_id = %s
+    """, extract.metrics.run_id).fetchall()
+
+    assert {'total', 'catalog', 'table_level'} == {r[0] for r in results}
+
+
+def test_process_table_log_metrics(
+        setup_module, setup_get_column_level_metadata, caplog):
+    """Metrics are logged as JSON objects without being stored."""
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    with caplog.at_level('INFO', logger='metabase.instrumentation'):
+        extract.process_table(categorical_threshold=2, log_metrics=True)
+
+    records = [json.loads(r.getMessage()) for r in caplog.records]
+    total = [r for r in records if r['stage'] == 'total'][0]
+
+    assert extract.metrics.run_id == total['run_id']
+    assert 1 == total['data_table_id']
+    assert total['wall_seconds'] > 0
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT * FROM metabase.profiling_run WHERE run_id = %s
+    """, extract.metrics.run_id).fetchall()
+
+    assert [] == results
+
+
+def test_process_table_explain_file(
+        setup_module, setup_get_column_level_metadata, tmpdir, caplog):
+    """Plans of data SELECT statements are written to the explain file."""
+
+    explain_filepath = str(tmpdir.join('explain.ndjson'))
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+
+    with caplog.at_level('INFO', logger='metabase.instrumentation'):
+        extract.process_table(
+            categorical_threshold=2,
+            explain_filepath=explain_filepath,
+        )
+
+    with open(explain_filepath) as f:
+        traces = [json.loads(line) for line in f]
+
+    assert traces
+    for trace in traces:
+        assert 'data' == trace['database']
+        assert trace['statement'].startswith(('SELECT', 'WITH'))
+        if trace['error'] is None:
+            assert 'Plan' in trace['plan'][0]
+        else:
+            # Failed type detection probes fail under EXPLAIN as well.
+            assert 'error' in trace['plan']
+
+    logged = [json.loads(r.getMessage()) for r in caplog.records]
+    assert {'data', 'metabase'} == {t['database'] for t in logged}
+
+    engine = setup_module.engine
+    result = engine.execute("""
+        SELECT COUNT(*) FROM metabase.column_info WHERE data_table_id = 1
+    """).fetchone()[0]
+
+    assert 4 == result
+
+
+# Tests for extraction jobs and the daemon
+# =========================================================================
+
+def sync_data_table_id_sequence(engine):
+    """Move the data_table_id sequence past the IDs inserted by fixtures."""
+
+    engine.execute("""
+        SELECT SETVAL(
+            PG_GET_SERIAL_SEQUENCE('metabase.data_table', 'data_table_id'),
+            COALESCE(MAX(data_table_id), 0) + 1,
+            FALSE
+        )
+        FROM metabase.data_table
+    """)
+
+
+def test_register_data_tables(setup_module, setup_get_column_level_metadata):
+    """Bulk registration allocates distinct IDs in the order of the tables."""
+
+    sync_data_table_id_sequence(setup_module.engine)
+
+    conn = psycopg2.connect(
+        setup_module.mock_params.metabase_connection_string)
+    try:
+        with conn:
+            ids = jobs.register_data_tables(
+                conn, ['data.table_a', 'data.table_b', 'data.table_c'])
+        with conn:
+            single_id = jobs.register_data_table(conn, 'data.table_d')
+    finally:
+        conn.close()
+
+    assert [2, 3, 4] == ids
+    assert 5 == single_id
+
+    results = setup_module.engine.execute("""
+        SELECT data_table_id, file_table_name
+        FROM metabase.data_table
+        WHERE data_table_id > 1
+        ORDER BY data_table_id
+    """).fetchall()
+
+    assert [
+        (2, 'data.table_a'),
+        (3, 'data.table_b'),
+        (4, 'data.table_c'),
+        (5, 'data.table_d'),
+    ] == results
+
+
+def test_register_data_tables_concurrently(
+        setup_module, setup_get_column_level_metadata):
+    """Open transactions registering tables never get the same ID."""
+
+    sync_data_table_id_sequence(setup_module.engine)
+
+    conn_str = setup_module.mock_params.metabase_connection_string
+    conn = psycopg2.connect(conn_str)
+    other_conn = psycopg2.connect(conn_str)
+    try:
+        # Both transactions stay open until all tables are registered.
+        ids = jobs.register_data_tables(conn, ['data.table_a'] * 3)
+        other_ids = jobs.register_data_tables(other_conn, ['data.table_b'])
+        ids += jobs.register_data_tables(conn, ['data.table_c'])
+        conn.commit()
+        other_conn.commit()
+    finally:
+        conn.close()
+        other_conn.close()
+
+    assert [2, 3, 4, 6] == ids
+    assert [5] == other_ids
+
+@pytest.fixture
+def setup_daemon(setup_module, tmpdir, request):
+    """
+    Start an extraction daemon on a temporary socket.
+    """
+    socket_path = str(tmpdir.join('extract.sock'))
+
+    with patch('metabase.daemon.settings', setup_module.mock_params):
+        server = daemon.ExtractionServer(socket_path, workers=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def teardown_daemon():
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+    request.addfinalizer(teardown_daemon)
+
+    return socket_path
+
+
+def test_daemon_runs_jobs(
+        setup_module, setup_get_column_level_metadata, setup_daemon, tmpdir):
+    """Jobs run on the pooled connections of the daemon."""
+
+    gmeta_output = str(tmpdir.join('gmeta.json'))
+    job = {
+        'full_table_name': 'data.col_level_meta',
+        'options': {'categorical_threshold': 2},
+        'gmeta_output': gmeta_output,
+    }
+
+    sync_data_table_id_sequence(setup_module.engine)
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        first_id = client.submit_job(job, setup_daemon)
+        second_id = client.submit_job(job, setup_daemon)
+
+    assert (2, 3) == (first_id, second_id)
+
+    engine = setup_module.engine
+    results = engine.execute("""
+        SELECT data_table_id, COUNT(*)
+        FROM metabase.column_info
+        GROUP BY data_table_id
+        ORDER BY data_table_id
+    """).fetchall()
+
+    assert [(2, 4), (3, 4)] == results
+    assert os.path.exists(gmeta_output)
+
+
+def test_daemon_job_failure(
+        setup_module, setup_empty_table, setup_daemon):
+    """Failed jobs are reported to the client and the daemon keeps serving."""
+
+    job = {
+        'full_table_name': 'data.col_level_meta',
+        'options': {'categorical_threshold': 2},
+    }
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        with pytest.raises(client.JobFailed) as excinfo:
+            client.submit_job(job, setup_daemon)
+        assert 'ValueError' in str(excinfo.value)
+
+        with pytest.raises(client.JobFailed):
+            client.submit_job(job, setup_daemon)
+
+
+def test_daemon_profile_memory_runs_alone(tmpdir):
+    """A job profiling memory waits for the running jobs and runs alone."""
+
+    running = []
+    overlaps = []
+    release = threading.Event()
+
+    def run_job(job, data_conn, metabase_conn):
+        running.append(job['full_table_name'])
+        overlaps.append(len(running))
+        if job['full_table_name'] == 'data.first':
+            release.wait(5)
+        running.remove(job['full_table_name'])
+
+    socket_path = str(tmpdir.join('extract.sock'))
+    with patch('metabase.daemon.psycopg2.pool.ThreadedConnectionPool'), \
+            patch('metabase.daemon.jobs.run_job', side_effect=run_job):
+        server = daemon.ExtractionServer(socket_path, workers=2)
+        try:
+            first = threading.Thread(
+                target=server.run_job,
+                args=({'full_table_name': 'data.first'},),
+            )
+            profiled = threading.Thread(
+                target=server.run_job,
+                args=({
+                    'full_table_name': 'data.profiled',
+                    'options': {'profile_memory': True},
+                },),
+            )
+            first.start()
+            while not running:
+                time.sleep(0.01)
+            profiled.start()
+            profiled.join(0.2)
+
+            # A slot is free, but the profiled job waits for the first one.
+            assert profiled.is_alive()
+            assert ['data.first'] == running
+
+            release.set()
+            first.join()
+            profiled.join()
+            server.run_job({'full_table_name': 'data.last'})
+        finally:
+            server.server_close()
+
+    assert [1, 1, 1] == overlaps
+
+
+def test_run_job_in_process(setup_module, setup_get_column_level_metadata):
+    """Without connections, a job opens its own."""
+
+    job = {
+        'full_table_name': 'data.col_level_meta',
+        'options': {'categorical_threshold': 2},
+    }
+
+    sync_data_table_id_sequence(setup_module.engine)
+
+    with patch('metabase.jobs.settings', setup_module.mock_params), \
+            patch('metabase.extract_metadata.settings',
+                  setup_module.mock_params):
+        data_table_id = jobs.run_job(job)
+
+    assert 2 == data_table_id
+
+    engine = setup_module.engine
+    result = engine.execute("""
+        SELECT COUNT(*) FROM metabase.column_info WHERE data_table_id = 2
+    """).fetchone()[0]
+
+    assert 4 == result
+
+
+# Tests for the extraction job queue
+# =========================================================================
+
+def get_jobs(engine):
+    return engine.execute("""
+        SELECT job_id, data_table_id, status, attempts, error
+        FROM metabase.extraction_job
+        ORDER BY job_id
+    """).fetchall()
+
+
+def test_job_queue_claims_by_priority(setup_module, setup_export_many):
+    """Jobs are claimed by priority and locked jobs are skipped."""
+
+    conn_str = setup_module.mock_params.metabase_connection_string
+    conn = psycopg2.connect(conn_str)
+    other_conn = psycopg2.connect(conn_str)
+    try:
+        with conn, conn.cursor() as cursor:
+            low_id, = job_queue.enqueue(cursor, [1])
+            high_id, = job_queue.enqueue(cursor, [2], priority=10)
+            next_id, = job_queue.enqueue(cursor, [1])
+
+        # Another transaction holds a lock on the job with highest priority.
+        with other_conn.cursor() as other_cursor:
+            other_cursor.execute("""
+                SELECT * FROM metabase.extraction_job
+                WHERE job_id = %s FOR UPDATE
+            """, [high_id])
+
+            job = job_queue.claim_job(conn, 'worker_1', 60)
+        other_conn.rollback()
+
+        assert (low_id, 1, 1) == (job.job_id, job.data_table_id, job.attempts)
+
+        assert high_id == job_queue.claim_job(conn, 'worker_2', 60).job_id
+        assert next_id == job_queue.claim_job(conn, 'worker_1', 60).job_id
+        assert job_queue.claim_job(conn, 'worker_1', 60) is None
+
+        assert job_queue.heartbeat(conn, low_id, 'worker_1', 60)
+        assert not job_queue.heartbeat(conn, low_id, 'worker_2', 60)
+    finally:
+        conn.close()
+        other_conn.close()
+
+
+def test_job_queue_lease_expiry(setup_module, setup_export_many):
+    """Jobs of unresponsive workers are retried until max_attempts."""
+
+    engine = setup_module.engine
+    conn = psycopg2.connect(
+        setup_module.mock_params.metabase_connection_string)
+    try:
+        with conn, conn.cursor() as cursor:
+            job_id, = job_queue.enqueue(cursor, [1], max_attempts=2)
+
+        for attempt in [1, 2]:
+            job = job_queue.claim_job(conn, 'worker_1', -1)
+            assert (job_id, attempt) == (job.job_id, job.attempts)
+            assert 1 == job_queue.release_expired_jobs(conn)
+
+        assert not job_queue.complete_job(conn, job_id, 'worker_1')
+    finally:
+        conn.close()
+
+    [(_, _, status, attempts, error)] = get_jobs(engine)
+    assert ('failed', 2) == (status, attempts)
+    assert 'Lease of worker worker_1 expired' == error
+
+
+@pytest.mark.parametrize('options', [
+    {'date_format': {'c_date': 'YYYY-MM-DD'}},
+    {'gmeta_output': 'gmeta.json'},
+    {'abort_event': None},
+])
+def test_job_queue_rejects_unknown_options(options):
+    """Options are checked against process_table() when jobs are queued."""
+
+    cursor = MagicMock()
+    with pytest.raises(ValueError, match=next(iter(options))):
+        job_queue.enqueue(cursor, [1], options=options)
+    cursor.execute.assert_not_called()
+
+    job_queue.check_options(
+        {'categorical_threshold': 2, 'date_format_dict': {}})
+
+
+def test_job_queue_run_worker(setup_module, setup_export_many):
+    """Workers drain the queue and record outcomes."""
+
+    engine = setup_module.engine
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name)
+        VALUES (3, 'data.missing_table');
+    """)
+
+    conn = psycopg2.connect(
+        setup_module.mock_params.metabase_connection_string)
+    try:
+        with conn, conn.cursor() as cursor:
+            job_queue.enqueue(
+                cursor,
+                [1, 3],
+                options={'categorical_threshold': 2, 'histogram_bins': 0},
+                max_attempts=1,
+            )
+    finally:
+        conn.close()
+
+    with patch('metabase.job_queue.settings', setup_module.mock_params), \
+            patch('metabase.extract_metadata.settings',
+                  setup_module.mock_params):
+        assert 2 == job_queue.run_worker(
+            heartbeat_seconds=0.01,
+            stop_when_empty=True,
+        )
+
+    jobs_rows = get_jobs(engine)
+    assert [(1, 'succeeded', 1), (3, 'failed', 1)] == [
+        (row['data_table_id'], row['status'], row['attempts'])
+        for row in jobs_rows
+    ]
+    assert jobs_rows[0]['error'] is None
+    assert jobs_rows[1]['error'].startswith('UndefinedTable')
+
+
+def test_process_table_abort_event(
+        setup_module, setup_get_column_level_metadata):
+    """No column is processed once the abort event is set."""
+
+    abort_event = threading.Event()
+    abort_event.set()
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract = extract_metadata.ExtractMetadata(data_table_id=1)
+    with pytest.raises(extract_metadata.RunAborted):
+        extract.process_table(
+            categorical_threshold=2,
+            abort_event=abort_event,
+        )
+
+    engine = setup_module.engine
+    assert 4 == engine.execute(
+        'SELECT number_rows FROM metabase.data_table').scalar()
+    assert 0 == engine.execute(
+        'SELECT COUNT(*) FROM metabase.column_info').scalar()
+
+
+def test_job_queue_lost_lease_aborts_run(
+        setup_module, setup_export_many, caplog):
+    """A worker whose heartbeat finds the job lost stops processing it."""
+
+    conn = psycopg2.connect(
+        setup_module.mock_params.metabase_connection_string)
+    try:
+        with conn, conn.cursor() as cursor:
+            job_queue.enqueue(cursor, [1])
+        job = job_queue.claim_job(conn, 'worker_1', 60)
+    finally:
+        conn.close()
+
+    heartbeat_sent = threading.Event()
+
+    def lost_heartbeat(*args):
+        heartbeat_sent.set()
+        return False
+
+    delete_missing_columns = extract_metadata_helper.delete_missing_columns
+
+    def delete_after_heartbeat(*args):
+        # Columns are processed once the heartbeat thread gave up.
+        heartbeat_sent.wait(5)
+        time.sleep(0.1)
+        return delete_missing_columns(*args)
+
+    with patch('metabase.job_queue.settings', setup_module.mock_params), \
+            patch('metabase.extract_metadata.settings',
+                  setup_module.mock_params), \
+            patch('metabase.job_queue.heartbeat', lost_heartbeat), \
+            patch('metabase.extract_metadata_helper.delete_missing_columns',
+                  delete_after_heartbeat), \
+            caplog.at_level('ERROR', logger='metabase.job_queue'):
+        error = job_queue.run_claimed_job(job, 'worker_1', 60, 0.01)
+
+    assert error.startswith('RunAborted')
+    assert ['Worker worker_1 lost job {}'.format(job.job_id)] == [
+        record.getMessage() for record in caplog.records]
+
+
+# Tests for candidate keys
+# =========================================================================
+
+def test_get_candidate_keys():
+    """Pairs are checked only if their distinct counts allow a key."""
+
+    key_columns = [
+        extract_metadata_helper.KEY_COLUMN('id', 0, 100, 100),
+        extract_metadata_helper.KEY_COLUMN('a', 0, 100, 10),
+        extract_metadata_helper.KEY_COLUMN('b', 0, 100, 20),
+        extract_metadata_helper.KEY_COLUMN('c', 0, 100, 5),
+        extract_metadata_helper.KEY_COLUMN('missing', 1, 99, 99),
+        extract_metadata_helper.KEY_COLUMN('constant', 0, 100, 1),
+    ]
+
+    assert (
+        (['id'], [('a', 'b'), ('b', 'c')])
+        == extract_metadata_helper.get_candidate_keys(key_columns)
+    )
+    assert (
+        (['id'], [('a', 'b')])
+        == extract_metadata_helper.get_candidate_keys(key_columns, 1)
+    )
+    assert (
+        (['id'], [])
+        == extract_metadata_helper.get_candidate_keys(
+            key_columns, max_rows=99)
+    )
+    assert ([], []) == extract_metadata_helper.get_candidate_keys([])
+
+
+def test_has_duplicate_rows():
+    """Duplicates are found within and across batches."""
+
+    assert not extract_metadata_helper.has_duplicate_rows(
+        [[(1, 'a'), (1, 'b')], [(2, 'a')]])
+    assert extract_metadata_helper.has_duplicate_rows(
+        [[(1, 'a'), (1, 'a')]])
+    assert extract_metadata_helper.has_duplicate_rows(
+        [[(1, 'a')], [(2, 'a'), (1, 'a')]])
+    assert not extract_metadata_helper.has_duplicate_rows([])
+
+
+@pytest.fixture
+def setup_candidate_keys(setup_module, request):
+    """
+    Setup function-level fixtures for candidate keys.
+
+    (a, b) identifies the rows, and (a, c) and (b, c) do not.
+    """
+    engine = setup_module.engine
+
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name)
+        VALUES (1, 'data.keys_table');
+
+        CREATE TABLE data.keys_table (id INT, a INT, b TEXT, c INT, d INT);
+
+        INSERT INTO data.keys_table
+            SELECT i, i / 10, 'b' || MOD(i, 10), MOD(i, 20) / 2, NULL
+            FROM GENERATE_SERIES(0, 99) AS i;
+    """)
+
+    def teardown_candidate_keys():
+        engine.execute("""
+            TRUNCATE TABLE metabase.data_table CASCADE;
+            DROP TABLE data.keys_table;
+        """)
+
+    request.addfinalizer(teardown_candidate_keys)
+
+
+def test_process_table_candidate_keys(setup_module, setup_candidate_keys):
+    """Unique columns and pairs of columns are stored as candidate keys."""
+
+    engine = setup_module.engine
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract_metadata.ExtractMetadata(1).process_table(
+            categorical_threshold=2)
+
+    uniqueness = dict(engine.execute("""
+        SELECT column_name, uniqueness FROM metabase.column_info
+    """).fetchall())
+    assert {
+        'id': 1, 'a': decimal.Decimal('0.1'), 'b': decimal.Decimal('0.1'),
+        'c': decimal.Decimal('0.1'), 'd': 0,
+    } == uniqueness
+
+    candidate_keys = engine.execute("""
+        SELECT key_columns FROM metabase.candidate_key
+        WHERE data_table_id = 1 ORDER BY key_columns
+    """).fetchall()
+    assert [(['a', 'b'],), (['id'],)] == candidate_keys
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract_metadata.ExtractMetadata(1).process_table(
+            categorical_threshold=2, candidate_key_pairs=0)
+
+    candidate_keys = engine.execute("""
+        SELECT key_columns FROM metabase.candidate_key
+    """).fetchall()
+    assert [(['id'],)] == candidate_keys
+
+
+# Tests for validation
+# =========================================================================
+
+@pytest.fixture
+def setup_validation(setup_module, request):
+    """
+    Setup function-level fixtures for validation.
+
+    Data Table 1 has expectations on every kind of column, some of which it
+    does not meet. Data Table 2 has no expectation.
+    """
+    engine = setup_module.engine
+
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name)
+        VALUES (1, 'data.valid_table'), (2, 'data.valid_table');
+
+        CREATE TABLE data.valid_table (num INT, txt TEXT, dt DATE, code TEXT);
+
+        INSERT INTO data.valid_table
+            SELECT
+                i,
+                'x' || i,
+                DATE '2018-01-01' + i,
+                CASE WHEN i <= 6 THEN 'A' WHEN i <= 9 THEN 'B' ELSE 'Z' END
+            FROM GENERATE_SERIES(1, 10) AS i;
+
+        INSERT INTO metabase.data_dictionary (data_table_id, column_name)
+        VALUES (1, 'num'), (1, 'txt'), (1, 'dt'), (1, 'code');
+
+        INSERT INTO metabase.numeric_range (
+            data_table_id, column_name, minimum, minimum_tolerance, maximum,
+            maximum_tolerance, mean, mean_tolerance
+        )
+        VALUES
+            (1, 'num', 1, 0, 8, 1, 5, 1),
+            (1, 'txt', 0, NULL, NULL, NULL, NULL, NULL);
+
+        INSERT INTO metabase.text_range (
+            data_table_id, column_name, max_length, min_length
+        )
+        VALUES (1, 'txt', 3, 3);
+
+        INSERT INTO metabase.date_range (
+            data_table_id, column_name, max_date, max_date_range, min_date,
+            min_date_range
+        )
+        VALUES (1, 'dt', '2018-01-10', '1 day', '2018-01-05', '2 days');
+
+        INSERT INTO metabase.codebook (
+            data_table_id, column_name, code, expected_frequency,
+            expected_frequency_interval
+        )
+        VALUES
+            (1, 'code', 'A', 6, 0),
+            (1, 'code', 'B', 5, 1),
+            (1, 'code', 'C', NULL, NULL);
+    """)
+
+    def teardown_validation():
+        engine.execute("""
+            TRUNCATE TABLE metabase.data_table CASCADE;
+            DROP TABLE data.valid_table;
+        """)
+
+    request.addfinalizer(teardown_validation)
+
+
+def test_process_table_validation(setup_module, setup_validation):
+    """Statistics out of their tolerances and unexpected codes are found."""
+
+    engine = setup_module.engine
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        for data_table_id in (1, 2):
+            extract_metadata.ExtractMetadata(data_table_id).process_table(
+                categorical_threshold=3)
+
+    violations = engine.execute("""
+        SELECT
+            data_table_id, column_name, expectation, statistic, code,
+            expected, tolerance, observed
+        FROM metabase.validation_violation
+    """).fetchall()
+    assert {
+        (1, 'num', 'numeric_range', 'maximum', None, '8', '1', '10'),
+        (1, 'txt', 'numeric_range', 'minimum', None, '0', None, None),
+        (1, 'txt', 'text_range', 'min_length', None, '3', None, '2'),
+        (1, 'dt', 'date_range', 'min_date', None, '2018-01-05', '2 days',
+         '2018-01-02'),
+        (1, 'code', 'codebook', 'frequency', 'B', '5', '1', '3'),
+        (1, 'code', 'codebook', 'unexpected_code', 'Z', None, None, '1'),
+    } == set(map(tuple, violations))
+    assert 6 == len(violations)
+
+    validation_status = dict(engine.execute("""
+        SELECT data_table_id, validation_status FROM metabase.data_table
+    """).fetchall())
+    assert {1: 'rejected', 2: None} == validation_status
+
+
+def test_validate_table(setup_module, setup_validation):
+    """Tables are validated again after their expectations change."""
+
+    engine = setup_module.engine
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract_metadata.ExtractMetadata(1).process_table(
+            categorical_threshold=3)
+
+        engine.execute("""
+            UPDATE metabase.numeric_range SET maximum = 10;
+            DELETE FROM metabase.numeric_range WHERE column_name = 'txt';
+            UPDATE metabase.text_range SET min_length = 2;
+            UPDATE metabase.date_range SET min_date = '2018-01-02';
+            UPDATE metabase.codebook SET expected_frequency = 3
+                WHERE code = 'B';
+            INSERT INTO metabase.codebook (data_table_id, column_name, code)
+                VALUES (1, 'code', 'Z');
+        """)
+        assert [] == extract_metadata.validate_table(1)
+
+        assert 0 == engine.execute(
+            'SELECT COUNT(*) FROM metabase.validation_violation').scalar()
+        assert 'passed' == engine.execute("""
+            SELECT validation_status FROM metabase.data_table
+            WHERE data_table_id = 1
+        """).scalar()
+
+        engine.execute("""
+            UPDATE metabase.data_table SET validation_status = 'force_pass'
+                WHERE data_table_id = 1;
+            UPDATE metabase.numeric_range SET maximum = 5;
+        """)
+        violations = extract_metadata.validate_table(1)
+
+    assert (
+        [('num', 'numeric_range', 'maximum', None, '5', '1', '10')]
+        == violations
+    )
+    assert 'force_pass' == engine.execute("""
+        SELECT validation_status FROM metabase.data_table
+        WHERE data_table_id = 1
+    """).scalar()
+
+
+# Tests for `find_joinable_columns()`
+# =========================================================================
+
+@pytest.fixture
+def setup_joinable_tables(setup_module, request):
+    """
+    Setup function-level fixtures for `find_joinable_columns()`.
+
+    Orders reference half of the customers, with IDs of another type.
+    """
+    engine = setup_module.engine
+
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name) VALUES
+            (1, 'data.customers'),
+            (2, 'data.orders'),
+            (3, 'data.products');
+
+        CREATE TABLE data.customers (customer_id INT, name TEXT);
+        CREATE TABLE data.orders (customer_id NUMERIC(6, 2), amount INT);
+        CREATE TABLE data.products (product_name TEXT, amount INT);
+
+        INSERT INTO data.customers
+            SELECT i, 'name ' || i FROM GENERATE_SERIES(1, 400) AS i;
+        INSERT INTO data.orders
+            SELECT MOD(i, 200) + 1, i * 10 FROM GENERATE_SERIES(1, 1000) AS i;
+        INSERT INTO data.products
+            SELECT 'product ' || i, NULL FROM GENERATE_SERIES(1, 50) AS i;
+    """)
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        for data_table_id in (1, 2, 3):
+            extract = extract_metadata.ExtractMetadata(data_table_id)
+            extract.process_table(categorical_threshold=2)
+
+    def teardown_joinable_tables():
+        engine.execute("""
+            TRUNCATE TABLE metabase.data_table CASCADE;
+            DROP TABLE data.customers;
+            DROP TABLE data.orders;
+            DROP TABLE data.products;
+        """)
+
+    request.addfinalizer(teardown_joinable_tables)
+
+
+def test_find_joinable_columns(setup_module, setup_joinable_tables):
+    """Columns sharing values are found from their signatures."""
+
+    engine = setup_module.engine
+    column_ids = {
+        (data_table_id, column_name): column_id
+        for column_id, data_table_id, column_name in engine.execute("""
+            SELECT column_id, data_table_id, column_name
+            FROM metabase.column_info
+        """)
+    }
+
+    # Columns without values have no signature.
+    assert 5 == engine.execute(
+        'SELECT COUNT(*) FROM metabase.column_minhash').scalar()
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        joinable_columns = extract_metadata.find_joinable_columns(
+            column_ids[(2, 'customer_id')])
+
+        with pytest.raises(ValueError):
+            extract_metadata.find_joinable_columns(
+                column_ids[(3, 'amount')])
+
+    assert (
+        [(column_ids[(1, 'customer_id')], 1, 'customer_id')]
+        == [column[:3] for column in joinable_columns]
+    )
+    assert 0.5 == pytest.approx(joinable_columns[0].jaccard, abs=0.15)
+    assert 1 == pytest.approx(joinable_columns[0].containment, abs=0.15)
+
+
+# Tests for CSV files
+# =========================================================================
+
+CSV_ROWS = [
+    ('1', 'apple', 'M', '2018-01-01', '20180101'),
+    ('2', 'kiwi', 'F', '2018-02-01', '20180201'),
+    ('3.5', 'banana', 'F', '2018-03-02', '20180302'),
+    (None, None, None, None, None),
+    ('10', 'kiwi', 'F', '2019-12-31', '20191231'),
+    ('-4', 'fig', None, '2018-01-01', '20180101'),
+]
+
+
+@pytest.fixture
+def setup_csv_file(setup_module, request, tmpdir):
+    """
+    Setup function-level fixtures for `ExtractCsvMetadata`.
+
+    The same rows are stored in data.csv_table, Data Table 1, and in a CSV
+    file, Data Table 2.
+    """
+    engine = setup_module.engine
+
+    engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name) VALUES
+            (1, 'data.csv_table'),
+            (2, 'csv_table.csv');
+
+        CREATE TABLE data.csv_table
+            (c_num TEXT, c_text TEXT, c_code TEXT, c_date TEXT,
+             c_compact TEXT);
+    """)
+    engine.execute(
+        'INSERT INTO data.csv_table VALUES (%s, %s, %s, %s, %s)',
+        CSV_ROWS,
+    )
+
+    csv_filepath = str(tmpdir.join('csv_table.csv'))
+    with open(csv_filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['c_num', 'c_text', 'c_code', 'c_date', 'c_compact'])
+        writer.writerows(
+            ['' if value is None else value for value in row]
+            for row in CSV_ROWS
+        )
+
+    def teardown_csv_file():
+        engine.execute("""
+            TRUNCATE TABLE metabase.data_table CASCADE;
+            DROP TABLE data.csv_table;
+        """)
+
+    request.addfinalizer(teardown_csv_file)
+
+    return csv_filepath
+
+
+def select_metadata(engine, data_table_id):
+    """Select the metadata of a Data Table, without IDs and audit fields."""
+
+    queries = {
+        'data_table': """
+            SELECT number_rows, number_columns FROM metabase.data_table
+            WHERE data_table_id = %(id)s
+        """,
+        'column_info': """
+            SELECT
+                column_name, data_type, missing_count, non_null_count,
+                distinct_count, uniqueness
+            FROM metabase.column_info WHERE data_table_id = %(id)s
+        """,
+        'numeric_column': """
+            SELECT column_name, minimum, maximum, mean, median, std
+            FROM metabase.numeric_column WHERE data_table_id = %(id)s
+        """,
+        'text_column': """
+            SELECT column_name, max_length, min_length, median_length
+            FROM metabase.text_column WHERE data_table_id = %(id)s
+        """,
+        'date_column': """
+            SELECT column_name, min_date, max_date
+            FROM metabase.date_column WHERE data_table_id = %(id)s
+        """,
+        'code_frequency': """
+            SELECT column_name, code, frequency
+            FROM metabase.code_frequency WHERE data_table_id = %(id)s
+        """,
+        # Python and PostgreSQL divide bounds with different precisions.
+        'histogram_bin': """
+            SELECT
+                column_name, histogram_type, method, bin_number,
+                ROUND(lower_bound, 10), ROUND(upper_bound, 10), frequency
+            FROM metabase.histogram_bin WHERE data_table_id = %(id)s
+        """,
+        'text_top_value': """
+            SELECT column_name, rank, value, frequency, frequency_error
+            FROM metabase.text_top_value WHERE data_table_id = %(id)s
+        """,
+    }
+
+    return {
+        table_name: sorted(
+            (
+                tuple(row)
+                for row in engine.execute(query, {'id': data_table_id})
+            ),
+            key=repr,
+        )
+        for table_name, query in queries.items()
+    }
+
+
+@pytest.mark.parametrize('histogram_method', ['equi_width', 'equi_depth'])
+@pytest.mark.parametrize('compress', [False, True])
+def test_csv_file_same_metadata_as_table(
+        setup_module, setup_csv_file, histogram_method, compress):
+    """A CSV file gets the metadata of a table with the same rows."""
+
+    csv_filepath = setup_csv_file
+    if compress:
+        with open(csv_filepath, 'rb') as f:
+            data = f.read()
+        csv_filepath += '.gz'
+        with gzip.open(csv_filepath, 'wb') as f:
+            f.write(data)
+
+    options = {
+        'categorical_threshold': 2,
+        'histogram_bins': 3,
+        'histogram_method': histogram_method,
+    }
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract_metadata.ExtractMetadata(data_table_id=1).process_table(
+            **options)
+
+    conn = psycopg2.connect(setup_module.mock_params.metabase_connection_string)
+    try:
+        csv_source.ExtractCsvMetadata(
+            2,
+            csv_filepath,
+            metabase_conn=conn,
+        ).process_table(processes=2, chunk_bytes=40, **options)
+    finally:
+        conn.close()
+
+    engine = setup_module.engine
+    table_metadata = select_metadata(engine, 1)
+    csv_metadata = select_metadata(engine, 2)
+
+    assert table_metadata == csv_metadata
+    assert [
+        ('c_code', 'code'),
+        ('c_compact', 'date'),
+        ('c_date', 'date'),
+        ('c_num', 'numeric'),
+        ('c_text', 'text'),
+    ] == [row[:2] for row in csv_metadata['column_info']]
+    assert [('c_text', 1, 'kiwi', 2, 0)] == csv_metadata['text_top_value']
+
+    gmeta_cache_count = engine.execute("""
+        SELECT COUNT(*) FROM metabase.gmeta_cache WHERE data_table_id = 2
+    """).scalar()
+    assert 1 == gmeta_cache_count
+
+
+def test_csv_file_type_overrides(setup_module, setup_csv_file):
+    """Overridden columns of CSV files are converted or rejected."""
+
+    conn = psycopg2.connect(setup_module.mock_params.metabase_connection_string)
+    try:
+        extract = csv_source.ExtractCsvMetadata(2, setup_csv_file, conn)
+        extract.process_table(
+            categorical_threshold=2,
+            type_overrides={'c_num': 'text', 'c_compact': 'numeric'},
+            processes=1,
+        )
+
+        with pytest.raises(ValueError):
+            extract.process_table(type_overrides={'c_text': 'date'},
+                                  processes=1)
+    finally:
+        conn.close()
+
+    data_types = dict(setup_module.engine.execute("""
+        SELECT column_name, data_type FROM metabase.column_info
+    """).fetchall())
+    assert 'text' == data_types['c_num']
+    assert 'numeric' == data_types['c_compact']
+
+
+# Tests for SQLite files
+# =========================================================================
+
+@pytest.mark.parametrize('histogram_method', ['equi_width', 'equi_depth'])
+def test_sqlite_file_same_metadata_as_table(
+        setup_module, setup_csv_file, tmpdir, histogram_method):
+    """A table of a SQLite file gets the metadata of the same PostgreSQL table.
+    """
+    sqlite_filepath = str(tmpdir.join('data.sqlite'))
+    sqlite_conn = sqlite3.connect(sqlite_filepath)
+    with sqlite_conn:
+        sqlite_conn.execute("""
+            CREATE TABLE csv_table
+                (c_num TEXT, c_text TEXT, c_code TEXT, c_date TEXT,
+                 c_compact TEXT)
+        """)
+        sqlite_conn.executemany(
+            'INSERT INTO csv_table VALUES (?, ?, ?, ?, ?)',
+            CSV_ROWS,
+        )
+    sqlite_conn.close()
+
+    setup_module.engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name)
+        VALUES (3, 'main.csv_table');
+    """)
+
+    options = {
+        'categorical_threshold': 2,
+        'histogram_bins': 3,
+        'histogram_method': histogram_method,
+    }
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract_metadata.ExtractMetadata(data_table_id=1).process_table(
+            **options)
+        extract_metadata.ExtractMetadata(
+            data_table_id=3,
+            data_source=sqlite_source.SqliteDataSource(sqlite_filepath),
+        ).process_table(record_metrics=True, **options)
+
+    engine = setup_module.engine
+    assert select_metadata(engine, 1) == select_metadata(engine, 3)
+
+    table_size = engine.execute("""
+        SELECT size FROM metabase.data_table WHERE data_table_id = 3
+    """).scalar()
+    assert table_size > 0
+
+
+def test_sqlite_file_typed_columns(setup_module, setup_csv_file, tmpdir):
+    """Numbers stored by SQLite are numeric, and text in mixed columns."""
+
+    sqlite_filepath = str(tmpdir.join('data.sqlite'))
+    sqlite_conn = sqlite3.connect(sqlite_filepath)
+    with sqlite_conn:
+        sqlite_conn.execute(
+            'CREATE TABLE typed (c_int INTEGER, c_real REAL, c_mixed)')
+        sqlite_conn.executemany(
+            'INSERT INTO typed VALUES (?, ?, ?)',
+            [(1, 0.5, 1), (2, 1.5, 'a'), (None, 2.5, 2.5), (4, None, 'b')],
+        )
+    sqlite_conn.close()
+
+    setup_module.engine.execute("""
+        INSERT INTO metabase.data_table (data_table_id, file_table_name)
+        VALUES (3, 'main.typed');
+    """)
+
+    with patch('metabase.extract_metadata.settings', setup_module.mock_params):
+        extract_metadata.ExtractMetadata(
+            data_table_id=3,
+            data_source=sqlite_source.SqliteDataSource(sqlite_filepath),
+        ).process_table(categorical_threshold=2, histogram_bins=2)
+
+    metadata = select_metadata(setup_module.engine, 3)
+    assert [
+        ('c_int', 'numeric', 1, 3, 3, decimal.Decimal('0.75')),
+        ('c_mixed', 'text', 0, 4, 4, 1),
+        ('c_real', 'numeric', 1, 3, 3, decimal.Decimal('0.75')),
+    ] == metadata['column_info']
+    assert [
+        ('c_int', 1, 4),
+        ('c_real', 0.5, 2.5),
+    ] == [row[:3] for row in metadata['numeric_column']]
+    assert (
+        [('c_mixed', 3, 1)]
+        == [row[:3] for row in metadata['text_column']]
+    )
+
+
+def test_sqlite_files_sharing_table_name(setup_module, setup_csv_file, tmpdir):
+    """Tables of the same name in two files are two Data Tables."""
+
+    for file_name, n_rows in [('a.sqlite', 2), ('b.v2.sqlite', 3)]:
+        sqlite_conn = sqlite3.connect(str(tmpdir.join(file_name)))
+        with sqlite_conn:
+            sqlite_conn.execute('CREATE TABLE t (c_num INTEGER)')
+            sqlite_conn.executemany(
+                'INSERT INTO t VALUES (?)',
+                [(i,) for i in range(n_rows)],
+            )
+        sqlite_conn.close()
+
+    engine = setup_module.engine
+    sync_data_table_id_sequence(engine)
+
+    with patch('metabase.sqlite_source.settings', setup_module.mock_params), \
+            patch('metabase.extract_metadata.settings',
+                  setup_module.mock_params):
+        for file_name in ['a.sqlite', 'b.v2.sqlite', 'a.sqlite']:
+            sqlite_source.main([str(tmpdir.join(file_name)), '-c', '1'])
+
+    # Profiling a file again updates its Data Table.
+    assert [('a.t', 2), ('b_v2.t', 3)] == [
+        tuple(row) for row in engine.execute("""
+            SELECT file_table_name, number_rows
+            FROM metabase.data_table
+            WHERE data_table_id > 2
+            ORDER BY data_table_id
+        """).fetchall()
+    ]
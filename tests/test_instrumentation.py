@@ -0,0 +1,154 @@
+"""
+Tests for instrumentation.py
+"""
+
+import json
+import tracemalloc
+from unittest.mock import MagicMock
+
+import pytest
+
+from metabase import instrumentation
+
+
+def test_run_metrics_nested_stages():
+    """Metrics are added to every running stage and repeated stages add up."""
+
+    metrics = instrumentation.RunMetrics(1)
+
+    with metrics.stage('total'):
+        for _ in range(2):
+            with metrics.stage('update', 'col_1'):
+                metrics.add(queries_issued=1, rows_fetched=10)
+        metrics.add(queries_issued=1)
+
+    total = metrics.records[(None, 'total')]
+    update = metrics.records[('col_1', 'update')]
+
+    assert 3 == total['queries_issued']
+    assert 2 == update['queries_issued']
+    assert 20 == total['rows_fetched'] == update['rows_fetched']
+    assert total['wall_seconds'] >= update['wall_seconds'] > 0
+
+
+def test_run_metrics_disabled():
+    """A disabled run records nothing."""
+
+    metrics = instrumentation.RunMetrics(1, enabled=False)
+
+    with metrics.stage('total'):
+        metrics.add(queries_issued=1)
+
+    assert {} == metrics.records
+
+
+def test_metrics_cursor():
+    """Queries and fetched rows are reported to the running stage."""
+
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [('abc', 1), (None, 2)]
+    cursor.fetchone.return_value = None
+    cursor.statusmessage = 'SELECT 2'
+
+    metrics = instrumentation.RunMetrics(1)
+    metrics_cursor = instrumentation.MetricsCursor(cursor, metrics)
+
+    with metrics.stage('type_detection', 'col_1'):
+        metrics_cursor.execute('SELECT 1')
+        assert [('abc', 1), (None, 2)] == metrics_cursor.fetchall()
+        assert metrics_cursor.fetchone() is None
+
+    record = metrics.records[('col_1', 'type_detection')]
+    assert 1 == record['queries_issued']
+    assert 2 == record['rows_fetched']
+    assert 3 + 8 + 8 == record['bytes_fetched']
+    cursor.execute.assert_called_once_with('SELECT 1', None)
+    assert cursor.rowcount == metrics_cursor.rowcount
+
+
+def test_tracing_cursor(caplog):
+    """Every statement is logged with its database and row count."""
+
+    cursor = MagicMock()
+    cursor.query = b'SELECT   col_1\n  FROM data.table_1'
+    cursor.rowcount = 3
+
+    tracing_cursor = instrumentation.TracingCursor(cursor, 'data')
+
+    with caplog.at_level('INFO', logger='metabase.instrumentation'):
+        tracing_cursor.execute('SELECT col_1 FROM data.table_1')
+
+    trace = json.loads(caplog.records[0].getMessage())
+    assert 'data' == trace['database']
+    assert 'SELECT col_1 FROM data.table_1' == trace['statement']
+    assert 3 == trace['rowcount']
+    assert trace['error'] is None
+    assert trace['seconds'] >= 0
+
+
+def test_tracing_cursor_error(caplog):
+    """Failing statements are logged with their error and re-raised."""
+
+    cursor = MagicMock()
+    cursor.query = None
+    cursor.rowcount = -1
+    cursor.execute.side_effect = ValueError('boom')
+
+    tracing_cursor = instrumentation.TracingCursor(cursor, 'metabase')
+
+    with caplog.at_level('INFO', logger='metabase.instrumentation'):
+        with pytest.raises(ValueError):
+            tracing_cursor.execute('SELECT 1')
+
+    trace = json.loads(caplog.records[0].getMessage())
+    assert 'SELECT 1' == trace['statement']
+    assert 'boom' == trace['error']
+
+
+def test_run_metrics_profile_memory():
+    """Memory of every stage is recorded and offenders are ranked by peak."""
+
+    metrics = instrumentation.RunMetrics(1, profile_memory=True)
+
+    tracemalloc.start()
+    try:
+        with metrics.stage('total'):
+            with metrics.stage('update', 'col_small'):
+                small = [0] * 1000
+            with metrics.stage('update', 'col_large'):
+                large = [0] * 1000000
+    finally:
+        tracemalloc.stop()
+    del small, large
+
+    total = metrics.records[(None, 'total')]
+    small_record = metrics.records[('col_small', 'update')]
+    large_record = metrics.records[('col_large', 'update')]
+
+    assert large_record['peak_traced_bytes'] >= 8 * 1000000
+    assert (large_record['peak_traced_bytes']
+            > small_record['peak_traced_bytes'])
+    assert total['peak_traced_bytes'] >= large_record['peak_traced_bytes']
+
+    top = metrics.top_memory_stages(n=1)
+    assert [('col_large', 'update')] == [(c, s) for c, s, _ in top]
+    assert 'col_large' in instrumentation.format_memory_report(top)
+
+
+def test_metrics_cursor_rows_written():
+    """Rows written are counted from the status of data changing statements."""
+
+    cursor = MagicMock()
+    cursor.statusmessage = 'INSERT 0 3'
+    cursor.rowcount = 3
+
+    metrics = instrumentation.RunMetrics(1)
+    metrics_cursor = instrumentation.MetricsCursor(cursor, metrics)
+
+    with metrics.stage('update', 'col_1'):
+        metrics_cursor.execute('INSERT INTO t VALUES (1), (2), (3)')
+        cursor.statusmessage = 'SELECT 5'
+        cursor.rowcount = 5
+        metrics_cursor.execute('SELECT * FROM t')
+
+    assert 3 == metrics.records[('col_1', 'update')]['rows_written']
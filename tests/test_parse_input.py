@@ -101,3 +101,20 @@ def test_derive_full_table_name_command_file():
     full_table = parse_input.derive_full_table_name(a)
 
     assert 'schema_1.table_1' == full_table
+
+
+def test_parse_command_line_args_daemon():
+    """Test the default and overridden daemon options."""
+
+    parsed_args = parse_input.parse_command_line_args(
+        ['-s', 'schema_1', '-t', 'table_1'])
+
+    assert parsed_args.daemon_socket is not None
+    assert not parsed_args.no_daemon
+
+    parsed_args = parse_input.parse_command_line_args(
+        ['-s', 'schema_1', '-t', 'table_1', '--daemon_socket', '/tmp/x.sock',
+         '--no_daemon'])
+
+    assert '/tmp/x.sock' == parsed_args.daemon_socket
+    assert parsed_args.no_daemon
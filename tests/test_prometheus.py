@@ -0,0 +1,70 @@
+"""
+Tests for prometheus.py
+"""
+
+import os
+
+from metabase import instrumentation
+from metabase import prometheus
+
+
+def get_run_metrics():
+    metrics = instrumentation.RunMetrics(7)
+    with metrics.stage('total'):
+        for col_name, wall_seconds in [('col_1', 0.02), ('col_2', 2)]:
+            with metrics.stage('update', col_name):
+                metrics.add(rows_written=3)
+            metrics.records[(col_name, 'update')]['wall_seconds'] = (
+                wall_seconds)
+    metrics.rows_scanned = 100
+    metrics.column_types.update(['numeric', 'code'])
+
+    return metrics
+
+
+def test_format_run_metrics():
+    """Run level values and stage duration histograms are formatted."""
+
+    text = prometheus.format_run_metrics(
+        get_run_metrics(),
+        failed=False,
+        timestamp=1559000000.0,
+    )
+    lines = text.splitlines()
+
+    assert text.endswith('\n')
+    assert 'metabase_extract_last_run_timestamp_seconds 1559000000.0' in lines
+    assert 'metabase_extract_last_run_data_table_id 7' in lines
+    assert 'metabase_extract_last_run_failed 0' in lines
+    assert 'metabase_extract_tables_processed 1' in lines
+    assert 'metabase_extract_columns{type="code"} 1' in lines
+    assert 'metabase_extract_columns{type="numeric"} 1' in lines
+    assert 'metabase_extract_rows_scanned 100' in lines
+    assert 'metabase_extract_rows_written 6' in lines
+    assert '# TYPE metabase_extract_stage_duration_seconds histogram' in lines
+    assert ('metabase_extract_stage_duration_seconds_bucket'
+            '{stage="update",le="0.05"} 1') in lines
+    assert ('metabase_extract_stage_duration_seconds_bucket'
+            '{stage="update",le="+Inf"} 2') in lines
+    assert ('metabase_extract_stage_duration_seconds_count'
+            '{stage="update"} 2') in lines
+    assert 'stage="total"' not in text
+
+
+def test_write_textfile(tmpdir):
+    """The file is readable by node_exporter and no temporary file is left."""
+
+    umask = os.umask(0o022)
+    try:
+        prometheus.write_textfile(str(tmpdir), get_run_metrics(), failed=True)
+    finally:
+        os.umask(umask)
+
+    filepath = str(tmpdir.join(prometheus.TEXTFILE_NAME))
+    with open(filepath) as f:
+        lines = f.read().splitlines()
+
+    assert 'metabase_extract_last_run_failed 1' in lines
+    assert 'metabase_extract_tables_processed 0' in lines
+    assert 0o644 == os.stat(filepath).st_mode & 0o777
+    assert [prometheus.TEXTFILE_NAME] == os.listdir(str(tmpdir))
@@ -0,0 +1,122 @@
+"""
+Tests for sketches.py
+"""
+
+from collections import Counter
+import random
+
+import pytest
+
+from metabase import sketches
+
+
+def test_space_saving_exact_within_capacity():
+    """Frequencies are exact if no tracked value is replaced."""
+
+    summary = sketches.SpaceSaving(capacity=3)
+    summary.update(['a', 'b', None, 'a', 'c', 'a', 'b'])
+
+    assert 6 == summary.total
+    assert [('a', 3, 0), ('b', 2, 0)] == summary.top_k(2)
+    assert [('a', 3, 0), ('b', 2, 0)] == summary.top_k(5, min_frequency=2)
+
+
+def test_space_saving_error_bounds(monkeypatch):
+    """Heavy hitters are tracked and frequencies are within their error."""
+
+    # Several batches, so that counts of batches are merged.
+    monkeypatch.setattr(sketches, 'BATCH_SIZE', 1000)
+
+    rng = random.Random(0)
+    values = (
+        ['heavy_{}'.format(i) for i in range(5) for _ in range(500 * (i + 1))]
+        + ['rare_{}'.format(i) for i in range(20000)]
+    )
+    rng.shuffle(values)
+    frequencies = Counter(values)
+
+    capacity = 100
+    summary = sketches.SpaceSaving(capacity)
+    summary.update(values)
+
+    top_values = summary.top_k(5)
+    assert (['heavy_{}'.format(i) for i in reversed(range(5))]
+            == [top_value.value for top_value in top_values])
+
+    for value, count in summary.counts.items():
+        error = summary.errors[value]
+        assert count - error <= frequencies[value] <= count
+        assert error <= len(values) / capacity
+
+    assert capacity == len(summary.counts)
+
+
+def test_space_saving_min_frequency():
+    """Values that might occur once are left out of a stream of uniques."""
+
+    summary = sketches.SpaceSaving(capacity=10)
+    summary.update(str(i) for i in range(1000))
+
+    assert [] == summary.top_k(10, min_frequency=2)
+    assert 10 == len(summary.top_k(10))
+
+    with pytest.raises(ValueError):
+        sketches.SpaceSaving(capacity=0)
+
+
+def test_space_saving_heap_stays_bounded():
+    """Updates of tracked values do not grow the heap past its limit."""
+
+    summary = sketches.SpaceSaving(capacity=10)
+    summary.update(str(i) for i in range(20))
+    summary.add_counts(Counter({'tracked': 1}))
+    tracked = list(summary.counts)
+
+    for _ in range(1000):
+        summary.add_counts(Counter(tracked))
+        assert len(summary.heap) <= 4 * summary.capacity
+
+    assert 20 + 1 + 1000 * summary.capacity == summary.total
+
+
+def test_minhash_estimates_jaccard():
+    """Signatures of overlapping sets estimate their Jaccard similarity."""
+
+    values = ['value {}'.format(i) for i in range(3000)]
+
+    minhash = sketches.MinHash(256)
+    minhash.update(values[:2000])
+    other_minhash = sketches.MinHash(256)
+    # Repeated values and order leave the signature unchanged.
+    other_minhash.update(reversed(values[1000:] + values[1000:]))
+
+    jaccard = sketches.estimate_jaccard(
+        minhash.signature,
+        sketches.signature_from_bytes(other_minhash.to_bytes()),
+    )
+    assert 1 / 3 == pytest.approx(jaccard, abs=0.1)
+    assert 0.5 == pytest.approx(
+        sketches.estimate_containment(jaccard, 2000, 2000), abs=0.1)
+    assert 1 == sketches.estimate_containment(1.0, 10, 1000)
+
+    with pytest.raises(ValueError):
+        sketches.estimate_jaccard(minhash.signature, minhash.signature[:10])
+
+
+def test_get_band_hashes():
+    """Band hashes match for equal bands only, whatever their position."""
+
+    signature = [1, 2, 1, 2, 3, 4]
+    other_signature = [1, 2, 5, 6, 3, 4]
+
+    band_hashes = sketches.get_band_hashes(signature, 3)
+    other_band_hashes = sketches.get_band_hashes(other_signature, 3)
+
+    assert 3 == len(set(band_hashes))
+    assert [True, False, True] == [
+        band_hash == other_band_hash
+        for band_hash, other_band_hash in zip(band_hashes, other_band_hashes)
+    ]
+
+    with pytest.raises(ValueError):
+        sketches.get_band_hashes(signature, 4)
@@ -0,0 +1,72 @@
+"""
+Tests for sqlite_source.py
+"""
+
+import collections
+import os
+import sqlite3
+
+import pytest
+
+from metabase import sqlite_source
+
+
+@pytest.mark.parametrize('declared_type,expected', [
+    ('INTEGER', 'bigint'),
+    ('unsigned big int', 'bigint'),
+    ('VARCHAR(10)', 'text'),
+    ('DOUBLE PRECISION', 'double precision'),
+    ('DATE', 'text'),
+    ('', 'text'),
+])
+def test_get_catalog_type(declared_type, expected):
+    """Catalog types follow the type affinity of SQLite."""
+
+    assert expected == sqlite_source.get_catalog_type(declared_type)
+
+
+def test_sqlite_data_source(tmpdir):
+    """Tables are read in place and values counted as stored."""
+
+    filepath = str(tmpdir.join('data.sqlite'))
+    conn = sqlite3.connect(filepath)
+    with conn:
+        conn.execute('CREATE TABLE t ("a b" TEXT COLLATE NOCASE, c INTEGER)')
+        conn.executemany(
+            'INSERT INTO t VALUES (?, ?)',
+            [('x', 1), ('X', 1), ('x', None)],
+        )
+    conn.close()
+
+    source = sqlite_source.SqliteDataSource(filepath)
+    try:
+        n_rows, n_cols, table_size = source.get_table_level_metadata(
+            'main', 't')
+        assert (3, 2) == (n_rows, n_cols)
+        assert 0 < table_size <= os.path.getsize(filepath)
+
+        assert (
+            [('a b', 'text'), ('c', 'bigint')]
+            == source.get_columns('main', 't')
+        )
+        assert (
+            collections.Counter({'x': 2, 'X': 1})
+            == source.count_values('a b', 'main', 't')
+        )
+        assert (
+            collections.Counter({1: 2, None: 1})
+            == source.count_values('c', 'main', 't')
+        )
+        assert (
+            [[('x', 1), ('X', 1)], [('x', None)]]
+            == list(source.iter_row_batches(['a b', 'c'], 'main', 't', 2))
+        )
+
+        with pytest.raises(sqlite3.OperationalError):
+            source.conn.execute('DELETE FROM t')
+    finally:
+        source.close()
+
+    with pytest.raises(sqlite3.OperationalError):
+        sqlite_source.SqliteDataSource(str(tmpdir.join('missing.sqlite')))
+    assert not tmpdir.join('missing.sqlite').exists()